@@ -1,100 +1,253 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-import mysql.connector
-from flask_bcrypt import Bcrypt
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response
+import functools
+import hmac
+import io
 import os
 from datetime import datetime
 from calendar import monthrange
-
-app = Flask(__name__)
+from decimal import Decimal
+
+import click
+
+import budgeting
+import bulk
+import cache
+import analytics
+import categorize
+import db
+import export
+import fx
+import hashing
+import http_cache
+import importer
+import ingest
+import instrumentation
+import ledger
+import migrations
+import partitions
+import recurring
+import repositories
+import search
+import sessions
+import summary
+from pagination import decode_cursor, page_size
+from repositories import get_repos
+
+app = Flask(__name__, template_folder='Templates')
 app.secret_key = os.environ.get('SECRET_KEY', 'a_very_secret_key')
-bcrypt = Bcrypt(app)
 
 db_config = {
-    'host': 'localhost',
-    'user': 'root',
-    'password': '365Pass',
-    'database': 'personal_finance_tracker'
+    'host': os.environ.get('DB_HOST', 'localhost'),
+    'user': os.environ.get('DB_USER', 'root'),
+    'password': os.environ.get('DB_PASSWORD', '365Pass'),
+    'database': os.environ.get('DB_NAME', 'personal_finance_tracker')
 }
 
-
-def create_tables():
-    connection = None
-    try:
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor()
-
-        # Create the users table first, as other tables depend on it
-        create_users_table_query = """
-        CREATE TABLE IF NOT EXISTS users ( 
-        id INT AUTO_INCREMENT PRIMARY KEY, 
-        username VARCHAR(250) NOT NULL UNIQUE,
-        password VARCHAR(250) NOT NULL
-        )
-        """
-        cursor.execute(create_users_table_query)
-        print("✅ Users table ensured to exist.")
-
-        # Create the categories table, which depends on the users table
-        create_categories_table_query = """
-        CREATE TABLE IF NOT EXISTS categories (
-            category_id INT AUTO_INCREMENT PRIMARY KEY,
-            name VARCHAR(250) NOT NULL,
-            user_id INT,
-            createdBy INT NOT NULL,
-            createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            modifiedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id),
-            FOREIGN KEY (createdBy) REFERENCES users(id)
-        );
-        """
-        cursor.execute(create_categories_table_query)
-        print("✅ Categories table ensured to exist.")
-
-        # Create the transactions table
-        create_transactions_table_query = """
-        CREATE TABLE IF NOT EXISTS transactions (
-            transaction_id INT AUTO_INCREMENT PRIMARY KEY,
-            user_id INT NOT NULL,
-            amount DECIMAL(10,2) NOT NULL,
-            type ENUM('income','expense') NOT NULL,
-            category_id INT,
-            description VARCHAR(300) NOT NULL,
-            transaction_date DATE NOT NULL,
-            createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            modifiedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id),
-            FOREIGN KEY (category_id) REFERENCES categories(category_id)
-        );
-        """
-        cursor.execute(create_transactions_table_query)
-        print("✅ Transactions table ensured to exist.")
-
-        # Create the budgets table
-        create_budgets_table_query = """
-        CREATE TABLE IF NOT EXISTS budgets (
-            budget_id INT AUTO_INCREMENT PRIMARY KEY,
-            user_id INT NOT NULL,
-            category_id INT NOT NULL,
-            amount DECIMAL(10, 2) NOT NULL,
-            start_date DATE NOT NULL,
-            end_date DATE NOT NULL,
-            createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            modifiedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id),
-            FOREIGN KEY (category_id) REFERENCES categories(category_id)
-        );
-        """
-        cursor.execute(create_budgets_table_query)
-        print("✅ Budgets table ensured to exist.")
-
-        connection.commit()
-        print("✅ All tables created successfully.")
-    except mysql.connector.Error as err:
-        print(f"⚠️ Error creating tables: {err}")
-    finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
+app.config.update(
+    DB_BACKEND=os.environ.get('DB_BACKEND', 'mysql'),
+    SQLITE_PATH=os.environ.get('SQLITE_PATH', 'finance_tracker.sqlite3'),
+    DB_POOL_SIZE=int(os.environ.get('DB_POOL_SIZE', 5)),
+    DB_POOL_MAX_OVERFLOW=int(os.environ.get('DB_POOL_MAX_OVERFLOW', 10)),
+    DB_POOL_TIMEOUT=float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+    DB_POOL_CHECK_INTERVAL=float(os.environ.get('DB_POOL_CHECK_INTERVAL', 30)),
+    DB_POOL_RECYCLE=float(os.environ.get('DB_POOL_RECYCLE', 3600)),
+    IMPORT_BATCH_SIZE=int(os.environ.get('IMPORT_BATCH_SIZE', importer.DEFAULT_BATCH_SIZE)),
+    IMPORT_CHUNK_SIZE=int(os.environ.get('IMPORT_CHUNK_SIZE', importer.DEFAULT_CHUNK_SIZE)),
+    FULLTEXT_MIN_TOKEN_SIZE=int(os.environ.get('FULLTEXT_MIN_TOKEN_SIZE', search.MIN_TOKEN_SIZE)),
+    CACHE_TTL=float(os.environ.get('CACHE_TTL', 300)),
+    CACHE_LOCAL_TTL=float(os.environ.get('CACHE_LOCAL_TTL', 5)),
+    CACHE_MAX_ENTRIES=int(os.environ.get('CACHE_MAX_ENTRIES', 2048)),
+    CACHE_REDIS_URL=os.environ.get('CACHE_REDIS_URL'),
+    # Set when the app runs as one process, so per-process caches stay coherent without Redis
+    CACHE_SINGLE_PROCESS=os.environ.get('CACHE_SINGLE_PROCESS', '') == '1',
+    BCRYPT_LOG_ROUNDS=int(os.environ.get('BCRYPT_LOG_ROUNDS', 12)),
+    HASH_WORKERS=int(os.environ['HASH_WORKERS']) if os.environ.get('HASH_WORKERS') else None,
+    HASH_MAX_QUEUE=int(os.environ.get('HASH_MAX_QUEUE', 4)),
+    HASH_TIMEOUT=float(os.environ.get('HASH_TIMEOUT', 10)),
+    HASH_USE_PROCESSES=os.environ.get('HASH_USE_PROCESSES', '') == '1',
+    SLOW_QUERY_THRESHOLD_MS=float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 200)),
+    # Server-Timing headers name and time each request's queries; for profiling only
+    SERVER_TIMING=os.environ.get('SERVER_TIMING', '') == '1',
+    ASYNC_DB_POOL_MIN=int(os.environ.get('ASYNC_DB_POOL_MIN', 1)),
+    ASYNC_DB_POOL_MAX=int(os.environ.get('ASYNC_DB_POOL_MAX', 20)),
+    TRANSACTIONS_PARTITION_UNIT=os.environ.get('TRANSACTIONS_PARTITION_UNIT', 'year'),
+    TRANSACTIONS_PARTITIONS_AHEAD=int(os.environ.get('TRANSACTIONS_PARTITIONS_AHEAD', partitions.DEFAULT_AHEAD)),
+    RECURRING_INTERVAL=float(os.environ.get('RECURRING_INTERVAL', 3600)),
+    RECURRING_BATCH_SIZE=int(os.environ.get('RECURRING_BATCH_SIZE', recurring.DEFAULT_BATCH_SIZE)),
+    SESSION_BACKEND=os.environ.get('SESSION_BACKEND', 'file'),
+    SESSION_DIR=os.environ.get('SESSION_DIR'),
+    SESSION_MAX_ENTRIES=int(os.environ.get('SESSION_MAX_ENTRIES', 10000)),
+    INGEST_MODE=os.environ.get('INGEST_MODE', 'direct'),
+    INGEST_JOURNAL=os.environ.get('INGEST_JOURNAL', 'finance_tracker_ingest.sqlite3'),
+    INGEST_BATCH_SIZE=int(os.environ.get('INGEST_BATCH_SIZE', ingest.DEFAULT_BATCH_SIZE)),
+    INGEST_INTERVAL=float(os.environ.get('INGEST_INTERVAL', 0.5)),
+    INGEST_RETRY_DELAY=float(os.environ.get('INGEST_RETRY_DELAY', 1)),
+    INGEST_MAX_RETRY_DELAY=float(os.environ.get('INGEST_MAX_RETRY_DELAY', 60)),
+    LEDGER_MAX_BYTES=int(os.environ.get('LEDGER_MAX_BYTES', ledger.DEFAULT_MAX_BYTES)),
+    LEDGER_TTL=float(os.environ.get('LEDGER_TTL', 300)),
+    DEFAULT_CURRENCY=os.environ.get('DEFAULT_CURRENCY', fx.DEFAULT_CURRENCY),
+    REPORTING_CURRENCY=os.environ.get('REPORTING_CURRENCY', os.environ.get('DEFAULT_CURRENCY', fx.DEFAULT_CURRENCY)),
+    FX_BASE_CURRENCY=os.environ.get('FX_BASE_CURRENCY', fx.DEFAULT_BASE),
+    FX_CHECK_INTERVAL=float(os.environ.get('FX_CHECK_INTERVAL', 5)),
+    CATEGORIZE_MAX_MATCHERS=int(os.environ.get('CATEGORIZE_MAX_MATCHERS', 1000)),
+    # Bearer token for the metrics endpoints; without one they are local-only
+    METRICS_TOKEN=os.environ.get('METRICS_TOKEN', ''),
+)
+db.init_app(app, db_config)
+instrumentation.init_app(app, db.pool)
+cache.init_app(app)
+hashing.init_app(app)
+http_cache.init_app(app)
+migrations.init_app(app, db.pool)
+fx.init_app(app, db.pool)
+sessions.init_app(app)
+ledger.init_app(app)
+categorize.init_app(app)
+
+
+def user_categories(user_id):
+    # Kept in the session too, tagged with the user's profile version, so
+    # most pages find them without even a cache lookup. Only when the cache
+    # is coherent: otherwise the version changes on every call, and each
+    # page would rewrite the session for nothing.
+    def load():
+        return get_repos().categories.for_user(user_id)
+    if not cache.user_cache.coherent:
+        return cache.user_cache.get_or_load(user_id, 'categories', load)
+    version = cache.user_cache.version(user_id, 'profile')
+    categories = sessions.cached('categories', version)
+    if categories is None:
+        categories = sessions.remember('categories', version,
+                                       cache.user_cache.get_or_load(user_id, 'categories', load))
+    return categories
+
+
+def session_username(user_id):
+    # Stored at login; sessions from before that only look it up once
+    username = session.get('username')
+    if username is None:
+        username = get_repos().users.username(user_id)
+        if username is not None:
+            session['username'] = username
+    return username
+
+
+def user_ledger(user_id):
+    """The user's in-memory ledger, loaded on first use, or None when ledgers are off."""
+    if ledger.ledgers is None:
+        return None
+    return ledger.ledgers.get(user_id, lambda version: get_repos().transactions.ledger(user_id, version))
+
+
+def category_names(categories):
+    return {category['category_id']: category['name'] for category in categories}
+
+
+def user_totals(user_id, currency):
+    # In `currency`, or with amounts added up as stored when it is None
+    book = user_ledger(user_id)
+    if book is None:
+        return get_repos().transactions.totals(user_id, currency)
+    return book.totals(category_names(user_categories(user_id)), currency)
+
+
+def user_budgets(user_id):
+    book = user_ledger(user_id)
+    if book is not None:
+        # Spend is summed from the ledger; only the budgets themselves are cached
+        def load_definitions():
+            return get_repos().budgets.definitions(user_id)
+        definitions = cache.user_cache.get_or_load(user_id, 'budget_definitions', load_definitions)
+        return budgeting.progress(book.budget_spend(definitions))
+
+    # Cached rows carry each budget's actual spend, so transaction writes
+    # invalidate them as well as budget writes. Spend in other currencies
+    # is cached unconverted and converted at the current rates.
+    def load():
+        return get_repos().budgets.spend_rows(user_id)
+    rows, foreign = cache.user_cache.get_or_load(user_id, 'budgets', load)
+    return budgeting.progress(budgeting.add_foreign_spend(rows, foreign))
+
+
+def user_recurring(user_id):
+    def load():
+        return get_repos().recurring.for_user(user_id)
+    return cache.user_cache.get_or_load(user_id, 'recurring', load)
+
+
+def user_rules(user_id):
+    def load():
+        return get_repos().rules.for_user(user_id)
+    return cache.user_cache.get_or_load(user_id, 'rules', load)
+
+
+def user_matcher(user_id):
+    """The user's categorization rules compiled into a categorize.Matcher."""
+    return categorize.matchers.get(user_id, lambda: user_rules(user_id))
+
+
+def transactions_changed(user_id, old=None, new=None):
+    # Budget spend and analytics series are derived from transactions.
+    # A single-row change (old and/or new row) is applied to the resident
+    # ledger; anything else drops it to be reloaded.
+    cache.user_cache.invalidate(user_id, 'budgets', 'analytics', 'data')
+    if ledger.ledgers is None:
+        return
+    if old is None and new is None:
+        ledger.ledgers.invalidate(user_id)
+    else:
+        ledger.ledgers.record(user_id, old, new)
+
+
+def budgets_changed(user_id):
+    cache.user_cache.invalidate(user_id, 'budgets', 'budget_definitions', 'data')
+
+
+def categories_changed(user_id):
+    # 'profile' versions the copies kept in sessions
+    cache.user_cache.invalidate(user_id, 'categories', 'profile', 'data')
+
+
+def rules_changed(user_id):
+    # 'matcher' versions the user's compiled matcher
+    cache.user_cache.invalidate(user_id, 'rules', 'matcher', 'data')
+
+
+# Started here rather than with the other extensions so that postings by
+# the scheduler and the ingestion writer invalidate the same cached reads
+# as the write routes.
+recurring.init_app(app, db.pool, on_posted=transactions_changed)
+ingest.init_app(app, db.pool, on_written=transactions_changed)
+
+
+def api_view(resource):
+    # JSON endpoints revalidated against the user's data version, which every
+    # write route bumps, and the rates version, which `flask fx import` bumps;
+    # a matching If-None-Match is answered without loading anything.
+    # Only when the cache is coherent: a per-process version would keep
+    # answering 304 after a write in another worker.
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if 'user_id' not in session:
+                return jsonify({'error': "Not logged in."}), 401
+            user_id = session['user_id']
+            etag = None
+            try:
+                if cache.user_cache.coherent:
+                    # Totals and budgets are converted, so a rates import changes them too
+                    version = f"{cache.user_cache.version(user_id, 'data')}:{fx.version()}"
+                    etag = http_cache.etag_for(user_id, version, resource)
+                    response = http_cache.not_modified(etag)
+                    if response is not None:
+                        return response
+                payload = view(user_id, *args, **kwargs)
+            except db.Error as err:
+                print(f"Database error: {err}")
+                return jsonify({'error': f"Failed to load {resource}."}), 500
+            return http_cache.json_response(payload, etag)
+        return wrapper
+    return decorator
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -103,15 +256,13 @@ def login():
         username = request.form['username']
         password = request.form['password']
 
-        connection = None
         try:
-            connection = mysql.connector.connect(**db_config)
-            cursor = connection.cursor(dictionary=True)
-            query = "SELECT * FROM users WHERE username = %s"
-            cursor.execute(query, (username,))
-            user = cursor.fetchone()
-            if user and bcrypt.check_password_hash(user['password'], password):
+            user = get_repos().users.by_username(username)
+            if user and hashing.hasher.check(user['password'], password):
+                # A fresh session id at login, so one planted beforehand can't be reused
+                sessions.regenerate()
                 session['user_id'] = user['id']
+                session['username'] = user['username']
                 print(f"Login successful for user: {username}")
                 flash("Login successful!", "success")
                 return redirect(url_for('dashboard'))
@@ -119,14 +270,14 @@ def login():
                 print(f"Login failed for user: {username}")
                 flash("Invalid username or password.", "danger")
                 return redirect(url_for('login'))
-        except mysql.connector.Error as err:
+        except hashing.HasherBusy as err:
+            print(f"Login rejected for user {username}: {err}")
+            flash("The server is busy. Please try again in a moment.", "danger")
+            return render_template('login.html'), 503
+        except db.Error as err:
             print(f"Database error: {err}")
             flash("Database connection error.", "danger")
             return redirect(url_for('login'))
-        finally:
-            if connection and connection.is_connected():
-                cursor.close()
-                connection.close()
     return render_template('login.html')
 
 
@@ -135,28 +286,26 @@ def register():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
-        connection = None
         try:
-            connection = mysql.connector.connect(**db_config)
-            cursor = connection.cursor()
-            query = "INSERT INTO users (username, password) VALUES (%s, %s)"
-            cursor.execute(query, (username, hashed_password))
-            connection.commit()
+            hashed_password = hashing.hasher.generate(password)
+        except hashing.HasherBusy as err:
+            print(f"Registration rejected for user {username}: {err}")
+            flash("The server is busy. Please try again in a moment.", "danger")
+            return render_template('register.html'), 503
+        try:
+            repos = get_repos()
+            repos.users.create(username, hashed_password)
+            repos.commit()
             print(f"Registration successful for user: {username}")
             flash("You have successfully registered! Please log in.", "success")
-        except mysql.connector.Error as err:
-            if err.errno == mysql.connector.errorcode.ER_DUP_ENTRY:
-                print(f"Registration failed: username '{username}' already exists.")
-                flash("Username already exists. Please choose a different one.", "danger")
-            else:
-                print(f"Database error: {err}")
-                flash("Database connection error.", "danger")
+        except db.IntegrityError:
+            print(f"Registration failed: username '{username}' already exists.")
+            flash("Username already exists. Please choose a different one.", "danger")
+            return redirect(url_for('register'))
+        except db.Error as err:
+            print(f"Database error: {err}")
+            flash("Database connection error.", "danger")
             return redirect(url_for('register'))
-        finally:
-            if connection and connection.is_connected():
-                cursor.close()
-                connection.close()
         return redirect(url_for('login'))
     return render_template('register.html')
 
@@ -166,94 +315,69 @@ def dashboard():
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    connection = None
     transactions = []
     categories = []
-    total_income = 0
-    total_expenses = 0
+    total_income = Decimal('0')
+    total_expenses = Decimal('0')
     budgets = []
+    recurring_rules = []
     spent_per_category = {}
+    next_cursor = prev_cursor = None
+    reporting_currency = app.config['REPORTING_CURRENCY']
+    currencies = [fx.DEFAULT_CURRENCY]
 
     search_query = request.args.get('q', '')
+    before = decode_cursor(request.args.get('before'))
+    after = decode_cursor(request.args.get('after'))
+    limit = page_size(request.args.get('per_page'))
 
     try:
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor(dictionary=True)
-        query = "SELECT username FROM users WHERE id = %s"
-        cursor.execute(query, (session['user_id'],))
-        user = cursor.fetchone()
-        username = user['username'] if user else 'Guest'
-
-        query_categories = "SELECT category_id, name FROM categories WHERE user_id = %s"
-        cursor.execute(query_categories, (session['user_id'],))
-        categories = cursor.fetchall()
-
-        base_query_transactions = """
-        SELECT 
-            t.*, c.name AS category_name
-        FROM 
-            transactions t
-        LEFT JOIN 
-            categories c ON t.category_id = c.category_id
-        WHERE 
-            t.user_id = %s
-        """
-        params = [session['user_id']]
-
-        if search_query:
-            base_query_transactions += """
-            AND (t.description LIKE %s OR c.name LIKE %s)
-            """
-            search_pattern = f"%{search_query}%"
-            params.append(search_pattern)
-            params.append(search_pattern)
-
-        base_query_transactions += " ORDER BY t.transaction_date DESC;"
-
-        cursor.execute(base_query_transactions, tuple(params))
-        transactions = cursor.fetchall()
-
-        # --- CHANGES START HERE ---
-        # Calculate spending per category
-        for transaction in transactions:
-            if transaction['type'] == 'expense' and transaction['category_name']:
-                category_name = transaction['category_name']
-                amount = float(transaction['amount'])
-                spent_per_category[category_name] = spent_per_category.get(category_name, 0) + amount
-        # --- CHANGES END HERE ---
-
-        # Total income
-        query_income = "SELECT SUM(amount) AS total FROM transactions WHERE user_id = %s AND type = 'income'"
-        cursor.execute(query_income, (session['user_id'],))
-        total_income = cursor.fetchone()['total'] or 0
-
-        #  Total expenses
-        query_expenses = "SELECT SUM(amount) AS total FROM transactions WHERE user_id = %s AND type = 'expense'"
-        cursor.execute(query_expenses, (session['user_id'],))
-        total_expenses = cursor.fetchone()['total'] or 0
+        repos = get_repos()
+        username = session_username(session['user_id']) or 'Guest'
 
-        # Get budgets
-        query_budgets = """
-        SELECT b.*, c.name AS category_name
-        FROM budgets b
-        JOIN categories c ON b.category_id = c.category_id
-        WHERE b.user_id = %s
-        """
-        cursor.execute(query_budgets, (session['user_id'],))
-        budgets = cursor.fetchall()
+        categories = user_categories(session['user_id'])
+
+        book = user_ledger(session['user_id'])
+        if book is not None and not search_query:
+            # A date-range scan of the user's in-memory ledger
+            transactions, next_cursor, prev_cursor = book.page(before, after, limit, category_names(categories))
+        else:
+            transactions, next_cursor, prev_cursor = repos.transactions.page(session['user_id'], search_query,
+                                                                             before, after, limit)
 
+        # Totals and spending per category, from the ledger or the per-month rollup,
+        # plus queued transactions not written yet, in the reporting currency
+        first_page = not (search_query or before or after)
+        try:
+            totals = user_totals(session['user_id'], reporting_currency)
+            entries = ingest.unwritten(db.get_cursor(dictionary=True), session['user_id'])
+            merged = ingest.merge_pending(entries, transactions, totals, categories, first_page,
+                                          currency=reporting_currency)
+        except fx.MissingRate as err:
+            print(f"Exchange rate error: {err}")
+            flash(f"{err} Totals add up amounts in different currencies.", "warning")
+            reporting_currency = None
+            totals = user_totals(session['user_id'], None)
+            entries = ingest.unwritten(db.get_cursor(dictionary=True), session['user_id'])
+            merged = ingest.merge_pending(entries, transactions, totals, categories, first_page)
+        transactions, (total_income, total_expenses, spent_per_category) = merged
 
-    except mysql.connector.Error as err:
+        # Get budgets
+        try:
+            budgets = user_budgets(session['user_id'])
+        except fx.MissingRate as err:
+            print(f"Exchange rate error: {err}")
+            flash(f"{err} Budgets can't be shown until rates are imported.", "warning")
+        recurring_rules = user_recurring(session['user_id'])
+        currencies = fx.currencies()
+
+    except db.Error as err:
         print(f"Database error: {err}")
         username = 'Guest'
-    finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
 
     total_balance = total_income - total_expenses
 
-    return render_template('dashboard.html',
+    return render_template('Dashboard.html',
                            username=username,
                            transactions=transactions,
                            categories=categories,
@@ -262,7 +386,13 @@ def dashboard():
                            total_balance=total_balance,
                            search_query=search_query,
                            budgets=budgets,
-                           spent_per_category=spent_per_category)
+                           recurring_rules=recurring_rules,
+                           spent_per_category=spent_per_category,
+                           next_cursor=next_cursor,
+                           prev_cursor=prev_cursor,
+                           per_page=limit,
+                           reporting_currency=reporting_currency,
+                           currencies=currencies)
 
 
 @app.route('/add_transaction', methods=['POST'])
@@ -274,86 +404,242 @@ def add_transaction():
         amount = float(request.form['amount'])
         transaction_type = request.form['type']
         description = request.form['description']
-        transaction_date = request.form['transaction_date']
+        # Parsed before any write, so the rollup and the ledger get a real date
+        transaction_date = datetime.strptime(request.form['transaction_date'], '%Y-%m-%d').date()
         category_id_str = request.form['category_id']
+        currency = fx.check_code(request.form.get('currency') or fx.DEFAULT_CURRENCY)
 
         # Convert empty string to None for database NULL
         category_id = int(category_id_str) if category_id_str else None
 
-        if not description or not transaction_date:
+        if not description:
             raise ValueError("All fields must be filled.")
     except (KeyError, ValueError) as e:
         print(f"Form data error: {e}")
         flash("Invalid form data. Please fill all fields correctly.", "danger")
         return redirect(url_for('dashboard'))
 
-    connection = None
-    try:
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor()
-
-        query = """
-        INSERT INTO transactions (user_id, amount, type, category_id, description, transaction_date)
-        VALUES (%s, %s, %s, %s, %s, %s)
-        """
+    if app.config['INGEST_MODE'] == 'queue':
+        # Acknowledged once journaled; the ingestion writer posts it shortly
+        try:
+            fx.require_rates(currency)
+            if category_id is None:
+                category_id = user_matcher(user_id).match(description, amount, transaction_type)
+            category_ids = {category['category_id'] for category in user_categories(user_id)}
+            ingest.queue.enqueue(user_id, amount, transaction_type, category_id, description, transaction_date,
+                                 category_ids, currency)
+            flash("Transaction added successfully!", "success")
+        except fx.MissingRate as err:
+            flash(f"{err} Import rates before adding transactions in {currency}.", "danger")
+        except ValueError as e:
+            print(f"Form data error: {e}")
+            flash("Invalid form data. Please fill all fields correctly.", "danger")
+        except db.Error as err:
+            print(f"Database error: {err}")
+            flash("Failed to add transaction.", "danger")
+        return redirect(url_for('dashboard'))
 
-        cursor.execute(query, (user_id, amount, transaction_type, category_id, description, transaction_date))
-        connection.commit()
+    try:
+        fx.require_rates(currency)
+        if category_id is None:
+            category_id = user_matcher(user_id).match(description, amount, transaction_type)
+        repos = get_repos()
+        transaction_id = repos.transactions.add(user_id, amount, transaction_type, category_id, description,
+                                                transaction_date, currency)
+        repos.commit()
+        transactions_changed(user_id, new={'transaction_id': transaction_id, 'amount': amount,
+                                           'type': transaction_type, 'category_id': category_id,
+                                           'description': description, 'transaction_date': transaction_date,
+                                           'currency': currency})
 
         print("Transaction added successfully!")
         flash("Transaction added successfully!", "success")
-    except mysql.connector.Error as err:
+    except fx.MissingRate as err:
+        flash(f"{err} Import rates before adding transactions in {currency}.", "danger")
+    except db.Error as err:
         print(f"Database error: {err}")
         flash("Failed to add transaction.", "danger")
-    finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
 
     return redirect(url_for('dashboard'))
 
 
+@app.route('/import_transactions', methods=['POST'])
+def import_transactions():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    user_id = session['user_id']
+
+    statement = request.files.get('statement')
+    fmt = request.form.get('format') or (statement and importer.detect_format(statement.filename))
+    if not statement or fmt not in importer.PARSERS:
+        return jsonify({'error': "Upload a CSV or OFX statement in the 'statement' field."}), 400
+
+    try:
+        currency = fx.check_code(request.form.get('currency') or fx.DEFAULT_CURRENCY)
+        fx.require_rates(currency)
+        stream = io.TextIOWrapper(statement.stream, encoding='utf-8-sig', errors='replace', newline='')
+        report = get_repos().transactions.import_statement(user_id, stream, fmt, currency, user_matcher(user_id))
+    except ValueError as err:
+        return jsonify({'error': str(err)}), 400
+    except db.Error as err:
+        print(f"Database error: {err}")
+        return jsonify({'error': "Failed to import statement."}), 500
+    finally:
+        # Chunks committed before a failure may already have created categories
+        categories_changed(user_id)
+        transactions_changed(user_id)
+
+    print(f"Imported {report.inserted} transactions for user {user_id}")
+    return jsonify(report.as_dict())
+
+
+@app.route('/export')
+def export_transactions():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    user_id = session['user_id']
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        return jsonify({'error': f"Unsupported format '{fmt}'."}), 400
+    if fmt == 'parquet' and not export.parquet_available():
+        return jsonify({'error': "Parquet export requires pyarrow to be installed."}), 501
+
+    try:
+        start_date = request.args.get('start')
+        end_date = request.args.get('end')
+        start_date = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else None
+        end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None
+        category = request.args.get('category', '')
+        uncategorized = category == 'none'
+        category_id = int(category) if category and not uncategorized else None
+    except ValueError:
+        return jsonify({'error': "Invalid date range or category filter."}), 400
+
+    body = get_repos().transactions.export(fmt, user_id, start_date, end_date, category_id, uncategorized)
+    mimetype, extension = export.FORMATS[fmt]
+    return Response(body, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=transactions.{extension}'})
+
+
+@app.route('/api/transactions')
+@api_view('transactions')
+def api_transactions(user_id):
+    before = decode_cursor(request.args.get('before'))
+    after = decode_cursor(request.args.get('after'))
+    limit = page_size(request.args.get('per_page'))
+    rows, next_cursor, prev_cursor = get_repos().transactions.page(user_id, request.args.get('q', ''),
+                                                                   before, after, limit)
+    return {'transactions': rows, 'next_cursor': next_cursor, 'prev_cursor': prev_cursor}
+
+
+@app.route('/api/totals')
+@api_view('totals')
+def api_totals(user_id):
+    currency = app.config['REPORTING_CURRENCY']
+    try:
+        total_income, total_expenses, spent_per_category = user_totals(user_id, currency)
+    except fx.MissingRate:
+        # Unconverted, which the null currency says
+        currency = None
+        total_income, total_expenses, spent_per_category = user_totals(user_id, None)
+    return {
+        'currency': currency,
+        'total_income': total_income,
+        'total_expenses': total_expenses,
+        'total_balance': total_income - total_expenses,
+        'spent_per_category': spent_per_category,
+    }
+
+
+@app.route('/api/categories')
+@api_view('categories')
+def api_categories(user_id):
+    return {'categories': user_categories(user_id)}
+
+
+@app.route('/api/budgets')
+@api_view('budgets')
+def api_budgets(user_id):
+    return {'budgets': user_budgets(user_id)}
+
+
+@app.route('/api/recurring')
+@api_view('recurring')
+def api_recurring(user_id):
+    return {'recurring': user_recurring(user_id)}
+
+
+@app.route('/api/analytics')
+def api_analytics():
+    if 'user_id' not in session:
+        return jsonify({'error': "Not logged in."}), 401
+    user_id = session['user_id']
+
+    if not analytics.available():
+        return jsonify({'error': "Analytics requires numpy to be installed."}), 501
+
+    try:
+        end_date = request.args.get('end')
+        end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else datetime.now().date()
+        start_date = request.args.get('start')
+        start_date = (datetime.strptime(start_date, '%Y-%m-%d').date() if start_date
+                      else end_date.replace(year=end_date.year - 1, day=1))
+        granularity = request.args.get('granularity', 'month')
+        window = int(request.args.get('window', 3))
+        if granularity not in analytics.GRANULARITIES or start_date > end_date or window < 1:
+            raise ValueError("Invalid analytics parameters")
+        if analytics.period_count(start_date, end_date, granularity) > analytics.MAX_PERIODS:
+            raise ValueError("Date range too long for this granularity")
+    except ValueError as err:
+        return jsonify({'error': str(err)}), 400
+
+    def load():
+        book = user_ledger(user_id)
+        if book is not None:
+            columns, opening = book.analytics_inputs(start_date, end_date)
+        else:
+            columns, opening = get_repos().transactions.analytics_inputs(user_id, start_date, end_date)
+        names = category_names(user_categories(user_id))
+        return analytics.compute(columns, opening, start_date, end_date, granularity, window, names)
+
+    try:
+        # Results are cached per parameter set under the user's current
+        # analytics version, which transaction writes bump.
+        version = cache.user_cache.version(user_id, 'analytics')
+        name = f"analytics:{version}:{start_date}:{end_date}:{granularity}:{window}"
+        return jsonify(cache.user_cache.get_or_load(user_id, name, load))
+    except db.Error as err:
+        print(f"Database error: {err}")
+        return jsonify({'error': "Failed to load analytics."}), 500
+
+
 @app.route('/edit_transaction/<int:transaction_id>', methods=['GET'])
 def edit_transaction(transaction_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    connection = None
     transaction = None
     categories = []
 
     try:
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor(dictionary=True)
-
         # Get the transaction to be edited
-        query_transaction = """
-        SELECT *
-        FROM transactions
-        WHERE transaction_id = %s AND user_id = %s
-        """
-        cursor.execute(query_transaction, (transaction_id, session['user_id']))
-        transaction = cursor.fetchone()
+        transaction = get_repos().transactions.get(session['user_id'], transaction_id)
 
         if not transaction:
             flash("Transaction not found or you don't have permission to edit it.", "danger")
             return redirect(url_for('dashboard'))
 
         # Get all categories for the dropdown
-        query_categories = "SELECT category_id, name FROM categories WHERE user_id = %s"
-        cursor.execute(query_categories, (session['user_id'],))
-        categories = cursor.fetchall()
+        categories = user_categories(session['user_id'])
 
-    except mysql.connector.Error as err:
+    except db.Error as err:
         print(f"Database error: {err}")
         flash("Failed to retrieve transaction details.", "danger")
         return redirect(url_for('dashboard'))
-    finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
 
-    return render_template('edit.html', transaction=transaction, categories=categories)
+    return render_template('edit.html', transaction=transaction, categories=categories,
+                           currencies=fx.currencies())
 
 
 @app.route('/update_transaction/<int:transaction_id>', methods=['POST'])
@@ -365,45 +651,41 @@ def update_transaction(transaction_id):
         amount = float(request.form['amount'])
         transaction_type = request.form['type']
         description = request.form['description']
-        transaction_date = request.form['transaction_date']
+        # Parsed before any write, so the rollup and the ledger get a real date
+        transaction_date = datetime.strptime(request.form['transaction_date'], '%Y-%m-%d').date()
         category_id_str = request.form['category_id']
+        currency = fx.check_code(request.form.get('currency') or fx.DEFAULT_CURRENCY)
 
         # Convert empty string to None for database NULL
         category_id = int(category_id_str) if category_id_str else None
 
-        if not description or not transaction_date:
+        if not description:
             raise ValueError("All fields must be filled.")
     except (KeyError, ValueError) as e:
         print(f"Form data error: {e}")
         flash("Invalid form data. Please fill all fields correctly.", "danger")
         return redirect(url_for('edit_transaction', transaction_id=transaction_id))
 
-    connection = None
     try:
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor()
-
-        query = """
-        UPDATE transactions
-        SET amount = %s, type = %s, category_id = %s, description = %s, transaction_date = %s
-        WHERE transaction_id = %s AND user_id = %s
-        """
-        cursor.execute(query,
-                       (amount, transaction_type, category_id, description, transaction_date, transaction_id, user_id))
-        connection.commit()
-
-        if cursor.rowcount == 0:
+        fx.require_rates(currency)
+        repos = get_repos()
+        old = repos.transactions.update(user_id, transaction_id, amount, transaction_type, category_id,
+                                        description, transaction_date, currency)
+        if old is None:
             flash("Failed to update transaction. It may not exist or you lack permission.", "danger")
         else:
+            repos.commit()
+            transactions_changed(user_id, old=old,
+                                 new={'transaction_id': transaction_id, 'amount': amount, 'type': transaction_type,
+                                      'category_id': category_id, 'description': description,
+                                      'transaction_date': transaction_date, 'currency': currency})
             flash("Transaction updated successfully!", "success")
 
-    except mysql.connector.Error as err:
+    except fx.MissingRate as err:
+        flash(f"{err} Import rates before using {currency}.", "danger")
+    except db.Error as err:
         print(f"Database error: {err}")
         flash("Failed to update transaction.", "danger")
-    finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
 
     return redirect(url_for('dashboard'))
 
@@ -414,24 +696,18 @@ def categories():
         return redirect(url_for('login'))
 
     user_id = session['user_id']
-    connection = None
     categories = []
+    rules = []
 
     try:
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor(dictionary=True)
-        query = "SELECT * FROM categories WHERE user_id = %s"
-        cursor.execute(query, (user_id,))
-        categories = cursor.fetchall()
+        categories = user_categories(user_id)
+        rules = user_rules(user_id)
 
-    except mysql.connector.Error as err:
+    except db.Error as err:
         print(f"Database error: {err}")
         flash("Failed to retrieve categories.", "danger")
-    finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
-    return render_template('categories.html', categories=categories)
+    return render_template('categories.html', categories=categories, rules=rules,
+                           rule_kinds=categorize.KINDS)
 
 
 @app.route('/add_category', methods=['POST'])
@@ -446,21 +722,87 @@ def add_category():
         flash("Category name cannot be empty.", "danger")
         return redirect(url_for('categories'))
 
-    connection = None
     try:
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor()
-        query = "INSERT INTO categories (name, user_id, createdBy) VALUES (%s, %s, %s)"
-        cursor.execute(query, (category_name, user_id, user_id))
-        connection.commit()
+        repos = get_repos()
+        repos.categories.create(user_id, category_name)
+        repos.commit()
+        categories_changed(user_id)
         flash("Category added successfully!", "success")
-    except mysql.connector.Error as err:
+    except db.Error as err:
         print(f"Database error: {err}")
         flash("Failed to add category.", "danger")
+
+    return redirect(url_for('categories'))
+
+
+@app.route('/add_rule', methods=['POST'])
+def add_rule():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    user_id = session['user_id']
+
+    try:
+        rule = categorize.parse(request.form)
+    except categorize.RuleError as err:
+        flash(str(err), "danger")
+        return redirect(url_for('categories'))
+
+    try:
+        repos = get_repos()
+        if repos.rules.count(user_id) >= categorize.MAX_RULES:
+            flash(f"You can have at most {categorize.MAX_RULES} rules.", "danger")
+            return redirect(url_for('categories'))
+        if repos.rules.create(user_id, rule) is None:
+            flash("Category not found or you don't have permission to use it.", "danger")
+            return redirect(url_for('categories'))
+        repos.commit()
+        rules_changed(user_id)
+        flash("Rule added successfully!", "success")
+    except db.Error as err:
+        print(f"Database error: {err}")
+        flash("Failed to add rule.", "danger")
+
+    return redirect(url_for('categories'))
+
+
+@app.route('/delete_rule/<int:rule_id>')
+def delete_rule(rule_id):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    user_id = session['user_id']
+
+    # Transactions the rule already categorized keep their category
+    try:
+        repos = get_repos()
+        deleted = repos.rules.delete(user_id, rule_id)
+        repos.commit()
+        rules_changed(user_id)
+        if deleted:
+            flash("Rule deleted successfully!", "success")
+        else:
+            flash("Rule not found or you don't have permission to delete it.", "danger")
+    except db.Error as err:
+        print(f"Database error: {err}")
+        flash("Failed to delete rule.", "danger")
+
+    return redirect(url_for('categories'))
+
+
+@app.route('/apply_rules', methods=['POST'])
+def apply_rules():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    user_id = session['user_id']
+
+    try:
+        scanned, categorized = get_repos().rules.backfill(user_id, user_matcher(user_id))
+        flash(f"Categorized {categorized} of {scanned} uncategorized transactions.", "success")
+    except db.Error as err:
+        print(f"Database error: {err}")
+        flash("Failed to apply rules.", "danger")
     finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
+        # Batches committed before a failure are kept
+        transactions_changed(user_id)
 
     return redirect(url_for('categories'))
 
@@ -470,69 +812,80 @@ def delete_transaction(transaction_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     user_id = session['user_id']
-    connection = None
     try:
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor()
-        query = "DELETE FROM transactions WHERE transaction_id = %s AND user_id = %s"
-        cursor.execute(query, (transaction_id, user_id))
-        connection.commit()
-        flash("Transaction deleted successfully!", "success")
-    except mysql.connector.Error as err:
+        repos = get_repos()
+        old = repos.transactions.delete(user_id, transaction_id)
+        if old is not None:
+            repos.commit()
+            transactions_changed(user_id, old=old)
+            flash("Transaction deleted successfully!", "success")
+        else:
+            flash("Transaction not found or you don't have permission to delete it.", "danger")
+    except db.Error as err:
         print(f"Database error: {err}")
         flash("Failed to delete transaction.", "danger")
-    finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
     return redirect(url_for('dashboard'))
 
 
+@app.route('/api/transactions/bulk', methods=['POST'])
+def bulk_transactions():
+    # Re-categorize, re-date or delete a set of IDs (or a filter's matches) in one database transaction
+    if 'user_id' not in session:
+        return jsonify({'error': "Not logged in."}), 401
+    user_id = session['user_id']
+
+    try:
+        operation = bulk.parse(request.get_json(silent=True))
+        repos = get_repos()
+        result = repos.transactions.bulk(user_id, operation)
+        repos.commit()
+    except bulk.BulkError as err:
+        return jsonify({'error': str(err)}), 400
+    except db.IntegrityError as err:
+        print(f"Database error: {err}")
+        return jsonify({'error': "The change conflicts with existing transactions; nothing was changed."}), 409
+    except db.Error as err:
+        print(f"Database error: {err}")
+        return jsonify({'error': "Bulk update failed; nothing was changed."}), 500
+
+    if result['matched']:
+        transactions_changed(user_id)
+    return jsonify(result)
+
+
 @app.route('/set_budget', methods=['POST'])
 def set_budget():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     user_id = session['user_id']
 
-    connection = None
     try:
         category_id = int(request.form['category_id'])
         # The database column is 'amount', not 'budget_amount'
         amount = float(request.form['budget_amount'])
         start_date_str = request.form['budget_start_date']
         start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+        currency = fx.check_code(request.form.get('currency') or fx.DEFAULT_CURRENCY)
+        fx.require_rates(currency)
 
         # Calculate the end date as the last day of the month
         _, last_day = monthrange(start_date.year, start_date.month)
         end_date = start_date.replace(day=last_day)
 
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor()
+        repos = get_repos()
 
         # Check for existing budget for the same user, category, and month
-        query_check = """
-        SELECT COUNT(*) FROM budgets
-        WHERE user_id = %s AND category_id = %s AND start_date = %s
-        """
-        cursor.execute(query_check, (user_id, category_id, start_date))
-        if cursor.fetchone()[0] > 0:
+        if repos.budgets.exists(user_id, category_id, start_date):
             flash('Budget for this category and month already exists. Please edit it instead.', 'danger')
         else:
-            query = """
-            INSERT INTO budgets (user_id, category_id, amount, start_date, end_date)
-            VALUES (%s, %s, %s, %s, %s)
-            """
-            cursor.execute(query, (user_id, category_id, amount, start_date, end_date))
-            connection.commit()
+            repos.budgets.create(user_id, category_id, amount, start_date, end_date, currency)
+            repos.commit()
+            budgets_changed(user_id)
             flash('Budget set successfully!', 'success')
 
-    except (KeyError, ValueError, mysql.connector.Error) as err:
+    except (KeyError, ValueError, *db.Error) as err:
         print(f"Database error or invalid form data: {err}")
         flash("Failed to set budget. Please check your data.", "danger")
-    finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
 
     return redirect(url_for('dashboard'))
 
@@ -542,40 +895,24 @@ def edit_budget(budget_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    connection = None
     budget = None
     categories = []
 
     try:
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor(dictionary=True)
-
         # Retrieve the budget to be edited
-        query_budget = """
-        SELECT *
-        FROM budgets
-        WHERE budget_id = %s AND user_id = %s
-        """
-        cursor.execute(query_budget, (budget_id, session['user_id']))
-        budget = cursor.fetchone()
+        budget = get_repos().budgets.get(session['user_id'], budget_id)
 
         if not budget:
             flash("Budget not found or you don't have permission to edit it.", "danger")
             return redirect(url_for('dashboard'))
 
         # Get all categories for the dropdown
-        query_categories = "SELECT category_id, name FROM categories WHERE user_id = %s"
-        cursor.execute(query_categories, (session['user_id'],))
-        categories = cursor.fetchall()
+        categories = user_categories(session['user_id'])
 
-    except mysql.connector.Error as err:
+    except db.Error as err:
         print(f"Database error: {err}")
         flash("Failed to retrieve budget details for editing.", "danger")
         return redirect(url_for('dashboard'))
-    finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
 
     return render_template('edit_budget.html', budget=budget, categories=categories)
 
@@ -586,36 +923,30 @@ def update_budget(budget_id):
         return redirect(url_for('login'))
 
     user_id = session['user_id']
-    connection = None
 
     try:
         amount = float(request.form['amount'])
-        start_date = request.form['start_date']
-        end_date = request.form['end_date']
-
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor()
-
-        query = """
-        UPDATE budgets
-        SET amount = %s, start_date = %s, end_date = %s
-        WHERE budget_id = %s AND user_id = %s
-        """
-        cursor.execute(query, (amount, start_date, end_date, budget_id, user_id))
-        connection.commit()
-
-        if cursor.rowcount == 0:
+        # Parsed here: SQLite would store any string, and every later read of it would fail
+        start_date = datetime.strptime(request.form['start_date'], '%Y-%m-%d').date()
+        end_date = datetime.strptime(request.form['end_date'], '%Y-%m-%d').date()
+        if end_date < start_date:
+            raise ValueError("The end date is before the start date.")
+        currency = fx.check_code(request.form.get('currency') or fx.DEFAULT_CURRENCY)
+        fx.require_rates(currency)
+
+        repos = get_repos()
+        updated = repos.budgets.update(user_id, budget_id, amount, start_date, end_date, currency)
+        repos.commit()
+        budgets_changed(user_id)
+
+        if not updated:
             flash("Failed to update budget. It may not exist or you lack permission.", "danger")
         else:
             flash("Budget updated successfully!", "success")
 
-    except (KeyError, ValueError, mysql.connector.Error) as err:
+    except (KeyError, ValueError, *db.Error) as err:
         print(f"Error updating budget: {err}")
         flash("Failed to update budget. Please check your data.", "danger")
-    finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
 
     return redirect(url_for('dashboard'))
 
@@ -626,31 +957,359 @@ def delete_budget(budget_id):
         return redirect(url_for('login'))
     user_id = session['user_id']
 
-    connection = None
     try:
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor()
-        query = "DELETE FROM budgets WHERE budget_id = %s AND user_id = %s"
-        cursor.execute(query, (budget_id, user_id))
-        connection.commit()
-        if cursor.rowcount > 0:
+        repos = get_repos()
+        deleted = repos.budgets.delete(user_id, budget_id)
+        repos.commit()
+        budgets_changed(user_id)
+        if deleted:
             flash("Budget deleted successfully!", "success")
         else:
             flash("Budget not found or you don't have permission to delete it.", "danger")
-    except mysql.connector.Error as err:
+    except db.Error as err:
         print(f"Database error: {err}")
         flash("Failed to delete budget.", "danger")
-    finally:
-        if connection and connection.is_connected():
-            cursor.close()
-            connection.close()
 
     return redirect(url_for('dashboard'))
 
 
+@app.route('/add_recurring', methods=['POST'])
+def add_recurring():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    user_id = session['user_id']
+
+    try:
+        amount = float(request.form['amount'])
+        transaction_type = request.form['type']
+        description = request.form['description'].strip()
+        category_id_str = request.form.get('category_id', '')
+        category_id = int(category_id_str) if category_id_str else None
+        frequency = request.form['frequency']
+        interval_count = int(request.form.get('interval_count') or 1)
+        start_date = datetime.strptime(request.form['start_date'], '%Y-%m-%d').date()
+        end_date_str = request.form.get('end_date', '')
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date() if end_date_str else None
+
+        if not description or transaction_type not in ('income', 'expense') or frequency not in recurring.FREQUENCIES:
+            raise ValueError("All fields must be filled.")
+        if interval_count < 1 or (end_date is not None and end_date < start_date):
+            raise ValueError("Invalid interval or date range.")
+    except (KeyError, ValueError) as e:
+        print(f"Form data error: {e}")
+        flash("Invalid recurring transaction. Please check your data.", "danger")
+        return redirect(url_for('dashboard'))
+
+    try:
+        repos = get_repos()
+        # Occurrences already due (a start date today or in the past) are posted straight away
+        posted = repos.recurring.create(user_id, amount, transaction_type, category_id, description, frequency,
+                                        interval_count, start_date, end_date)
+        repos.commit()
+        cache.user_cache.invalidate(user_id, 'recurring', 'data')
+        if posted:
+            transactions_changed(user_id)
+        flash(f"Recurring transaction added ({len(posted)} occurrences posted so far).", "success")
+    except db.Error as err:
+        print(f"Database error: {err}")
+        flash("Failed to add recurring transaction.", "danger")
+
+    return redirect(url_for('dashboard'))
+
+
+@app.route('/delete_recurring/<int:recurring_id>')
+def delete_recurring(recurring_id):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    user_id = session['user_id']
+
+    # Transactions already posted by the rule are kept
+    try:
+        repos = get_repos()
+        deleted = repos.recurring.delete(user_id, recurring_id)
+        repos.commit()
+        cache.user_cache.invalidate(user_id, 'recurring', 'data')
+        if deleted:
+            flash("Recurring transaction deleted successfully!", "success")
+        else:
+            flash("Recurring transaction not found or you don't have permission to delete it.", "danger")
+    except db.Error as err:
+        print(f"Database error: {err}")
+        flash("Failed to delete recurring transaction.", "danger")
+
+    return redirect(url_for('dashboard'))
+
+
+def metrics_view(view):
+    # Metrics carry query text and internal state. With METRICS_TOKEN set they
+    # need "Authorization: Bearer <token>"; without it they are served only to
+    # requests from this host that didn't come through a proxy.
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = app.config['METRICS_TOKEN']
+        if token:
+            supplied = request.headers.get('Authorization', '')
+            if not hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode()):
+                return jsonify({'error': "Not authorized."}), 401
+        elif request.remote_addr not in ('127.0.0.1', '::1') or 'X-Forwarded-For' in request.headers:
+            return jsonify({'error': "Metrics are only served locally without METRICS_TOKEN."}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@app.route('/pool_metrics')
+@metrics_view
+def pool_metrics():
+    return jsonify(db.pool.metrics())
+
+
+@app.route('/metrics')
+@metrics_view
+def metrics():
+    pool_stats = db.pool.metrics()
+    gauges = [(f'db_pool_{name}', f"Connection pool {name.replace('_', ' ')}.", pool_stats[name])
+              for name in ('open', 'idle', 'checked_out', 'overflow_in_use', 'timeouts', 'health_check_failures')]
+    body = instrumentation.stats.render(gauges)
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/hash_metrics')
+@metrics_view
+def hash_metrics():
+    return jsonify(hashing.hasher.metrics())
+
+
+@app.route('/recurring_metrics')
+@metrics_view
+def recurring_metrics():
+    return jsonify(recurring.scheduler.metrics())
+
+
+@app.route('/cache_metrics')
+@metrics_view
+def cache_metrics():
+    return jsonify(cache.user_cache.metrics())
+
+
+@app.route('/ingest_metrics')
+@metrics_view
+def ingest_metrics():
+    if ingest.queue is None:
+        return jsonify({'mode': app.config['INGEST_MODE'], 'running': False})
+    return jsonify({'mode': app.config['INGEST_MODE'], **ingest.queue.metrics()})
+
+
+@app.route('/ledger_metrics')
+@metrics_view
+def ledger_metrics():
+    if ledger.ledgers is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **ledger.ledgers.metrics()})
+
+
+@app.route('/categorize_metrics')
+@metrics_view
+def categorize_metrics():
+    return jsonify(categorize.matchers.metrics())
+
+
+@app.route('/session_metrics')
+@metrics_view
+def session_metrics():
+    return jsonify(sessions.interface.metrics())
+
+
+schema_cli = click.Group('schema', help="Inspect and upgrade the database schema.")
+app.cli.add_command(schema_cli)
+
+
+@schema_cli.command('status')
+def schema_status_command():
+    with db.pool.connection() as connection:
+        cursor = connection.cursor(buffered=True)
+        version = migrations.current_version(cursor)
+        waiting = migrations.pending(cursor)
+        cursor.close()
+    print(f"Schema version {version} (latest {migrations.latest()}).")
+    for pending_version, name, _ in waiting:
+        print(f"  pending: {pending_version} {name}")
+
+
+@schema_cli.command('upgrade')
+@click.option('--target', type=int, default=None, help="Stop after this version (default: latest).")
+def schema_upgrade_command(target):
+    with db.pool.connection() as connection:
+        try:
+            applied = migrations.upgrade(connection, app.config, target)
+        except RuntimeError as err:
+            raise click.ClickException(str(err))
+    print(f"✅ Schema is at version {applied[-1][0] if applied else 'unchanged'} "
+          f"({len(applied)} migrations applied).")
+
+
+@app.cli.command('rebuild-summary')
+@click.option('--user-id', type=int, default=None, help="Only rebuild or verify this user's rows.")
+@click.option('--verify', 'verify_only', is_flag=True, help="Report drift without rewriting the rollup.")
+def rebuild_summary_command(user_id, verify_only):
+    with db.pool.connection() as connection:
+        cursor = connection.cursor(buffered=True)
+        drift = summary.verify(cursor, user_id)
+        for key, expected, actual in drift:
+            print(f"Drift at user={key[0]} category={key[1]} month={key[2]}: expected {expected}, found {actual}")
+        print(f"{len(drift)} drifted summary rows.")
+        if not verify_only:
+            rows = summary.rebuild(cursor, user_id)
+            connection.commit()
+            print(f"✅ Summary rebuilt ({rows} rows).")
+        cursor.close()
+
+
+@app.cli.command('partitions')
+@click.option('--ahead', type=int, default=None, help="Periods after the current one to create partitions for.")
+@click.option('--archive-before', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help="Move partitions ending on or before this date to the archive tier.")
+@click.option('--check-pruning', 'check_user_id', type=int, default=None,
+              help="EXPLAIN the dashboard and budget queries for this user and show the partitions read.")
+def partitions_command(ahead, archive_before, check_user_id):
+    if db.dialect != 'mysql':
+        raise click.ClickException("Partitioning is only available with the MySQL backend.")
+    unit = app.config['TRANSACTIONS_PARTITION_UNIT']
+    with db.pool.connection() as connection:
+        cursor = connection.cursor(buffered=True)
+        added = partitions.ensure(cursor, unit, app.config['TRANSACTIONS_PARTITIONS_AHEAD'] if ahead is None else ahead)
+        print(f"✅ {len(added)} partitions added{': ' + ', '.join(added) if added else ''}.")
+
+        if archive_before is not None:
+            moved = partitions.archive(connection, archive_before.date())
+            for name, rows in moved:
+                print(f"✅ Archived {name} ({rows} rows).")
+            print(f"{len(moved)} partitions archived.")
+
+        for table in (partitions.HOT_TABLE, partitions.ARCHIVE_TABLE):
+            listing = ', '.join(f"{name}(~{rows})" for name, _, rows in partitions.list_partitions(cursor, table))
+            print(f"{table}: {listing}")
+
+        if check_user_id is not None:
+            since = repositories.page_window(None, None, unit)
+            checks = [('dashboard first page', repositories.page_query(check_user_id, '', None, None, 50, since))]
+            cursor.execute(budgeting.BUDGET_BOUNDS_QUERY, (check_user_id,))
+            params = budgeting.spend_params(check_user_id, dict(zip(('first_day', 'last_day'), cursor.fetchone())))
+            if params is not None:
+                checks.append(('budget spend', (budgeting.BUDGET_SPEND_QUERY, params)))
+            for label, (query, query_params) in checks:
+                plan = partitions.explain_partitions(cursor, query, query_params)
+                print(f"{label}: reads {', '.join(plan.get('t', ['all partitions']))}")
+        cursor.close()
+
+
+@app.cli.command('import-statement')
+@click.argument('user_id', type=int)
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(sorted(importer.PARSERS)), default=None,
+              help="Statement format; detected from the file extension by default.")
+@click.option('--currency', default=None,
+              help="Currency of rows the statement doesn't give one for (default: DEFAULT_CURRENCY).")
+@click.option('--no-rules', is_flag=True, help="Don't categorize rows with the user's categorization rules.")
+def import_statement_command(user_id, path, fmt, currency, no_rules):
+    fmt = fmt or importer.detect_format(path)
+    if fmt is None:
+        raise click.UsageError("Could not detect the statement format; pass --format.")
+    try:
+        currency = fx.check_code(currency or fx.DEFAULT_CURRENCY)
+    except ValueError as err:
+        raise click.UsageError(str(err))
+    with open(path, encoding='utf-8-sig', errors='replace', newline='') as stream, \
+            db.pool.connection() as connection:
+        report = importer.import_statement(connection, user_id, stream, fmt,
+                                           batch_size=app.config['IMPORT_BATCH_SIZE'],
+                                           chunk_size=app.config['IMPORT_CHUNK_SIZE'],
+                                           currency=currency, currencies=fx.currencies(),
+                                           matcher=None if no_rules else user_matcher(user_id))
+    categories_changed(user_id)
+    transactions_changed(user_id)
+    result = report.as_dict()
+    for error in result['errors']:
+        print(f"Line {error['line']}: {error['error']}")
+    print(f"✅ Read {result['read']} rows: {result['inserted']} imported, {result['duplicates']} duplicates, "
+          f"{result['error_count']} errors, {result['categories_created']} categories created, "
+          f"{result['auto_categorized']} categorized by rules.")
+
+
+@app.cli.command('categorize-backfill')
+@click.option('--user-id', type=int, default=None,
+              help="Only this user's transactions (default: every user with rules).")
+def categorize_backfill_command(user_id):
+    """Apply categorization rules to uncategorized transactions."""
+    repos = get_repos()
+    user_ids = [user_id] if user_id is not None else categorize.users_with_rules(db.get_cursor())
+    total = 0
+    for uid in user_ids:
+        scanned, categorized = repos.rules.backfill(uid, user_matcher(uid))
+        transactions_changed(uid)
+        total += categorized
+        print(f"User {uid}: categorized {categorized} of {scanned} uncategorized transactions.")
+    print(f"✅ {total} transactions categorized for {len(user_ids)} users.")
+
+
+@app.cli.command('materialize-recurring')
+@click.option('--date', 'today', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help="Post occurrences due on or before this date (default: today).")
+def materialize_recurring_command(today):
+    result = recurring.scheduler.run_once(today.date() if today else None)
+    if result is None:
+        print("Another instance is already posting recurring transactions.")
+        return
+    print(f"✅ Processed {result['rules']} due rules: {result['posted']} transactions posted "
+          f"for {len(result['user_ids'])} users.")
+
+
+fx_cli = click.Group('fx', help="Exchange rates for reporting in one currency.")
+app.cli.add_command(fx_cli)
+
+
+@fx_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def fx_import_command(path):
+    """Load rates from a CSV: the ECB's eurofxref-hist.csv layout, or date,currency,rate rows."""
+    with open(path, encoding='utf-8-sig', newline='') as stream, db.pool.connection() as connection:
+        try:
+            count = fx.import_rates(connection, stream, fx.rates.base)
+        except ValueError as err:
+            raise click.ClickException(str(err))
+    table = fx.rates.reload()
+    print(f"✅ Imported {count} exchange rates (per 1 {fx.rates.base}), now version {table.version}; "
+          f"servers reload them within {fx.rates.check_interval:g}s.")
+    problem = fx.reporting_problem()
+    if problem:
+        print(f"⚠️ {problem}")
+
+
+@fx_cli.command('status')
+def fx_status_command():
+    for currency, first_day, last_day, count in fx.coverage():
+        print(f"{currency}: {count} rates from {first_day} to {last_day}")
+    print(f"Base {fx.rates.base}; reporting in {fx.REPORTING_CURRENCY}.")
+    problem = fx.reporting_problem()
+    if problem:
+        print(f"⚠️ {problem}")
+
+
+@app.cli.command('drain-ingest')
+def drain_ingest_command():
+    """Write every queued transaction in the ingestion journal now."""
+    if ingest.queue is None:
+        print("No ingestion journal; INGEST_MODE is 'direct'.")
+        return
+    written = ingest.queue.drain()
+    metrics = ingest.queue.metrics()
+    print(f"✅ Took {written} entries off the journal: {metrics['pending']} pending, "
+          f"{metrics['failed']} rejected in total.")
+
+
 @app.route('/logout')
 def logout():
-    session.pop('user_id', None)
+    # Deletes the server-side record along with the cached profile
+    session.clear()
     return redirect(url_for('login'))
 
 
@@ -660,5 +1319,4 @@ def index():
 
 
 if __name__ == '__main__':
-    create_tables()
     app.run(debug=True)
@@ -0,0 +1,367 @@
+"""ASGI entry point: read-heavy pages on asyncio, everything else through Flask.
+
+    uvicorn asgi:application --workers 2
+
+The dashboard, categories, edit_transaction and edit_budget pages are
+served by coroutines that query MySQL through an aiomysql pool, so a
+worker process can have many requests waiting on the database at once.
+The dashboard runs its independent queries concurrently, each on its own
+pooled connection. Every other route (and every write) is handed to the
+regular WSGI app. The async views need MySQL; with DB_BACKEND=sqlite
+every request goes to the WSGI app, since embedded queries don't wait on
+a network round trip anyway.
+
+The async views render the same templates inside a Flask request
+context, so sessions, flashing and url_for behave exactly as in the sync
+views; like them, they take the username and categories from the
+server-side session when it has them, and the dashboard takes its totals
+and unsearched pages from the user's ledger when one is resident (it is
+loaded by the sync views; see ledger.py). Totals and budget spend in
+other currencies are converted with the process's fx rate table.
+"""
+import asyncio
+import time
+
+import aiomysql
+from asgiref.wsgi import WsgiToAsgi
+from flask import flash, redirect, render_template, request, session, url_for
+from werkzeug.exceptions import HTTPException
+
+import app as finance_app
+import budgeting
+import categorize
+import db
+import fx
+import ingest
+import instrumentation
+import ledger
+import repositories
+import sessions
+import summary
+from app import app
+from pagination import decode_cursor, page_size, paginate
+from repositories import BUDGET_QUERY, CATEGORIES_QUERY, RECURRING_QUERY, TRANSACTION_QUERY, USERNAME_QUERY
+
+_pool = None
+_pool_lock = asyncio.Lock()
+_wsgi = WsgiToAsgi(app)
+
+
+async def _get_pool():
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                config = finance_app.db_config
+                _pool = await aiomysql.create_pool(
+                    host=config['host'], user=config['user'], password=config['password'], db=config['database'],
+                    minsize=app.config.get('ASYNC_DB_POOL_MIN', 1),
+                    maxsize=app.config.get('ASYNC_DB_POOL_MAX', 20),
+                    pool_recycle=int(app.config.get('DB_POOL_RECYCLE', 3600)),
+                    # Reads only; autocommit keeps pooled connections from
+                    # pinning an old REPEATABLE READ snapshot between requests.
+                    autocommit=True,
+                )
+    return _pool
+
+
+async def _fetchall(query, params):
+    pool = await _get_pool()
+    async with pool.acquire() as connection:
+        async with connection.cursor(aiomysql.DictCursor) as cursor:
+            started = time.perf_counter()
+            await cursor.execute(query, params)
+            rows = await cursor.fetchall()
+            instrumentation.stats.record(query, time.perf_counter() - started, len(rows))
+            return list(rows)
+
+
+async def _fetchone(query, params):
+    rows = await _fetchall(query, params)
+    return rows[0] if rows else None
+
+
+def _cached(user_id, name, query):
+    async def load():
+        return await _fetchall(query, (user_id,))
+    return finance_app.cache.user_cache.get_or_load_async(user_id, name, load)
+
+
+async def _categories(user_id):
+    # As app.user_categories
+    version = finance_app.cache.user_cache.version(user_id, 'profile')
+    categories = sessions.cached('categories', version)
+    if categories is None:
+        categories = sessions.remember('categories', version,
+                                       await _cached(user_id, 'categories', CATEGORIES_QUERY))
+    return categories
+
+
+async def _username(user_id):
+    # As app.session_username
+    username = session.get('username')
+    if username is None:
+        user = await _fetchone(USERNAME_QUERY, (user_id,))
+        if user is not None:
+            username = session['username'] = user['username']
+    return username
+
+
+async def _budgets(user_id):
+    # Cached unconverted, as app.user_budgets
+    async def load():
+        params = budgeting.spend_params(user_id, await _fetchone(budgeting.BUDGET_BOUNDS_QUERY, (user_id,)))
+        if not params:
+            return [], []
+        return await asyncio.gather(_fetchall(budgeting.BUDGET_SPEND_QUERY, params),
+                                    _fetchall(budgeting.FOREIGN_SPEND_QUERY, params))
+    try:
+        rows, foreign = await finance_app.cache.user_cache.get_or_load_async(user_id, 'budgets', load)
+        return budgeting.add_foreign_spend(rows, foreign)
+    except fx.MissingRate as err:
+        print(f"Exchange rate error: {err}")
+        flash(f"{err} Budgets can't be shown until rates are imported.", "warning")
+        return []
+
+
+async def _transaction_page(user_id, search_query, before, after, limit):
+    # Same recent-partitions-first lookup as TransactionRepo.page
+    since = repositories.page_window(before, after, app.config['TRANSACTIONS_PARTITION_UNIT'])
+    min_token_size = app.config['FULLTEXT_MIN_TOKEN_SIZE']
+    rows = await _fetchall(*repositories.page_query(user_id, search_query, before, after, limit, since,
+                                                     min_token_size))
+    if since is not None and len(rows) <= limit:
+        rows = await _fetchall(*repositories.page_query(user_id, search_query, before, after, limit,
+                                                         min_token_size=min_token_size))
+    return paginate(rows, limit, before, after)
+
+
+async def _none():
+    return None
+
+
+async def _unwritten(user_id):
+    # As ingest.unwritten: read after the totals
+    entries = ingest.pending(user_id)
+    if entries:
+        entries = ingest.drop_written(entries, await _fetchall(*ingest.written_query(entries)))
+    return entries
+
+
+async def dashboard():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    user_id = session['user_id']
+
+    search_query = request.args.get('q', '')
+    before = decode_cursor(request.args.get('before'))
+    after = decode_cursor(request.args.get('after'))
+    limit = page_size(request.args.get('per_page'))
+
+    transactions = []
+    categories = []
+    budgets = []
+    recurring_rules = []
+    next_cursor = prev_cursor = None
+    total_income, total_expenses, spent_per_category = summary.fold_totals([])
+    reporting_currency = app.config['REPORTING_CURRENCY']
+    currencies = [fx.DEFAULT_CURRENCY]
+
+    try:
+        book = ledger.resident(user_id)
+        # The reads are independent, so they run concurrently on separate connections
+        username, categories, page, total_rows, foreign_rows, budget_rows, recurring_rules = await asyncio.gather(
+            _username(user_id),
+            _categories(user_id),
+            _transaction_page(user_id, search_query, before, after, limit)
+            if book is None or search_query else _none(),
+            _fetchall(summary.READ_TOTALS_QUERY, (user_id,)) if book is None else _none(),
+            _fetchall(*summary.foreign_totals_query(user_id, reporting_currency)) if book is None else _none(),
+            _budgets(user_id),
+            _cached(user_id, 'recurring', RECURRING_QUERY),
+        )
+        username = username or 'Guest'
+        names = {category['category_id']: category['name'] for category in categories}
+        if page is None:
+            page = book.page(before, after, limit, names)
+        transactions, next_cursor, prev_cursor = page
+        first_page = not (search_query or before or after)
+        try:
+            totals = (summary.fold_totals(fx.convert_totals(total_rows, foreign_rows, reporting_currency))
+                      if book is None else book.totals(names, reporting_currency))
+            entries = await _unwritten(user_id)
+            merged = ingest.merge_pending(entries, transactions, totals, categories, first_page,
+                                          currency=reporting_currency)
+        except fx.MissingRate as err:
+            print(f"Exchange rate error: {err}")
+            flash(f"{err} Totals add up amounts in different currencies.", "warning")
+            reporting_currency = None
+            totals = summary.fold_totals(total_rows) if book is None else book.totals(names)
+            entries = await _unwritten(user_id)
+            merged = ingest.merge_pending(entries, transactions, totals, categories, first_page)
+        transactions, (total_income, total_expenses, spent_per_category) = merged
+        budgets = budgeting.progress(budget_rows)
+        currencies = fx.currencies()
+    except aiomysql.MySQLError as err:
+        print(f"Database error: {err}")
+        username = 'Guest'
+
+    total_balance = total_income - total_expenses
+
+    return render_template('Dashboard.html',
+                           username=username,
+                           transactions=transactions,
+                           categories=categories,
+                           total_income=total_income,
+                           total_expenses=total_expenses,
+                           total_balance=total_balance,
+                           search_query=search_query,
+                           budgets=budgets,
+                           recurring_rules=recurring_rules,
+                           spent_per_category=spent_per_category,
+                           next_cursor=next_cursor,
+                           prev_cursor=prev_cursor,
+                           per_page=limit,
+                           reporting_currency=reporting_currency,
+                           currencies=currencies)
+
+
+async def categories():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    user_id = session['user_id']
+    categories = []
+    rules = []
+    try:
+        categories, rules = await asyncio.gather(_categories(user_id),
+                                                 _cached(user_id, 'rules', categorize.RULES_QUERY))
+    except aiomysql.MySQLError as err:
+        print(f"Database error: {err}")
+        flash("Failed to retrieve categories.", "danger")
+    return render_template('categories.html', categories=categories, rules=rules,
+                           rule_kinds=categorize.KINDS)
+
+
+async def edit_transaction(transaction_id):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    user_id = session['user_id']
+
+    try:
+        transaction, categories = await asyncio.gather(
+            _fetchone(TRANSACTION_QUERY, (transaction_id, user_id)),
+            _categories(user_id),
+        )
+    except aiomysql.MySQLError as err:
+        print(f"Database error: {err}")
+        flash("Failed to retrieve transaction details.", "danger")
+        return redirect(url_for('dashboard'))
+
+    if not transaction:
+        flash("Transaction not found or you don't have permission to edit it.", "danger")
+        return redirect(url_for('dashboard'))
+    return render_template('edit.html', transaction=transaction, categories=categories,
+                           currencies=fx.currencies())
+
+
+async def edit_budget(budget_id):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    user_id = session['user_id']
+
+    try:
+        budget, categories = await asyncio.gather(
+            _fetchone(BUDGET_QUERY, (budget_id, user_id)),
+            _categories(user_id),
+        )
+    except aiomysql.MySQLError as err:
+        print(f"Database error: {err}")
+        flash("Failed to retrieve budget details for editing.", "danger")
+        return redirect(url_for('dashboard'))
+
+    if not budget:
+        flash("Budget not found or you don't have permission to edit it.", "danger")
+        return redirect(url_for('dashboard'))
+    return render_template('edit_budget.html', budget=budget, categories=categories)
+
+
+ASYNC_VIEWS = {
+    'dashboard': dashboard,
+    'categories': categories,
+    'edit_transaction': edit_transaction,
+    'edit_budget': edit_budget,
+}
+
+
+def _match(scope):
+    if db.dialect != 'mysql' or scope['method'] not in ('GET', 'HEAD'):
+        return None
+    adapter = app.url_map.bind('', url_scheme=scope.get('scheme', 'http'))
+    try:
+        endpoint, view_args = adapter.match(scope['path'], method=scope['method'])
+    except HTTPException:
+        return None
+    if endpoint not in ASYNC_VIEWS:
+        return None
+    return endpoint, view_args
+
+
+async def _serve(scope, send, endpoint, view_args):
+    headers = [(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']]
+    host = dict(headers).get('host') or '{}:{}'.format(*scope.get('server') or ('localhost', 80))
+    ctx = app.test_request_context(
+        path=scope['path'],
+        base_url=f"{scope.get('scheme', 'http')}://{host}{scope.get('root_path', '')}",
+        query_string=scope['query_string'].decode('latin-1'),
+        method=scope['method'],
+        headers=headers,
+    )
+    ctx.push()
+    try:
+        try:
+            response = app.make_response(await ASYNC_VIEWS[endpoint](**view_args))
+        except Exception as err:
+            response = app.make_response(app.handle_user_exception(err))
+        # Runs after_request hooks and writes the session cookie (flashes)
+        response = app.process_response(response)
+    finally:
+        ctx.pop()
+
+    body = response.get_data()
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in response.headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if db.dialect == 'mysql':
+                try:
+                    await _get_pool()
+                except aiomysql.MySQLError as err:
+                    # The pool is created lazily on first use if MySQL isn't up yet
+                    print(f"Database error: {err}")
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _pool is not None:
+                _pool.close()
+                await _pool.wait_closed()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] == 'http':
+        matched = _match(scope)
+        if matched is not None:
+            return await _serve(scope, send, *matched)
+    return await _wsgi(scope, receive, send)
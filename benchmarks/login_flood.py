@@ -0,0 +1,96 @@
+"""p99 dashboard latency while a login flood hits the same server.
+
+The server is modelled as a fixed pool of request workers (as with
+gunicorn --threads). Dashboard requests wait on I/O for a couple of
+milliseconds; login requests verify a bcrypt hash. The run is repeated
+with hashing inline on the request worker and with hashing.PasswordHasher,
+which caps hashing concurrency and rejects the overflow immediately.
+
+    python benchmarks/login_flood.py --workers 16 --logins 400 --rounds 12
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hashing  # noqa: E402
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def dashboard_request():
+    time.sleep(0.002)
+
+
+def run(mode, args, pw_hash):
+    hasher = None
+    if mode == 'pooled':
+        hasher = hashing.PasswordHasher(rounds=args.rounds, workers=args.hash_workers,
+                                        max_queue=args.hash_queue)
+
+    def login_request():
+        if hasher is None:
+            return hashing._check(pw_hash, 'password')
+        try:
+            return hasher.check(pw_hash, 'password')
+        except hashing.HasherBusy:
+            return None
+
+    latencies = []
+
+    def timed_dashboard(submitted):
+        dashboard_request()
+        latencies.append(time.perf_counter() - submitted)
+
+    server = ThreadPoolExecutor(max_workers=args.workers)
+    started = time.perf_counter()
+    futures = [server.submit(login_request) for _ in range(args.logins)]
+    for _ in range(args.dashboards):
+        futures.append(server.submit(timed_dashboard, time.perf_counter()))
+        time.sleep(args.interval)
+    for future in futures:
+        future.result()
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+    rejected = hasher.metrics()['rejected'] if hasher else 0
+    if hasher:
+        hasher.shutdown()
+
+    return {
+        'mode': mode,
+        'elapsed_s': round(elapsed, 3),
+        'logins_rejected': rejected,
+        'dashboard_p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'dashboard_p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'dashboard_p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=16, help="request worker threads")
+    parser.add_argument('--logins', type=int, default=400, help="login requests in the flood")
+    parser.add_argument('--dashboards', type=int, default=500, help="dashboard requests to time")
+    parser.add_argument('--interval', type=float, default=0.002, help="seconds between dashboard arrivals")
+    parser.add_argument('--rounds', type=int, default=12, help="bcrypt cost factor")
+    parser.add_argument('--hash-workers', type=int, default=None)
+    parser.add_argument('--hash-queue', type=int, default=4)
+    args = parser.parse_args()
+
+    pw_hash = hashing._generate('password', args.rounds)
+    results = [run('inline', args, pw_hash), run('pooled', args, pw_hash)]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""Drive the real Flask routes against a seeded database and report latency.
+
+Each scenario runs for a fixed number of requests across a pool of
+concurrent clients. Every client is a Flask test client whose session is
+logged in as one of the seeded users (see benchmarks/seed.py). Results are
+throughput plus p50/p95/p99 latency per scenario.
+
+    DB_NAME=finance_bench python benchmarks/run.py --save baseline.json
+    DB_NAME=finance_bench python benchmarks/run.py --compare baseline.json
+    DB_BACKEND=sqlite SQLITE_PATH=/tmp/bench.sqlite3 python benchmarks/run.py
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as finance_app  # noqa: E402
+import db  # noqa: E402
+from seed import USERNAME_PREFIX  # noqa: E402
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def load_fixtures():
+    with db.pool.connection() as connection:
+        cursor = connection.cursor(buffered=True)
+        cursor.execute("SELECT id FROM users WHERE username LIKE %s", (USERNAME_PREFIX + '%',))
+        user_ids = [row[0] for row in cursor.fetchall()]
+        fixtures = {}
+        for user_id in user_ids:
+            cursor.execute("SELECT category_id FROM categories WHERE user_id = %s", (user_id,))
+            category_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute("SELECT transaction_id FROM transactions WHERE user_id = %s "
+                           "ORDER BY transaction_id DESC LIMIT 200", (user_id,))
+            transaction_ids = [row[0] for row in cursor.fetchall()]
+            fixtures[user_id] = {'categories': category_ids, 'transactions': transaction_ids}
+        cursor.close()
+    if not fixtures:
+        raise SystemExit("No seeded users found; run benchmarks/seed.py first.")
+    return fixtures
+
+
+def _dashboard(client, user_id, fixture, rng):
+    return client.get('/dashboard')
+
+
+def _dashboard_search(client, user_id, fixture, rng):
+    return client.get('/dashboard', query_string={'q': rng.choice(('coffee', 'salary', 'fuel', 'gym rent'))})
+
+
+def _add_transaction(client, user_id, fixture, rng):
+    return client.post('/add_transaction', data={
+        'amount': f"{rng.randint(100, 50000) / 100:.2f}",
+        'type': rng.choice(('income', 'expense')),
+        'description': 'Benchmark transaction',
+        'transaction_date': (date.today() - timedelta(days=rng.randrange(365))).isoformat(),
+        'category_id': str(rng.choice(fixture['categories'])) if fixture['categories'] else '',
+    })
+
+
+def _set_budget(client, user_id, fixture, rng):
+    start = date(rng.randint(2000, 2020), rng.randint(1, 12), 1)
+    return client.post('/set_budget', data={
+        'category_id': str(rng.choice(fixture['categories'])),
+        'budget_amount': f"{rng.randint(100, 5000)}.00",
+        'budget_start_date': start.isoformat(),
+    })
+
+
+def _edit_transaction(client, user_id, fixture, rng):
+    return client.get(f"/edit_transaction/{rng.choice(fixture['transactions'])}")
+
+
+SCENARIOS = {
+    'dashboard': _dashboard,
+    'dashboard_search': _dashboard_search,
+    'add_transaction': _add_transaction,
+    'set_budget': _set_budget,
+    'edit_transaction': _edit_transaction,
+}
+
+
+def run_scenario(name, fixtures, requests, concurrency, seed_value):
+    handler = SCENARIOS[name]
+    user_ids = sorted(fixtures)
+    local = threading.local()
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def one(index):
+        if not hasattr(local, 'client'):
+            local.client = finance_app.app.test_client()
+            local.rng = random.Random(seed_value + index)
+        user_id = user_ids[index % len(user_ids)]
+        with local.client.session_transaction() as flask_session:
+            flask_session['user_id'] = user_id
+        started = time.perf_counter()
+        response = handler(local.client, user_id, fixtures[user_id], local.rng)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if response.status_code >= 500:
+                errors[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    wall = time.perf_counter() - started
+
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': errors[0],
+        'throughput_rps': round(requests / wall, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        for metric in ('p95_ms', 'p99_ms'):
+            if before[metric] and result[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f"{name} {metric}: {before[metric]} -> {result[metric]}")
+        if before['throughput_rps'] and result['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name} throughput_rps: {before['throughput_rps']} -> {result['throughput_rps']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the finance-tracker routes.")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help="comma separated subset of: " + ', '.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=500, help="requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=20, help="untimed requests per scenario")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', metavar='PATH', help="write the results as a JSON baseline")
+    parser.add_argument('--compare', metavar='PATH', help="fail if results regress against this baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    finance_app.app.config['TESTING'] = True
+    fixtures = load_fixtures()
+
+    results = {}
+    for name in args.scenarios.split(','):
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario '{name}'")
+        if args.warmup:
+            run_scenario(name, fixtures, args.warmup, args.concurrency, args.seed)
+        results[name] = run_scenario(name, fixtures, args.requests, args.concurrency, args.seed)
+        print(f"{name:18} {json.dumps(results[name])}")
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'users': len(fixtures),
+        'scenarios': results,
+        'pool': db.pool.metrics(),
+    }
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"Saved results to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against baseline.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Seed a database with a synthetic, reproducible dataset.
+
+Point DB_NAME (and DB_HOST/DB_USER/DB_PASSWORD) at a scratch database, or
+set DB_BACKEND=sqlite and SQLITE_PATH to seed an embedded SQLite file;
+the schema is brought up to date with migrations.upgrade() (as
+`flask schema upgrade` does).
+
+    DB_NAME=finance_bench python benchmarks/seed.py --users 50 --transactions 20000
+    DB_BACKEND=sqlite SQLITE_PATH=/tmp/bench.sqlite3 python benchmarks/seed.py
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import date, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as finance_app  # noqa: E402
+import db  # noqa: E402
+import hashing  # noqa: E402
+import migrations  # noqa: E402
+import summary  # noqa: E402
+
+USERNAME_PREFIX = 'bench_user_'
+PASSWORD = 'bench-password'
+BATCH_SIZE = 5000
+
+_WORDS = ('grocer', 'fuel', 'coffee', 'rent', 'salary', 'insurance', 'pharmacy', 'airtime', 'gym',
+          'restaurant', 'electricity', 'water', 'books', 'hardware', 'transfer', 'dividend', 'refund')
+
+
+def _description(rng):
+    return f"{rng.choice(_WORDS).title()} {rng.choice(_WORDS)} #{rng.randint(1, 99999)}"
+
+
+def seed(users, categories, budgets, transactions, years, rounds, seed_value):
+    rng = random.Random(seed_value)
+    today = date.today()
+    first_day = today - timedelta(days=365 * years)
+    span = (today - first_day).days
+    pw_hash = hashing._generate(PASSWORD, rounds)
+
+    with db.pool.connection() as connection:
+        migrations.upgrade(connection, finance_app.app.config)
+
+        cursor = connection.cursor(buffered=True)
+        user_ids = []
+        for index in range(users):
+            username = f"{USERNAME_PREFIX}{index}"
+            cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute("INSERT INTO users (username, password) VALUES (%s, %s)", (username, pw_hash))
+                user_ids.append(cursor.lastrowid)
+            else:
+                user_ids.append(row[0])
+        connection.commit()
+
+        for user_id in user_ids:
+            cursor.executemany(
+                "INSERT INTO categories (name, user_id, createdBy) VALUES (%s, %s, %s)",
+                [(f"Category {n}", user_id, user_id) for n in range(categories)])
+            cursor.execute("SELECT category_id FROM categories WHERE user_id = %s", (user_id,))
+            category_ids = [row[0] for row in cursor.fetchall()]
+
+            budget_rows = []
+            for n in range(budgets):
+                month = today.replace(day=1) - timedelta(days=31 * (n // max(1, len(category_ids))))
+                start = month.replace(day=1)
+                end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+                budget_rows.append((user_id, category_ids[n % len(category_ids)],
+                                    Decimal(rng.randint(500, 20000)), start, end))
+            cursor.executemany(
+                "INSERT INTO budgets (user_id, category_id, amount, start_date, end_date) "
+                "VALUES (%s, %s, %s, %s, %s)", budget_rows)
+
+            batch = []
+            for _ in range(transactions):
+                transaction_type = 'income' if rng.random() < 0.15 else 'expense'
+                category_id = rng.choice(category_ids) if rng.random() < 0.9 else None
+                batch.append((user_id, Decimal(rng.randint(100, 500000)) / 100, transaction_type, category_id,
+                              _description(rng), first_day + timedelta(days=rng.randrange(span))))
+                if len(batch) >= BATCH_SIZE:
+                    _insert_transactions(cursor, batch)
+                    batch = []
+            _insert_transactions(cursor, batch)
+            connection.commit()
+            print(f"Seeded user {user_id}: {categories} categories, {budgets} budgets, "
+                  f"{transactions} transactions")
+
+        summary.rebuild(cursor)
+        connection.commit()
+        cursor.close()
+    return user_ids
+
+
+def _insert_transactions(cursor, rows):
+    if rows:
+        cursor.executemany(
+            "INSERT INTO transactions (user_id, amount, type, category_id, description, transaction_date) "
+            "VALUES (%s, %s, %s, %s, %s, %s)", rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a synthetic finance-tracker dataset.")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--categories', type=int, default=12, help="per user")
+    parser.add_argument('--budgets', type=int, default=24, help="per user")
+    parser.add_argument('--transactions', type=int, default=5000, help="per user")
+    parser.add_argument('--years', type=int, default=3, help="history spread over this many years")
+    parser.add_argument('--rounds', type=int, default=4, help="bcrypt cost for the seeded passwords")
+    parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args()
+    seed(args.users, args.categories, args.budgets, args.transactions, args.years, args.rounds, args.seed)
+
+
+if __name__ == '__main__':
+    main()
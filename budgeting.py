@@ -0,0 +1,154 @@
+"""Budget vs. actual: spend inside each budget's own date window.
+
+All of a user's budgets are evaluated in one query. It range-joins each
+budget to its category's expenses between start_date and end_date, served
+by the transactions(user_id, category_id, transaction_date) index. The
+join is also bounded by the earliest and latest budget dates as constants,
+which is what lets MySQL prune the date partitions it doesn't need.
+Derived figures (remaining, burn rate, projection) are computed from those
+rows so they can be recomputed for any day without going back to MySQL.
+
+A budget counts spend in its own currency. Expenses in other currencies
+are read per day by a second query and converted at each day's rate.
+"""
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+
+import fx
+
+BUDGET_BOUNDS_QUERY = """
+SELECT MIN(start_date) AS first_day, MAX(end_date) AS last_day
+FROM budgets
+WHERE user_id = %s
+"""
+
+BUDGET_SPEND_QUERY = """
+SELECT
+    b.budget_id, b.user_id, b.category_id, b.amount, b.currency, b.start_date, b.end_date,
+    c.name AS category_name,
+    COALESCE(SUM(t.amount), 0) AS spent
+FROM budgets b
+JOIN categories c ON b.category_id = c.category_id
+LEFT JOIN transactions t
+    ON t.user_id = b.user_id
+    AND t.category_id = b.category_id
+    AND t.transaction_date BETWEEN b.start_date AND b.end_date
+    AND t.type = 'expense'
+    AND t.currency = b.currency
+    AND t.transaction_date BETWEEN %s AND %s
+WHERE b.user_id = %s
+GROUP BY b.budget_id, b.user_id, b.category_id, b.amount, b.currency, b.start_date, b.end_date, c.name
+ORDER BY b.start_date DESC, c.name
+"""
+
+# Expenses within a budget's window in other currencies than the budget's
+FOREIGN_SPEND_QUERY = """
+SELECT b.budget_id, b.currency AS budget_currency, t.currency, t.transaction_date, SUM(t.amount) AS amount
+FROM budgets b
+JOIN transactions t
+    ON t.user_id = b.user_id
+    AND t.category_id = b.category_id
+    AND t.transaction_date BETWEEN b.start_date AND b.end_date
+    AND t.type = 'expense'
+    AND t.currency <> b.currency
+    AND t.transaction_date BETWEEN %s AND %s
+WHERE b.user_id = %s
+GROUP BY b.budget_id, b.currency, t.currency, t.transaction_date
+"""
+
+# The same rows without the spend, which a resident ledger supplies
+BUDGETS_QUERY = """
+SELECT
+    b.budget_id, b.user_id, b.category_id, b.amount, b.currency, b.start_date, b.end_date,
+    c.name AS category_name
+FROM budgets b
+JOIN categories c ON b.category_id = c.category_id
+WHERE b.user_id = %s
+ORDER BY b.start_date DESC, c.name
+"""
+
+_CENT = Decimal('0.01')
+
+
+def spend_params(user_id, bounds):
+    """BUDGET_SPEND_QUERY parameters, or None when the user has no budgets."""
+    if bounds is None or bounds['first_day'] is None:
+        return None
+    return bounds['first_day'], bounds['last_day'], user_id
+
+
+def load(cursor, user_id):
+    """Budget rows for `user_id`, each with the actual `spent` in its window."""
+    return add_foreign_spend(*load_spend(cursor, user_id))
+
+
+def load_spend(cursor, user_id):
+    """(BUDGET_SPEND_QUERY rows, FOREIGN_SPEND_QUERY rows) for `user_id`, before conversion.
+
+    Unlike the converted rows they don't depend on the rates, so they are
+    what gets cached.
+    """
+    cursor.execute(BUDGET_BOUNDS_QUERY, (user_id,))
+    params = spend_params(user_id, cursor.fetchone())
+    if params is None:
+        return [], []
+    cursor.execute(BUDGET_SPEND_QUERY, params)
+    rows = cursor.fetchall()
+    cursor.execute(FOREIGN_SPEND_QUERY, params)
+    return rows, cursor.fetchall()
+
+
+def add_foreign_spend(rows, foreign):
+    """Add FOREIGN_SPEND_QUERY rows, converted to each budget's currency, to BUDGET_SPEND_QUERY rows."""
+    if not foreign:
+        return rows
+    converted = fx.convert_amounts([row['amount'] for row in foreign], [row['currency'] for row in foreign],
+                                   [row['transaction_date'] for row in foreign],
+                                   [row['budget_currency'] for row in foreign])
+    extra = {}
+    for row, cents in zip(foreign, converted):
+        extra[row['budget_id']] = extra.get(row['budget_id'], 0) + cents
+    return [dict(row, spent=Decimal(str(row['spent'])) + Decimal(extra.get(row['budget_id'], 0)).scaleb(-2))
+            for row in rows]
+
+
+def progress(rows, today=None):
+    """Annotate budget rows with remaining amount, burn rate and projection.
+
+    burn_rate is spend per elapsed day of the period. projected_spend
+    extrapolates it to the end of the period, and projected_overspend is
+    how far that lands above the budget (0 when on track).
+    """
+    today = today or date.today()
+    evaluated = []
+    for row in rows:
+        amount = Decimal(row['amount'])
+        spent = Decimal(row['spent'])
+        total_days = (row['end_date'] - row['start_date']).days + 1
+        elapsed_days = min(max((today - row['start_date']).days + 1, 0), total_days)
+
+        burn_rate = (spent / elapsed_days) if elapsed_days else Decimal('0')
+        projected = spent if elapsed_days in (0, total_days) else burn_rate * total_days
+
+        if today < row['start_date']:
+            status = 'upcoming'
+        elif spent > amount:
+            status = 'over'
+        elif projected > amount:
+            status = 'at_risk'
+        else:
+            status = 'on_track'
+
+        evaluated.append(dict(
+            row,
+            spent=spent,
+            remaining=amount - spent,
+            percent_used=float(spent / amount * 100) if amount else 0.0,
+            total_days=total_days,
+            elapsed_days=elapsed_days,
+            burn_rate=burn_rate.quantize(_CENT, ROUND_HALF_UP),
+            projected_spend=projected.quantize(_CENT, ROUND_HALF_UP),
+            projected_overspend=max(projected - amount, Decimal('0')).quantize(_CENT, ROUND_HALF_UP),
+            status=status,
+        ))
+    return evaluated
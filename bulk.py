@@ -0,0 +1,188 @@
+"""Set-based re-categorize, re-date and delete over many transactions at once.
+
+An operation targets an explicit list of transaction IDs or every
+transaction matching a filter. The targets are locked with SELECT ... FOR
+UPDATE, changed with one UPDATE or DELETE per chunk of IDs and folded into
+the monthly rollup as a single delta. The caller commits once, so the whole
+set succeeds or fails together.
+"""
+from datetime import datetime
+
+import search
+import summary
+
+ACTIONS = ('categorize', 'redate', 'delete')
+MAX_IDS = 10000
+ID_CHUNK_SIZE = 1000
+
+_FILTER_KEYS = ('start', 'end', 'category', 'q')
+
+
+class BulkError(ValueError):
+    pass
+
+
+def _date(value, field):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise BulkError(f"'{field}' must be a YYYY-MM-DD date.")
+
+
+def parse(payload):
+    """Validate a JSON request body and return the operation as a dict."""
+    if not isinstance(payload, dict):
+        raise BulkError("Expected a JSON object.")
+    action = payload.get('action')
+    if action not in ACTIONS:
+        raise BulkError(f"'action' must be one of {', '.join(ACTIONS)}.")
+    operation = {'action': action, 'ids': None, 'filter': None}
+
+    ids, filters = payload.get('ids'), payload.get('filter')
+    if (ids is None) == (filters is None):
+        raise BulkError("Pass either 'ids' or 'filter'.")
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            raise BulkError("'ids' must be a list of transaction IDs.")
+        if not ids or len(ids) > MAX_IDS:
+            raise BulkError(f"'ids' must hold between 1 and {MAX_IDS} IDs.")
+        operation['ids'] = list(dict.fromkeys(ids))
+    else:
+        if not isinstance(filters, dict) or not filters or set(filters) - set(_FILTER_KEYS):
+            raise BulkError(f"'filter' must use at least one of {', '.join(_FILTER_KEYS)}.")
+        parsed = {}
+        if filters.get('start'):
+            parsed['start'] = _date(filters['start'], 'start')
+        if filters.get('end'):
+            parsed['end'] = _date(filters['end'], 'end')
+        category = filters.get('category')
+        if category is not None and category != 'none' and (not isinstance(category, int) or isinstance(category, bool)):
+            raise BulkError("'category' must be a category ID or 'none'.")
+        parsed['category'] = category
+        parsed['q'] = filters.get('q') or ''
+        operation['filter'] = parsed
+
+    if action == 'categorize':
+        if 'category_id' not in payload:
+            raise BulkError("'categorize' needs a 'category_id' (null to uncategorize).")
+        category_id = payload['category_id']
+        if category_id is not None and (not isinstance(category_id, int) or isinstance(category_id, bool)):
+            raise BulkError("'category_id' must be a category ID or null.")
+        operation['category_id'] = category_id
+    elif action == 'redate':
+        operation['transaction_date'] = _date(payload.get('transaction_date'), 'transaction_date')
+    return operation
+
+
+def _chunks(values):
+    for start in range(0, len(values), ID_CHUNK_SIZE):
+        yield values[start:start + ID_CHUNK_SIZE]
+
+
+def _in_clause(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def _lock_by_ids(cursor, user_id, ids):
+    rows = []
+    for chunk in _chunks(ids):
+        query = f"""
+        SELECT transaction_id, amount, type, category_id, transaction_date
+        FROM transactions
+        WHERE user_id = %s AND transaction_id IN ({_in_clause(chunk)})
+        FOR UPDATE
+        """
+        cursor.execute(query, [user_id] + chunk)
+        rows.extend(cursor.fetchall())
+    return rows
+
+
+def _lock_by_filter(cursor, user_id, filters, min_token_size):
+    query = """
+    SELECT t.transaction_id, t.amount, t.type, t.category_id, t.transaction_date
+    FROM transactions t
+    """
+    params = []
+    if filters['q']:
+        query += " LEFT JOIN categories c ON t.category_id = c.category_id"
+    query += " WHERE t.user_id = %s"
+    params.append(user_id)
+    if filters.get('start'):
+        query += " AND t.transaction_date >= %s"
+        params.append(filters['start'])
+    if filters.get('end'):
+        query += " AND t.transaction_date <= %s"
+        params.append(filters['end'])
+    if filters['category'] == 'none':
+        query += " AND t.category_id IS NULL"
+    elif filters['category'] is not None:
+        query += " AND t.category_id = %s"
+        params.append(filters['category'])
+    if filters['q']:
+        search_sql, search_params = search.search_clause(filters['q'], user_id, min_token_size)
+        query += search_sql
+        params.extend(search_params)
+    # One past the limit, to tell "exactly MAX_IDS" from "too many"
+    query += " ORDER BY t.transaction_id LIMIT %s FOR UPDATE"
+    params.append(MAX_IDS + 1)
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+    if len(rows) > MAX_IDS:
+        raise BulkError(f"The filter matches more than {MAX_IDS} transactions; narrow it down.")
+    return rows
+
+
+def apply(cursor, user_id, operation, min_token_size=search.MIN_TOKEN_SIZE):
+    """Run a parsed operation for `user_id` and return per-ID outcomes.
+
+    `cursor` must be a dictionary cursor; the caller owns the commit. IDs
+    that don't exist or belong to another user are reported as not_found.
+    """
+    action = operation['action']
+    if action == 'categorize' and operation['category_id'] is not None:
+        cursor.execute("SELECT 1 FROM categories WHERE category_id = %s AND user_id = %s",
+                       (operation['category_id'], user_id))
+        if cursor.fetchone() is None:
+            raise BulkError("Category not found.")
+
+    if operation['ids'] is not None:
+        targets = _lock_by_ids(cursor, user_id, operation['ids'])
+    else:
+        targets = _lock_by_filter(cursor, user_id, operation['filter'], min_token_size)
+
+    if action == 'categorize':
+        field, value, done = 'category_id', operation['category_id'], 'updated'
+    elif action == 'redate':
+        field, value, done = 'transaction_date', operation['transaction_date'], 'updated'
+    else:
+        field, value, done = None, None, 'deleted'
+
+    changed = [row for row in targets if field is None or row[field] != value]
+    changed_ids = [row['transaction_id'] for row in changed]
+    for chunk in _chunks(changed_ids):
+        if field is None:
+            query = f"DELETE FROM transactions WHERE user_id = %s AND transaction_id IN ({_in_clause(chunk)})"
+            cursor.execute(query, [user_id] + chunk)
+        else:
+            query = f"""
+            UPDATE transactions SET {field} = %s
+            WHERE user_id = %s AND transaction_id IN ({_in_clause(chunk)})
+            """
+            cursor.execute(query, [value, user_id] + chunk)
+
+    new_rows = [] if field is None else [dict(row, **{field: value}) for row in changed]
+    summary.record_changes(cursor, user_id, old_rows=changed, new_rows=new_rows)
+
+    outcome = {row['transaction_id']: 'unchanged' for row in targets}
+    outcome.update((transaction_id, done) for transaction_id in changed_ids)
+    requested = operation['ids'] if operation['ids'] is not None else [row['transaction_id'] for row in targets]
+    results = [{'transaction_id': transaction_id, 'status': outcome.get(transaction_id, 'not_found')}
+               for transaction_id in requested]
+    return {
+        'action': action,
+        'matched': len(targets),
+        done: len(changed_ids),
+        'unchanged': len(targets) - len(changed_ids),
+        'not_found': len(requested) - len(targets),
+        'results': results,
+    }
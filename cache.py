@@ -0,0 +1,191 @@
+"""Per-user read-through cache for rarely changing rows (categories, budgets).
+
+Entries live in an in-process LRU with a TTL. An optional shared backend
+(Redis, or anything with get/set/delete) sits behind it so several app
+processes can share loads. Write routes invalidate by (user, name).
+
+Invalidations only reach other processes through the shared backend. So
+without one the cache is only coherent when the app runs as a single
+process, which CACHE_SINGLE_PROCESS=1 declares. Otherwise nothing is
+cached: every get_or_load calls its loader, and every version() is new,
+so entries keyed by version never hit. Callers that hand state to other
+requests (ETags, ledgers) check `coherent` first.
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+user_cache = None
+
+
+class LRUCache:
+    def __init__(self, max_entries=2048, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (found, value)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Shared backend storing pickled values in Redis with a TTL."""
+
+    def __init__(self, url, ttl=300, prefix='finance-tracker:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = int(ttl)
+        self.prefix = prefix
+
+    def get(self, key):
+        data = self.client.get(self.prefix + key)
+        if data is None:
+            return False, None
+        return True, pickle.loads(data)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+class UserCache:
+    def __init__(self, local, shared=None, coherent=True):
+        self.local = local
+        self.shared = shared
+        # Whether an invalidation here reaches every process serving the user
+        self.coherent = coherent or shared is not None
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._generations = {}
+
+    @staticmethod
+    def _key(user_id, name):
+        return f"user:{user_id}:{name}"
+
+    def _count(self, name, outcome):
+        # Parameterised names ("analytics:<version>:...") count under their prefix
+        name = name.split(':', 1)[0]
+        with self._lock:
+            counters = self._counters.setdefault(name, {'hits': 0, 'shared_hits': 0, 'misses': 0,
+                                                        'invalidations': 0})
+            counters[outcome] += 1
+
+    def _lookup(self, key, name):
+        if not self.coherent:
+            self._count(name, 'misses')
+            return False, None
+        found, value = self.local.get(key)
+        if found:
+            self._count(name, 'hits')
+            return True, value
+        if self.shared is not None:
+            found, value = self.shared.get(key)
+            if found:
+                self._count(name, 'shared_hits')
+                self.local.set(key, value)
+                return True, value
+        self._count(name, 'misses')
+        return False, None
+
+    def _generation(self, key):
+        with self._lock:
+            return self._generations.get(key, 0)
+
+    def _store(self, key, value, generation):
+        # Don't store a value loaded before a concurrent invalidation landed
+        if not self.coherent or self._generation(key) != generation:
+            return
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    def get_or_load(self, user_id, name, loader):
+        """Return the cached value for (user_id, name), calling loader() on a miss."""
+        key = self._key(user_id, name)
+        found, value = self._lookup(key, name)
+        if found:
+            return value
+        generation = self._generation(key)
+        value = loader()
+        self._store(key, value, generation)
+        return value
+
+    async def get_or_load_async(self, user_id, name, loader):
+        """As get_or_load, for a coroutine function `loader`."""
+        key = self._key(user_id, name)
+        found, value = self._lookup(key, name)
+        if found:
+            return value
+        generation = self._generation(key)
+        value = await loader()
+        self._store(key, value, generation)
+        return value
+
+    def version(self, user_id, namespace):
+        """A token that changes whenever `invalidate(user_id, namespace)` is called.
+
+        Useful for families of entries (one per query parameter set) that
+        can't be invalidated one by one: include the token in their names.
+        """
+        return self.get_or_load(user_id, namespace, time.time_ns)
+
+    def invalidate(self, user_id, *names):
+        for name in names:
+            key = self._key(user_id, name)
+            with self._lock:
+                self._generations[key] = self._generations.get(key, 0) + 1
+            self.local.delete(key)
+            if self.shared is not None:
+                self.shared.delete(key)
+            self._count(name, 'invalidations')
+
+    def metrics(self):
+        with self._lock:
+            counters = {name: dict(values) for name, values in self._counters.items()}
+        return {'entries': len(self.local), 'shared_backend': self.shared is not None, 'coherent': self.coherent,
+                'by_name': counters}
+
+
+def init_app(app):
+    global user_cache
+    shared = None
+    if app.config.get('CACHE_REDIS_URL'):
+        shared = RedisBackend(app.config['CACHE_REDIS_URL'], ttl=app.config.get('CACHE_TTL', 300))
+    # With a shared backend the local copy only bridges short bursts, since
+    # invalidations from other processes cannot reach it.
+    local_ttl = app.config.get('CACHE_LOCAL_TTL', 5.0) if shared else app.config.get('CACHE_TTL', 300)
+    user_cache = UserCache(LRUCache(app.config.get('CACHE_MAX_ENTRIES', 2048), local_ttl), shared,
+                           coherent=bool(app.config.get('CACHE_SINGLE_PROCESS')))
+    if not user_cache.coherent:
+        print("⚠️ No CACHE_REDIS_URL and CACHE_SINGLE_PROCESS is not set: per-user caching, ETags and "
+              "ledgers are off.")
+    return user_cache
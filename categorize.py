@@ -0,0 +1,459 @@
+"""Rule-based categorization of transactions that arrive without a category.
+
+Users define rules in `category_rules`, each assigning a category when it
+matches:
+
+- 'substring': the description contains `pattern` (case-insensitive);
+- 'regex': `pattern` is found in the description (case-insensitive);
+- 'amount': the amount is within [min_amount, max_amount].
+
+Any rule can also be bounded by amount and limited to one `type`
+(income or expense). Rules are tried in (priority, rule_id) order and the
+first that matches wins.
+
+A user's rules are compiled into one Matcher: an Aho-Corasick automaton
+over every substring pattern, so a description is scanned once however
+many substrings there are. Most regexes contain a literal any match must
+include ('uber' in r'uber\s*eats'); those literals go into the same
+automaton, and a regex is only searched when its literal was found. The
+remaining regexes are joined into one merged regex, which rules them all
+out in a single search. Amount rules are looked up by binary search over
+their bounds. Compiled matchers are kept per process, keyed by the
+user's 'matcher' version in the cache (which rule writes bump).
+
+Matchers run when a transaction is added or imported without a category,
+and `backfill` applies them to a user's uncategorized transactions in
+both storage tiers.
+"""
+import heapq
+import re
+import time
+from bisect import bisect_left
+from collections import deque
+from decimal import Decimal
+
+import cache
+import partitions
+import summary
+
+KINDS = ('substring', 'regex', 'amount')
+MAX_RULES = 5000
+MAX_PATTERN = 300
+DEFAULT_BATCH_SIZE = 1000
+
+# Regex patterns are joined into one alternation, where group names and
+# numbered backreferences from different patterns would clash
+_GROUP_REFERENCE_RE = re.compile(r"\(\?P[<=]|\\[1-9]|\\g<")
+
+# Characters a regex matches literally, and escapes of classes and anchors
+_LITERAL_CHARS = frozenset(chr(code) for code in range(32, 127)) - set('\\.^$*+?{}[]()|')
+_CLASS_ESCAPES = frozenset('dDwWsSbBAZ')
+_MIN_LITERAL = 3
+
+# Case-insensitive matching by case folding; IGNORECASE also matches the
+# dotless i to 'i', which case folding leaves as it is
+_FOLD_TABLE = {ord('ı'): 'i'}
+
+CREATE_RULES_QUERIES = {
+    'mysql': """
+    CREATE TABLE IF NOT EXISTS category_rules (
+        rule_id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        category_id INT NOT NULL,
+        kind ENUM('substring','regex','amount') NOT NULL,
+        pattern VARCHAR(300),
+        min_amount DECIMAL(10,2),
+        max_amount DECIMAL(10,2),
+        type ENUM('income','expense'),
+        priority INT NOT NULL DEFAULT 0,
+        createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (category_id) REFERENCES categories(category_id)
+    );
+    """,
+    'sqlite': """
+    CREATE TABLE IF NOT EXISTS category_rules (
+        rule_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INT NOT NULL REFERENCES users(id),
+        category_id INT NOT NULL REFERENCES categories(category_id),
+        kind TEXT NOT NULL CHECK (kind IN ('substring', 'regex', 'amount')),
+        pattern VARCHAR(300),
+        min_amount DECIMAL(10,2),
+        max_amount DECIMAL(10,2),
+        type TEXT CHECK (type IN ('income', 'expense')),
+        priority INT NOT NULL DEFAULT 0,
+        createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+}
+
+RULES_QUERY = """
+SELECT r.rule_id, r.category_id, r.kind, r.pattern, r.min_amount, r.max_amount, r.type, r.priority,
+       c.name AS category_name
+FROM category_rules r
+JOIN categories c ON r.category_id = c.category_id
+WHERE r.user_id = %s
+ORDER BY r.priority, r.rule_id
+"""
+
+# One batch of a tier's uncategorized rows, locked so the rollup delta matches what is updated
+_UNCATEGORIZED_QUERY = """
+SELECT transaction_id, amount, type, category_id, description, transaction_date
+FROM {table}
+WHERE user_id = %s AND category_id IS NULL AND transaction_id > %s
+ORDER BY transaction_id
+LIMIT %s
+FOR UPDATE
+"""
+
+matchers = None
+
+
+class RuleError(ValueError):
+    pass
+
+
+def _amount(value, field):
+    if value in (None, ''):
+        return None
+    try:
+        amount = Decimal(str(value)).quantize(Decimal('0.01'))
+    except ArithmeticError:
+        raise RuleError(f"'{field}' must be an amount.")
+    if not amount.is_finite() or amount < 0:
+        raise RuleError(f"'{field}' must be a positive amount.")
+    return amount
+
+
+def parse(form):
+    """Validate a rule from form fields; returns the columns to store or raises RuleError."""
+    kind = form.get('kind')
+    if kind not in KINDS:
+        raise RuleError(f"'kind' must be one of {', '.join(KINDS)}.")
+    try:
+        category_id = int(form.get('category_id') or '')
+        priority = int(form.get('priority') or 0)
+    except ValueError:
+        raise RuleError("'category_id' and 'priority' must be integers.")
+    transaction_type = form.get('type') or None
+    if transaction_type not in (None, 'income', 'expense'):
+        raise RuleError("'type' must be income or expense.")
+    min_amount = _amount(form.get('min_amount'), 'min_amount')
+    max_amount = _amount(form.get('max_amount'), 'max_amount')
+    if min_amount is not None and max_amount is not None and min_amount > max_amount:
+        raise RuleError("'min_amount' is above 'max_amount'.")
+
+    pattern = (form.get('pattern') or '').strip() or None
+    if kind == 'amount':
+        pattern = None
+        if min_amount is None and max_amount is None:
+            raise RuleError("An amount rule needs 'min_amount' or 'max_amount'.")
+    elif pattern is None or len(pattern) > MAX_PATTERN:
+        raise RuleError(f"A {kind} rule needs a pattern of at most {MAX_PATTERN} characters.")
+    elif kind == 'regex':
+        try:
+            compiled = re.compile(pattern, re.IGNORECASE)
+        except re.error as err:
+            raise RuleError(f"Invalid regular expression: {err}.")
+        if compiled.groupindex or _GROUP_REFERENCE_RE.search(pattern):
+            raise RuleError("Regular expressions can't use named groups or backreferences.")
+    return {
+        'category_id': category_id,
+        'kind': kind,
+        'pattern': pattern,
+        'min_amount': min_amount,
+        'max_amount': max_amount,
+        'type': transaction_type,
+        'priority': priority,
+    }
+
+
+def _fold(text):
+    return text.casefold().translate(_FOLD_TABLE)
+
+
+def required_literal(pattern):
+    """The longest run of ASCII characters every match of regex `pattern` contains, or None.
+
+    Only the pattern's leading stretch outside groups, classes and
+    repetition counts is read; a pattern with an alternation has none.
+    """
+    if '|' in pattern:
+        return None
+    runs, run = [], ''
+    position = 0
+    while position < len(pattern):
+        char = pattern[position]
+        position += 1
+        if char == '\\':
+            escaped = pattern[position:position + 1]
+            position += 1
+            if escaped.isascii() and escaped.isprintable() and not escaped.isalnum():
+                run += escaped
+                continue
+            if escaped not in _CLASS_ESCAPES:
+                break
+            runs.append(run)
+            run = ''
+        elif char in _LITERAL_CHARS:
+            run += char
+        elif char in '*?{':
+            # The character before is optional (and what follows a count isn't read)
+            runs.append(run[:-1])
+            run = ''
+            if char == '{':
+                break
+        elif char in '+.^$':
+            runs.append(run)
+            run = ''
+        else:
+            break
+    runs.append(run)
+    longest = max(runs, key=len)
+    return longest if len(longest) >= _MIN_LITERAL else None
+
+
+class Automaton:
+    """Aho-Corasick over case-folded patterns; `ranks(text)` yields the ranks of every pattern found."""
+
+    def __init__(self, patterns):
+        # patterns: [(pattern, rank)]
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for pattern, rank in patterns:
+            node = 0
+            for char in _fold(pattern):
+                child = self._goto[node].get(char)
+                if child is None:
+                    child = self._goto[node][char] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                node = child
+            self._out[node] += (rank,)
+
+        # Breadth-first, so every node's failure link is final before its children need it
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] += self._out[self._fail[child]]
+
+    def __len__(self):
+        return len(self._goto) - 1
+
+    def ranks(self, text):
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for char in _fold(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                yield from out[node]
+
+
+class AmountIndex:
+    """The first amount rule (by rank) whose range holds an amount, found by binary search."""
+
+    def __init__(self, rules):
+        # rules: [(rank, min_amount, max_amount, type)], bounds None when open
+        self._points = sorted({bound for _, low, high, _ in rules for bound in (low, high) if bound is not None})
+        # Slot 2i is the gap below points[i], 2i + 1 is points[i] itself,
+        # and the last slot is above every point
+        slots = 2 * len(self._points) + 1
+        starts = [[] for _ in range(slots)]
+        for rule in rules:
+            starts[0 if rule[1] is None else self._slot(rule[1])].append(rule)
+
+        # Per type, a sweep over the slots keeps the covering rules in a heap by rank
+        self._first = {}
+        for transaction_type in (None, 'income', 'expense'):
+            heap, first = [], []
+            for slot in range(slots):
+                for rank, _, high, rule_type in starts[slot]:
+                    if rule_type is None or rule_type == transaction_type:
+                        heapq.heappush(heap, (rank, slots - 1 if high is None else self._slot(high)))
+                while heap and heap[0][1] < slot:
+                    heapq.heappop(heap)
+                first.append(heap[0][0] if heap else None)
+            self._first[transaction_type] = first
+
+    def _slot(self, amount):
+        index = bisect_left(self._points, amount)
+        return 2 * index + (index < len(self._points) and self._points[index] == amount)
+
+    def first(self, amount, transaction_type):
+        first = self._first.get(transaction_type, self._first[None])
+        return first[self._slot(amount)]
+
+
+class Matcher:
+    """A user's rules compiled for matching; `match` returns a category id or None."""
+
+    def __init__(self, rules):
+        rules = sorted(rules, key=lambda rule: (rule['priority'], rule['rule_id']))
+        self.size = len(rules)
+        # Per rank: (category_id, min_amount, max_amount, type)
+        self._conditions = [(rule['category_id'], rule['min_amount'], rule['max_amount'], rule['type'])
+                            for rule in rules]
+        keywords = []
+        # Regexes behind a literal in the automaton, by rank; the others are searched merged
+        self._checks = {}
+        self._regexes = []
+        for rank, rule in enumerate(rules):
+            if rule['kind'] == 'substring':
+                keywords.append((rule['pattern'], rank))
+            elif rule['kind'] == 'regex':
+                regex = re.compile(rule['pattern'], re.IGNORECASE)
+                literal = required_literal(rule['pattern'])
+                if literal is None:
+                    self._regexes.append((rank, regex))
+                else:
+                    keywords.append((literal, rank))
+                    self._checks[rank] = regex
+        self._automaton = Automaton(keywords)
+        self._merged = None
+        if self._regexes:
+            self._merged = re.compile('|'.join(f"(?:{regex.pattern})" for _, regex in self._regexes),
+                                      re.IGNORECASE)
+        self._amounts = AmountIndex([(rank, rule['min_amount'], rule['max_amount'], rule['type'])
+                                     for rank, rule in enumerate(rules) if rule['kind'] == 'amount'])
+
+    def __len__(self):
+        return self.size
+
+    def _fits(self, rank, amount, transaction_type):
+        _, low, high, rule_type = self._conditions[rank]
+        return ((rule_type is None or rule_type == transaction_type)
+                and (low is None or amount >= low) and (high is None or amount <= high))
+
+    def match(self, description, amount, transaction_type):
+        """The category of the first rule matching the transaction, or None."""
+        amount = Decimal(str(amount))
+        best = self.size
+        checks = set()
+        for rank in self._automaton.ranks(description):
+            if rank < best and self._fits(rank, amount, transaction_type):
+                if rank in self._checks:
+                    checks.add(rank)
+                else:
+                    best = rank
+        for rank in sorted(checks):
+            if rank >= best:
+                break
+            if self._checks[rank].search(description):
+                best = rank
+                break
+        # One search rules out every regex at once; only on a hit are they tried one by one
+        if self._regexes and self._regexes[0][0] < best and self._merged.search(description):
+            for rank, regex in self._regexes:
+                if rank >= best:
+                    break
+                if self._fits(rank, amount, transaction_type) and regex.search(description):
+                    best = rank
+                    break
+        rank = self._amounts.first(amount, transaction_type)
+        if rank is not None and rank < best:
+            best = rank
+        return self._conditions[best][0] if best < self.size else None
+
+    def apply(self, rows):
+        """Set category_id on the rows that have none and match a rule; returns how many were set."""
+        matched = 0
+        for row in rows:
+            if row['category_id'] is None:
+                row['category_id'] = self.match(row['description'], row['amount'], row['type'])
+                matched += row['category_id'] is not None
+        return matched
+
+
+class Matchers:
+    """Compiled matchers per user, rebuilt when the user's rules version changes."""
+
+    def __init__(self, max_entries=1000, ttl=3600.0):
+        self._matchers = cache.LRUCache(max_entries, ttl)
+        self._compiles = 0
+        self._compile_seconds = 0.0
+
+    def get(self, user_id, loader):
+        """The user's Matcher, calling loader() for their rules when it must be (re)compiled."""
+        version = cache.user_cache.version(user_id, 'matcher')
+        found, entry = self._matchers.get(user_id)
+        if found and entry[0] == version:
+            return entry[1]
+        started = time.perf_counter()
+        matcher = Matcher(loader())
+        self._compile_seconds += time.perf_counter() - started
+        self._compiles += 1
+        self._matchers.set(user_id, (version, matcher))
+        return matcher
+
+    def metrics(self):
+        return {
+            'users': len(self._matchers),
+            'compiles': self._compiles,
+            'compile_seconds': round(self._compile_seconds, 3),
+        }
+
+
+def backfill(connection, user_id, matcher, batch_size=DEFAULT_BATCH_SIZE):
+    """Categorize a user's uncategorized transactions in both tiers; returns (scanned, categorized).
+
+    Rows are read and updated `batch_size` at a time, each batch folded
+    into the rollup and committed on its own.
+    """
+    scanned = categorized = 0
+    if not matcher:
+        return scanned, categorized
+    cursor = connection.cursor(dictionary=True, buffered=True)
+    try:
+        for table in (partitions.ARCHIVE_TABLE, partitions.HOT_TABLE):
+            last_id = 0
+            while True:
+                cursor.execute(_UNCATEGORIZED_QUERY.format(table=table), (user_id, last_id, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    connection.commit()
+                    break
+                last_id = rows[-1]['transaction_id']
+                scanned += len(rows)
+                old_rows = [dict(row) for row in rows]
+                matcher.apply(rows)
+                changed = [(old, new) for old, new in zip(old_rows, rows) if new['category_id'] is not None]
+                by_category = {}
+                for _, row in changed:
+                    by_category.setdefault(row['category_id'], []).append(row['transaction_id'])
+                for category_id, ids in by_category.items():
+                    placeholders = ', '.join(['%s'] * len(ids))
+                    cursor.execute(f"UPDATE {table} SET category_id = %s "
+                                   f"WHERE user_id = %s AND transaction_id IN ({placeholders})",
+                                   [category_id, user_id] + ids)
+                summary.record_changes(cursor, user_id, old_rows=[old for old, _ in changed],
+                                       new_rows=[new for _, new in changed])
+                connection.commit()
+                categorized += len(changed)
+                if len(rows) < batch_size:
+                    break
+    finally:
+        connection.rollback()
+        cursor.close()
+    return scanned, categorized
+
+
+def users_with_rules(cursor):
+    cursor.execute("SELECT DISTINCT user_id FROM category_rules ORDER BY user_id")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def init_app(app):
+    global matchers
+    matchers = Matchers(app.config.get('CATEGORIZE_MAX_MATCHERS', 1000))
+    return matchers
@@ -0,0 +1,228 @@
+"""Pooled database connections, checked out once per request and kept on flask.g.
+
+DB_BACKEND picks the backend: MySQL (the default) through ConnectionPool,
+or an embedded SQLite file through sqlite_store.SQLitePool. `dialect`
+names the one in use, for the few statements the two write differently.
+"""
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector.errors import PoolError
+from flask import g
+
+import sqlite_store
+
+# Catch these rather than either driver's own exception classes
+Error = (mysql.connector.Error, sqlite3.Error)
+IntegrityError = (mysql.connector.IntegrityError, sqlite3.IntegrityError)
+DataError = (mysql.connector.DataError, sqlite3.DataError)
+
+pool = None
+dialect = 'mysql'
+
+
+class ConnectionPool:
+    """A fixed-size pool of MySQL connections with a bounded overflow.
+
+    `size` connections are kept open between requests; up to `max_overflow`
+    extra connections are opened under load and closed again on release.
+    A checkout that cannot be served within `timeout` seconds raises PoolError.
+    """
+
+    def __init__(self, config, size=5, max_overflow=10, timeout=10.0, check_interval=30.0, recycle=3600.0):
+        self.config = config
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.recycle = recycle
+        # Optional callable applied to connections on checkout (e.g. instrumentation)
+        self.wrapper = None
+
+        self._idle = deque()
+        self._cond = threading.Condition()
+        self._opened = 0
+        self._checked_out = 0
+
+        self._acquires = 0
+        self._timeouts = 0
+        self._health_check_failures = 0
+        self._wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+
+    def _connect(self):
+        connection = mysql.connector.connect(**self.config)
+        connection._pool_created_at = connection._pool_used_at = time.monotonic()
+        return connection
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except mysql.connector.Error:
+            pass
+
+    def _healthy(self, connection):
+        now = time.monotonic()
+        if now - connection._pool_created_at > self.recycle:
+            return False
+        # Only ping connections that have been idle for a while; a ping is a
+        # round trip of its own and recently used connections are almost
+        # always still alive.
+        if now - connection._pool_used_at < self.check_interval:
+            return True
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except mysql.connector.Error:
+            return False
+
+    def acquire(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        connection = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    connection = self._idle.pop()
+                    break
+                if self._opened < self.size + self.max_overflow:
+                    self._opened += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolError(
+                        f"Connection pool exhausted: {self._opened} connections in use, "
+                        f"waited {self.timeout:.1f}s")
+                self._cond.wait(remaining)
+            self._checked_out += 1
+
+        try:
+            if connection is not None and not self._healthy(connection):
+                self._discard(connection)
+                with self._cond:
+                    self._health_check_failures += 1
+                connection = None
+            if connection is None:
+                connection = self._connect()
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._checked_out -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - started
+        with self._cond:
+            self._acquires += 1
+            self._wait_seconds += waited
+            self._max_wait_seconds = max(self._max_wait_seconds, waited)
+        return self.wrapper(connection) if self.wrapper else connection
+
+    def release(self, connection):
+        connection = getattr(connection, 'raw', connection)
+        keep = True
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+        except mysql.connector.Error:
+            keep = False
+
+        with self._cond:
+            self._checked_out -= 1
+            if keep and len(self._idle) + self._checked_out < self.size:
+                connection._pool_used_at = time.monotonic()
+                self._idle.append(connection)
+            else:
+                self._opened -= 1
+                keep = False
+            self._cond.notify()
+        if not keep:
+            self._discard(connection)
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._opened -= len(idle)
+        for connection in idle:
+            self._discard(connection)
+
+    def metrics(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'timeout': self.timeout,
+                'open': self._opened,
+                'idle': len(self._idle),
+                'checked_out': self._checked_out,
+                'overflow_in_use': max(0, self._opened - self.size),
+                'acquires': self._acquires,
+                'timeouts': self._timeouts,
+                'health_check_failures': self._health_check_failures,
+                'avg_wait_ms': (self._wait_seconds / self._acquires * 1000) if self._acquires else 0.0,
+                'max_wait_ms': self._max_wait_seconds * 1000,
+            }
+
+
+def init_app(app, config):
+    global pool, dialect
+    dialect = app.config.get('DB_BACKEND', 'mysql')
+    if dialect == 'sqlite':
+        pool = sqlite_store.SQLitePool(
+            app.config['SQLITE_PATH'],
+            size=app.config.get('DB_POOL_SIZE', 5),
+            timeout=app.config.get('DB_POOL_TIMEOUT', 10.0),
+        )
+    elif dialect == 'mysql':
+        pool = ConnectionPool(
+            config,
+            size=app.config.get('DB_POOL_SIZE', 5),
+            max_overflow=app.config.get('DB_POOL_MAX_OVERFLOW', 10),
+            timeout=app.config.get('DB_POOL_TIMEOUT', 10.0),
+            check_interval=app.config.get('DB_POOL_CHECK_INTERVAL', 30.0),
+            recycle=app.config.get('DB_POOL_RECYCLE', 3600.0),
+        )
+    else:
+        raise ValueError(f"Unknown DB_BACKEND '{dialect}'; use 'mysql' or 'sqlite'.")
+    app.teardown_appcontext(close_db)
+    return pool
+
+
+def get_db():
+    if 'db' not in g:
+        started = time.perf_counter()
+        g.db = pool.acquire()
+        g.db_acquire_seconds = time.perf_counter() - started
+        g.db_cursors = []
+    return g.db
+
+
+def get_cursor(dictionary=False):
+    cursor = get_db().cursor(dictionary=dictionary, buffered=True)
+    g.db_cursors.append(cursor)
+    return cursor
+
+
+def close_db(exc=None):
+    connection = g.pop('db', None)
+    if connection is None:
+        return
+    for cursor in g.pop('db_cursors', []):
+        try:
+            cursor.close()
+        except Error:
+            pass
+    pool.release(connection)
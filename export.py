@@ -0,0 +1,151 @@
+"""Streaming export of a user's transactions as CSV, NDJSON or Parquet.
+
+Rows are read from an unbuffered cursor in `fetchmany` chunks and encoded
+as they arrive, so memory use does not depend on how many rows match.
+Archived years are exported too: the archive tier is read first, then the
+hot table, each in date order.
+"""
+import csv
+import io
+import json
+
+import db
+import partitions
+
+CHUNK_SIZE = 2000
+
+COLUMNS = ('transaction_id', 'transaction_date', 'type', 'amount', 'currency', 'category_id', 'category_name',
+           'description')
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def build_query(user_id, start_date=None, end_date=None, category_id=None, uncategorized=False):
+    """[(query, params)] to run in order, one per storage tier."""
+    query = """
+    SELECT t.transaction_id, t.transaction_date, t.type, t.amount, t.currency, t.category_id,
+           c.name AS category_name, t.description
+    FROM {table} t
+    LEFT JOIN categories c ON t.category_id = c.category_id
+    WHERE t.user_id = %s
+    """
+    params = [user_id]
+    if start_date:
+        query += " AND t.transaction_date >= %s"
+        params.append(start_date)
+    if end_date:
+        query += " AND t.transaction_date <= %s"
+        params.append(end_date)
+    if uncategorized:
+        query += " AND t.category_id IS NULL"
+    elif category_id is not None:
+        query += " AND t.category_id = %s"
+        params.append(category_id)
+    query += " ORDER BY t.transaction_date, t.transaction_id"
+    return partitions.tier_queries(query, params)
+
+
+def _rows(queries):
+    # A dedicated connection rather than the request's: the response body is
+    # produced after the view returns, so it must outlive the request scope.
+    with db.pool.connection() as connection:
+        for query, params in queries:
+            cursor = connection.cursor(buffered=False)
+            try:
+                cursor.execute(query, params)
+                while True:
+                    chunk = cursor.fetchmany(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                # Drain anything left if the client went away mid-stream
+                try:
+                    if cursor.with_rows:
+                        cursor.fetchall()
+                finally:
+                    cursor.close()
+
+
+def _csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue()
+    for chunk in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+
+
+def _ndjson(chunks):
+    for chunk in chunks:
+        yield ''.join(json.dumps(dict(zip(COLUMNS, row)), default=str) + '\n' for row in chunk)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last drain."""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data, self._parts = b''.join(self._parts), []
+        return data
+
+
+def _parquet(chunks):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('transaction_id', pa.int64()),
+        ('transaction_date', pa.date32()),
+        ('type', pa.string()),
+        ('amount', pa.decimal128(10, 2)),
+        ('currency', pa.string()),
+        ('category_id', pa.int64()),
+        ('category_name', pa.string()),
+        ('description', pa.string()),
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for chunk in chunks:
+            columns = list(zip(*chunk))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def parquet_available():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def stream(fmt, queries):
+    encoder = {'csv': _csv, 'ndjson': _ndjson, 'parquet': _parquet}[fmt]
+    return encoder(_rows(queries))
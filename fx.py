@@ -0,0 +1,399 @@
+"""Currencies, and the historical exchange rates used to report in one of them.
+
+Every transaction and budget carries a currency (ISO 4217 code; columns
+added by migration 4, defaulting to DEFAULT_CURRENCY). Dashboard totals
+and spend per category are reported in REPORTING_CURRENCY: amounts in
+other currencies are converted at the rate for their own date.
+
+Rates live in the fx_rates table as units of `currency` per one unit of
+FX_BASE_CURRENCY (the base of the ECB reference rates by default), and are
+imported from files with `flask fx import`, so no network access is
+needed. Each process keeps them in memory as a RateTable: per currency,
+a sorted array of date ordinals and one of rates. A conversion looks up
+all of its rows at once with one searchsorted per currency involved,
+taking the latest rate on or before each date.
+
+Every import bumps a version stored in fx_rates_version. Processes read
+it at most every FX_CHECK_INTERVAL seconds and reload their table when
+it has moved, which is how an import reaches running servers. Anything
+cached from converted amounts includes `version()` in its key (the API
+ETags do).
+"""
+import csv
+import re
+import threading
+import time
+from bisect import bisect_right
+from datetime import date, datetime
+from decimal import Decimal
+
+import db
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_CURRENCY = 'ZAR'
+DEFAULT_BASE = 'EUR'
+REPORTING_CURRENCY = DEFAULT_CURRENCY
+SYMBOLS = {'ZAR': 'R', 'USD': '$', 'EUR': '€', 'GBP': '£', 'JPY': '¥'}
+IMPORT_BATCH_SIZE = 1000
+
+_CODE_RE = re.compile(r"[A-Z]{3}")
+
+CREATE_FX_RATES_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS fx_rates (
+    currency CHAR(3) NOT NULL,
+    rate_date DATE NOT NULL,
+    rate NUMERIC(18,8) NOT NULL,
+    PRIMARY KEY (currency, rate_date)
+);
+"""
+
+CREATE_FX_RATES_VERSION_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS fx_rates_version (
+    id INT PRIMARY KEY,
+    version BIGINT NOT NULL
+);
+"""
+
+_BUMP_VERSION_QUERIES = {
+    'mysql': """
+    INSERT INTO fx_rates_version (id, version) VALUES (1, 1)
+    ON DUPLICATE KEY UPDATE version = version + 1
+    """,
+    'sqlite': """
+    INSERT INTO fx_rates_version (id, version) VALUES (1, 1)
+    ON CONFLICT (id) DO UPDATE SET version = version + 1
+    """,
+}
+
+_UPSERT_QUERIES = {
+    'mysql': """
+    INSERT INTO fx_rates (currency, rate_date, rate) VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE rate = VALUES(rate)
+    """,
+    'sqlite': """
+    INSERT INTO fx_rates (currency, rate_date, rate) VALUES (%s, %s, %s)
+    ON CONFLICT (currency, rate_date) DO UPDATE SET rate = excluded.rate
+    """,
+}
+
+rates = None
+
+
+class MissingRate(ValueError):
+    """Amounts in `currencies` can't be converted: there are no rates for them."""
+
+    def __init__(self, currencies):
+        self.currencies = sorted(currencies)
+        super().__init__(f"No exchange rates for {', '.join(self.currencies)}.")
+
+
+def check_code(code):
+    """Return `code` normalized to upper case, or raise ValueError if it isn't a currency code."""
+    code = (code or '').strip().upper()
+    if not _CODE_RE.fullmatch(code):
+        raise ValueError(f"Invalid currency code {code!r}.")
+    return code
+
+
+def format_money(amount, currency=None):
+    currency = currency or DEFAULT_CURRENCY
+    symbol = SYMBOLS.get(currency)
+    if symbol is None:
+        return f"{currency} {amount:.2f}"
+    return f"{symbol}{amount:.2f}"
+
+
+def read_version(cursor):
+    cursor.execute("SELECT version FROM fx_rates_version WHERE id = 1")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+class RateTable:
+    def __init__(self, base, series, version=0):
+        # series: {currency: (ascending date ordinals, rates)}
+        self.base = base
+        self.version = version
+        self._series = {}
+        for currency, (days, values) in series.items():
+            if np is not None:
+                days, values = np.asarray(days, dtype=np.int32), np.asarray(values, dtype=np.float64)
+            self._series[currency] = (days, values)
+
+    @classmethod
+    def load(cls, cursor, base):
+        version = read_version(cursor)
+        cursor.execute("SELECT currency, rate_date, rate FROM fx_rates ORDER BY currency, rate_date")
+        series = {}
+        for currency, rate_date, rate in cursor.fetchall():
+            if isinstance(rate_date, str):
+                rate_date = date.fromisoformat(rate_date)
+            days, values = series.setdefault(currency, ([], []))
+            days.append(rate_date.toordinal())
+            values.append(float(rate))
+        return cls(base, series, version)
+
+    def currencies(self):
+        """Codes with rates: the base is one only once some other currency has rates against it."""
+        if not self._series:
+            return []
+        return sorted(set(self._series) | {self.base})
+
+    def _rates(self, currency, days):
+        """Units of `currency` per base unit on each of `days` (latest rate on or before; else the first)."""
+        if currency == self.base:
+            return np.ones(len(days)) if np is not None else [1.0] * len(days)
+        known_days, values = self._series[currency]
+        if np is not None:
+            index = np.searchsorted(known_days, days, side='right') - 1
+            return values[np.maximum(index, 0)]
+        return [values[max(bisect_right(known_days, day) - 1, 0)] for day in days]
+
+    def convert(self, cents, from_currencies, days, to_currencies):
+        """Convert integer cents row by row; returns a list of integer cents.
+
+        `from_currencies` and `to_currencies` are per-row codes, or a single
+        code for every row; `days` are date ordinals. Raises MissingRate if
+        a currency other than the base has no rates.
+        """
+        rows = len(cents)
+        if isinstance(from_currencies, str):
+            from_currencies = [from_currencies] * rows
+        if isinstance(to_currencies, str):
+            to_currencies = [to_currencies] * rows
+        missing = {code for code in set(from_currencies) | set(to_currencies)
+                   if code != self.base and code not in self._series}
+        if missing:
+            raise MissingRate(missing)
+        if not rows:
+            return []
+
+        if np is None:
+            factors = [1.0] * rows
+            for codes, power in ((from_currencies, -1), (to_currencies, 1)):
+                for code in set(codes):
+                    positions = [i for i, row_code in enumerate(codes) if row_code == code]
+                    for i, rate in zip(positions, self._rates(code, [days[i] for i in positions])):
+                        factors[i] *= rate ** power
+            return [round(amount * factor) for amount, factor in zip(cents, factors)]
+
+        days = np.asarray(days, dtype=np.int32)
+        factors = np.ones(rows)
+        # One vectorized lookup per distinct currency, not per row
+        for codes, power in ((from_currencies, -1), (to_currencies, 1)):
+            codes = np.asarray(codes)
+            for code in np.unique(codes):
+                mask = codes == code
+                factors[mask] *= self._rates(str(code), days[mask]) ** power
+        return np.rint(np.asarray(cents, dtype=np.float64) * factors).astype(np.int64).tolist()
+
+
+class Rates:
+    """The process's RateTable, loaded on first use and again when the stored version moves.
+
+    The version is read at most every `check_interval` seconds.
+    """
+
+    def __init__(self, pool, base=DEFAULT_BASE, check_interval=5.0):
+        self.pool = pool
+        self.base = base
+        self.check_interval = check_interval
+        self._table = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _due(self):
+        return self._table is None or time.monotonic() - self._checked_at >= self.check_interval
+
+    def table(self):
+        if self._due():
+            with self._lock:
+                if self._due():
+                    with self.pool.connection() as connection:
+                        cursor = connection.cursor()
+                        try:
+                            if self._table is None or read_version(cursor) != self._table.version:
+                                self._table = RateTable.load(cursor, self.base)
+                        finally:
+                            cursor.close()
+                    self._checked_at = time.monotonic()
+        return self._table
+
+    def reload(self):
+        with self._lock:
+            self._table = None
+        return self.table()
+
+
+def table():
+    return rates.table()
+
+
+def version():
+    """The version of the rates this process converts with."""
+    return table().version
+
+
+def currencies():
+    """Codes amounts can be entered in.
+
+    That is the reporting currency, which never needs converting, and every
+    currency with rates, but only once the reporting currency has rates too:
+    until then nothing could be converted to it.
+    """
+    known = table().currencies()
+    if REPORTING_CURRENCY not in known:
+        return [REPORTING_CURRENCY]
+    return known
+
+
+def require_rates(currency):
+    """Raise MissingRate unless amounts in `currency` can be converted to the reporting currency."""
+    if currency not in currencies():
+        raise MissingRate([currency])
+
+
+def reporting_problem():
+    """Why amounts can't be reported in the reporting currency, or None when they can."""
+    known = table().currencies()
+    if known and REPORTING_CURRENCY not in known:
+        return (f"No exchange rates for the reporting currency {REPORTING_CURRENCY}; "
+                f"only amounts in {REPORTING_CURRENCY} can be entered.")
+    return None
+
+
+def coverage():
+    """[(currency, first date, last date, rate count)] of the stored rates."""
+    with rates.pool.connection() as connection:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT currency, MIN(rate_date), MAX(rate_date), COUNT(*) FROM fx_rates "
+                           "GROUP BY currency ORDER BY currency")
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+
+def convert_amounts(amounts, currencies, dates, to_currencies):
+    """RateTable.convert for database rows: decimal amounts and dates (or ISO strings) in, cents out."""
+    return table().convert([round(Decimal(str(amount)) * 100) for amount in amounts], currencies,
+                           [_ordinal(value) for value in dates], to_currencies)
+
+
+def convert_totals(rows, foreign_rows, currency):
+    """Adjust summary.READ_TOTALS_QUERY rows for FOREIGN_TOTALS_QUERY rows converted to `currency`.
+
+    The rollup sums amounts whatever their currency; the foreign rows'
+    own amounts are taken back out and their converted amounts put in.
+    """
+    if not foreign_rows:
+        return rows
+    converted = convert_amounts([row['amount'] for row in foreign_rows], [row['currency'] for row in foreign_rows],
+                                [row['transaction_date'] for row in foreign_rows], currency)
+    by_category = {row['category_id']: dict(row) for row in rows}
+    for row, cents in zip(foreign_rows, converted):
+        total = by_category.get(row['category_id'])
+        if total is None:
+            # Not in the rollup (stale or not yet rebuilt), so there is nothing to swap out
+            continue
+        column = 'income' if row['type'] == 'income' else 'expenses'
+        total[column] = Decimal(str(total[column] or 0)) - Decimal(str(row['amount'])) + _amount(cents)
+    return list(by_category.values())
+
+
+def _ordinal(value):
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    return value.toordinal()
+
+
+def _amount(cents):
+    return Decimal(cents).scaleb(-2)
+
+
+def parse_rates(stream, base):
+    """Yield (currency, date, rate) from a rates CSV.
+
+    Two layouts are read: long files with `date,currency,rate` columns
+    (rates per unit of `base`), and wide files like the ECB's
+    eurofxref-hist.csv, with a Date column and one column per currency.
+    Blank and N/A cells are skipped.
+    """
+    reader = csv.reader(stream)
+    header = [cell.strip() for cell in next(reader, [])]
+    lowered = [cell.lower() for cell in header]
+    if {'date', 'currency', 'rate'} <= set(lowered):
+        date_at, currency_at, rate_at = (lowered.index(name) for name in ('date', 'currency', 'rate'))
+        for row in reader:
+            if len(row) > max(date_at, currency_at, rate_at) and row[rate_at].strip() not in ('', 'N/A'):
+                yield (check_code(row[currency_at]), _parse_date(row[date_at]), _parse_rate(row[rate_at]))
+        return
+    if not lowered or lowered[0] != 'date':
+        raise ValueError("Expected a 'date,currency,rate' header or a 'Date,<currency>,...' header.")
+    currencies = [check_code(cell) if cell else None for cell in header[1:]]
+    for row in reader:
+        if not row or not row[0].strip():
+            continue
+        rate_date = _parse_date(row[0])
+        for currency, cell in zip(currencies, row[1:]):
+            cell = cell.strip()
+            if currency and cell and cell != 'N/A':
+                yield currency, rate_date, _parse_rate(cell)
+
+
+def _parse_date(value):
+    return datetime.strptime(value.strip(), '%Y-%m-%d').date()
+
+
+def _parse_rate(value):
+    rate = float(value)
+    if not rate > 0:
+        raise ValueError(f"Invalid rate {value!r}.")
+    return rate
+
+
+def import_rates(connection, stream, base, batch_size=IMPORT_BATCH_SIZE):
+    """Store every rate in a rates file (see parse_rates), replacing existing ones; returns the count.
+
+    The rates version is bumped in the same transaction.
+    """
+    cursor = connection.cursor()
+    count = 0
+    try:
+        batch = []
+        for currency, rate_date, rate in parse_rates(stream, base):
+            if currency == base:
+                continue
+            batch.append((currency, rate_date, rate))
+            if len(batch) >= batch_size:
+                cursor.executemany(_UPSERT_QUERIES[db.dialect], batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(_UPSERT_QUERIES[db.dialect], batch)
+            count += len(batch)
+        cursor.execute(_BUMP_VERSION_QUERIES[db.dialect])
+        connection.commit()
+    finally:
+        connection.rollback()
+        cursor.close()
+    return count
+
+
+def init_app(app, pool):
+    global rates, DEFAULT_CURRENCY, REPORTING_CURRENCY
+    DEFAULT_CURRENCY = check_code(app.config.get('DEFAULT_CURRENCY', DEFAULT_CURRENCY))
+    REPORTING_CURRENCY = check_code(app.config.get('REPORTING_CURRENCY', DEFAULT_CURRENCY))
+    base = check_code(app.config.get('FX_BASE_CURRENCY', DEFAULT_BASE))
+    rates = Rates(pool, base, app.config.get('FX_CHECK_INTERVAL', 5.0))
+    app.add_template_filter(format_money, 'money')
+
+    @app.context_processor
+    def currency_context():
+        return {'default_currency': DEFAULT_CURRENCY}
+
+    return rates
@@ -0,0 +1,112 @@
+"""Password hashing on a bounded worker pool.
+
+bcrypt is deliberately slow, so a burst of logins run inline would occupy
+every request worker. Hashes here run on at most `workers` threads (or
+processes) with at most `max_queue` more waiting; anything beyond that is
+rejected straight away with HasherBusy instead of piling up. Keep
+`workers + max_queue` well below the number of request workers so the
+rest stay free for other traffic.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import bcrypt as _bcrypt
+
+hasher = None
+
+
+class HasherBusy(Exception):
+    pass
+
+
+def _check(pw_hash, password):
+    try:
+        return _bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+    except ValueError:
+        return False
+
+
+def _generate(password, rounds):
+    return _bcrypt.hashpw(password.encode('utf-8'), _bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+class PasswordHasher:
+    def __init__(self, rounds=12, workers=None, max_queue=4, timeout=10.0, use_processes=False):
+        self.rounds = rounds
+        self.workers = workers or max(1, (os.cpu_count() or 2) // 2)
+        self.max_queue = max_queue
+        self.timeout = timeout
+        # bcrypt releases the GIL while hashing, so threads are enough unless
+        # the deployment wants hashing isolated in separate processes.
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self._executor = executor_class(max_workers=self.workers)
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timed_out = 0
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise HasherBusy("Password hashing pool is saturated")
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._finished(None)
+            raise
+        # The slot is held until the hash has really finished (or was
+        # cancelled before it started): a timed-out hash may still be running.
+        future.add_done_callback(self._finished)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            with self._lock:
+                self._timed_out += 1
+            raise HasherBusy("Password hashing timed out")
+
+    def _finished(self, future):
+        with self._lock:
+            self._in_flight -= 1
+            self._completed += 1
+        self._slots.release()
+
+    def check(self, pw_hash, password):
+        return self._run(_check, pw_hash, password)
+
+    def generate(self, password):
+        return self._run(_generate, password, self.rounds)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'rounds': self.rounds,
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'in_flight': self._in_flight,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'timed_out': self._timed_out,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def init_app(app):
+    global hasher
+    hasher = PasswordHasher(
+        rounds=app.config.get('BCRYPT_LOG_ROUNDS', 12),
+        workers=app.config.get('HASH_WORKERS'),
+        max_queue=app.config.get('HASH_MAX_QUEUE', 4),
+        timeout=app.config.get('HASH_TIMEOUT', 10.0),
+        use_processes=app.config.get('HASH_USE_PROCESSES', False),
+    )
+    return hasher
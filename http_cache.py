@@ -0,0 +1,97 @@
+"""Conditional GET and response compression for the JSON API.
+
+Each user has a data version token (see UserCache.version) that every
+write route bumps. API responses carry it in a strong ETag, so a client
+revalidating unchanged data gets 304 Not Modified before any query runs.
+That needs the version to be shared by every app process (a coherent
+cache, see cache.py); otherwise responses carry no ETag.
+"""
+import gzip
+import hashlib
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import Response, json, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_BYTES = 512
+
+_ENCODING_SUFFIX = {'br': '-br', 'gzip': '-gz'}
+
+
+def etag_for(user_id, version, resource):
+    """Strong ETag for `resource` at `version`, varying with the query string."""
+    args = request.query_string.decode()
+    digest = hashlib.sha1(f"{user_id}:{version}:{resource}:{args}".encode()).hexdigest()[:20]
+    return digest
+
+
+def not_modified(etag):
+    """A 304 response if the client already holds `etag` (in any encoding), else None."""
+    candidates = [etag] + [etag + suffix for suffix in _ENCODING_SUFFIX.values()]
+    if any(request.if_none_match.contains_weak(candidate) for candidate in candidates):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return None
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    return value
+
+
+def json_response(payload, etag=None):
+    response = Response(json.dumps(_plain(payload)), mimetype='application/json')
+    if etag is not None:
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(response):
+    """after_request hook: brotli/gzip-compress JSON responses the client accepts."""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype != 'application/json'):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    encoding = _choose_encoding()
+    if encoding is None or len(data) < MIN_COMPRESS_BYTES:
+        return response
+
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=5))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers['Content-Encoding'] = encoding
+    # A strong ETag names exact bytes, so each encoding gets its own
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag + _ENCODING_SUFFIX[encoding])
+    return response
+
+
+def init_app(app):
+    app.after_request(compress)
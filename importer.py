@@ -0,0 +1,350 @@
+"""Streaming import of bank statements (CSV and OFX) into `transactions`.
+
+Statements are parsed one row at a time and written in `executemany`
+batches, committing every `chunk_size` rows, so memory stays bounded by the
+batch rather than the file.
+
+Rows are in the statement's currency: a CSV currency column, an OFX
+CURDEF, or else the currency the import was started with. Rows without
+a category are given one by the user's categorization rules, if any.
+
+Re-importing a statement doesn't duplicate rows already stored. OFX rows
+are recognised by their FITID (qualified by the account's ACCTID), kept
+in `external_id`. Other rows are matched on date, amount, type,
+description and currency, by count: a file row is skipped only while
+fewer of its identical rows have been seen than were stored before the
+import, so two identical purchases on one day both import.
+"""
+import csv
+import re
+from collections import Counter
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+import fx
+import ingest
+import partitions
+import summary
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_CHUNK_SIZE = 10000
+MAX_REPORTED_ERRORS = 1000
+
+_CSV_COLUMNS = {
+    'date': ('date', 'transaction_date', 'posted', 'posting date', 'value date'),
+    'description': ('description', 'memo', 'details', 'narrative', 'reference', 'payee'),
+    'amount': ('amount', 'value', 'transaction amount'),
+    'debit': ('debit', 'withdrawal', 'money out'),
+    'credit': ('credit', 'deposit', 'money in'),
+    'type': ('type', 'transaction type'),
+    'category': ('category', 'category name'),
+    'currency': ('currency', 'currency code', 'ccy'),
+}
+_DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%d/%m/%Y', '%d-%m-%Y', '%Y%m%d')
+_OFX_TAG_RE = re.compile(r"<(/?)([A-Z0-9.]+)>([^<\r\n]*)", re.IGNORECASE)
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+class ImportReport:
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.categories_created = 0
+        self.auto_categorized = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def as_dict(self):
+        return {
+            'read': self.read,
+            'inserted': self.inserted,
+            'duplicates': self.duplicates,
+            'categories_created': self.categories_created,
+            'auto_categorized': self.auto_categorized,
+            'error_count': self.read - self.inserted - self.duplicates,
+            'errors': self.errors,
+        }
+
+
+def _parse_date(value):
+    value = value.strip()
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ImportRowError(f"Unrecognised date '{value}'")
+
+
+def _parse_amount(value):
+    cleaned = value.strip().replace(',', '').replace(' ', '')
+    if cleaned.startswith('(') and cleaned.endswith(')'):
+        cleaned = '-' + cleaned[1:-1]
+    try:
+        amount = Decimal(cleaned).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ImportRowError(f"Unrecognised amount '{value}'")
+    # Past DECIMAL(10,2) one row would fail the whole batch insert
+    if not amount.is_finite() or abs(amount) > ingest.MAX_AMOUNT:
+        raise ImportRowError(f"Amount '{value}' is out of range")
+    return amount
+
+
+def _record(transaction_date, amount, description, transaction_type=None, category=None, currency=None,
+            external_id=None):
+    if transaction_type:
+        transaction_type = transaction_type.strip().lower()
+        if transaction_type in ('credit', 'cr', 'deposit'):
+            transaction_type = 'income'
+        elif transaction_type in ('debit', 'dr', 'withdrawal', 'payment'):
+            transaction_type = 'expense'
+        if transaction_type not in ('income', 'expense'):
+            raise ImportRowError(f"Unrecognised transaction type '{transaction_type}'")
+    else:
+        transaction_type = 'income' if amount >= 0 else 'expense'
+    description = (description or '').strip()[:300]
+    if not description:
+        raise ImportRowError("Missing description")
+    if currency:
+        try:
+            currency = fx.check_code(currency)
+        except ValueError as err:
+            raise ImportRowError(str(err))
+    return {
+        'transaction_date': transaction_date,
+        'amount': abs(amount),
+        'type': transaction_type,
+        'description': description,
+        'category': (category or '').strip() or None,
+        'currency': currency or None,
+        'external_id': external_id,
+    }
+
+
+def parse_csv(stream):
+    """Yield (line_number, record_or_error) for each data row of a CSV statement."""
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        return
+    normalized = [column.strip().lower() for column in header]
+    columns = {}
+    for field, aliases in _CSV_COLUMNS.items():
+        for alias in aliases:
+            if alias in normalized:
+                columns[field] = normalized.index(alias)
+                break
+    if 'date' not in columns or 'description' not in columns or not (
+            'amount' in columns or 'debit' in columns or 'credit' in columns):
+        yield 1, ImportRowError("CSV header needs date, description and amount (or debit/credit) columns")
+        return
+
+    def cell(row, field):
+        index = columns.get(field)
+        return row[index] if index is not None and index < len(row) else ''
+
+    for row in reader:
+        line = reader.line_num
+        if not any(value.strip() for value in row):
+            continue
+        try:
+            if cell(row, 'amount').strip():
+                amount = _parse_amount(cell(row, 'amount'))
+            else:
+                credit = cell(row, 'credit').strip()
+                debit = cell(row, 'debit').strip()
+                amount = _parse_amount(credit) if credit else -_parse_amount(debit or '0')
+            yield line, _record(_parse_date(cell(row, 'date')), amount, cell(row, 'description'),
+                                cell(row, 'type'), cell(row, 'category'), cell(row, 'currency'))
+        except ImportRowError as err:
+            yield line, err
+
+
+def parse_ofx(stream):
+    """Yield (line_number, record_or_error) for each <STMTTRN> in an OFX statement.
+
+    Handles both SGML (OFX 1.x, unclosed leaf tags) and XML (OFX 2.x) files.
+    """
+    current = None
+    currency = None
+    account = None
+    start_line = 0
+    for line_number, line in enumerate(stream, 1):
+        for closing, tag, value in _OFX_TAG_RE.findall(line):
+            tag = tag.upper()
+            if tag == 'CURDEF' and not closing:
+                # The statement's default currency; it precedes its transactions
+                currency = value.strip()
+            elif tag == 'ACCTID' and not closing and current is None:
+                account = value.strip()
+            elif tag == 'STMTTRN':
+                if not closing:
+                    current, start_line = {}, line_number
+                    continue
+                if current is not None:
+                    try:
+                        posted = current.get('DTPOSTED', '')
+                        fitid = current.get('FITID')
+                        external_id = f"{account or ''}:{fitid}"[:255] if fitid else None
+                        yield start_line, _record(_parse_date(posted[:8]),
+                                                  _parse_amount(current.get('TRNAMT', '')),
+                                                  current.get('NAME') or current.get('MEMO'),
+                                                  currency=currency, external_id=external_id)
+                    except ImportRowError as err:
+                        yield start_line, err
+                current = None
+            elif current is not None and not closing:
+                current[tag] = value.strip()
+
+
+PARSERS = {'csv': parse_csv, 'ofx': parse_ofx, 'qfx': parse_ofx}
+
+
+def detect_format(filename):
+    extension = filename.rsplit('.', 1)[-1].lower() if filename and '.' in filename else ''
+    return extension if extension in PARSERS else None
+
+
+def _resolve_categories(cursor, user_id, batch, category_ids, report):
+    for _, record in batch:
+        name = record.pop('category')
+        if name is None:
+            record['category_id'] = None
+            continue
+        key = name.lower()
+        if key not in category_ids:
+            query = "INSERT INTO categories (name, user_id, createdBy) VALUES (%s, %s, %s)"
+            cursor.execute(query, (name[:250], user_id, user_id))
+            category_ids[key] = cursor.lastrowid
+            report.categories_created += 1
+        record['category_id'] = category_ids[key]
+
+
+def _dedupe_key(transaction_date, amount, transaction_type, description, currency):
+    return transaction_date, Decimal(amount).quantize(Decimal('0.01')), transaction_type, description, currency
+
+
+class _Seen:
+    """What the import has seen so far, for telling duplicates from repeated rows."""
+
+    def __init__(self):
+        # File rows per dedupe key, and how many of them this import inserted
+        self.occurrences = Counter()
+        self.inserted = Counter()
+        self.external_ids = set()
+
+
+def _existing_keys(cursor, user_id, batch):
+    """Counts of the stored rows per dedupe key over the batch's dates, and the batch's stored external ids."""
+    dates = [record['transaction_date'] for _, record in batch]
+    # Archived years count too, so re-importing an old statement stays a no-op.
+    # Rows with an external id are matched by it alone.
+    query = """
+    SELECT transaction_date, amount, type, description, currency
+    FROM {table}
+    WHERE user_id = %s AND transaction_date BETWEEN %s AND %s AND external_id IS NULL
+    """
+    cursor.execute(*partitions.all_tiers(query, (user_id, min(dates), max(dates))))
+    counts = Counter(_dedupe_key(*row) for row in cursor.fetchall())
+
+    external_ids = sorted({record['external_id'] for _, record in batch if record['external_id']})
+    stored = set()
+    if external_ids:
+        placeholders = ', '.join(['%s'] * len(external_ids))
+        query = f"SELECT external_id FROM {{table}} WHERE user_id = %s AND external_id IN ({placeholders})"
+        cursor.execute(*partitions.all_tiers(query, [user_id] + external_ids))
+        stored = {row[0] for row in cursor.fetchall()}
+    return counts, stored
+
+
+def _flush(cursor, user_id, batch, category_ids, report, currency, matcher, seen):
+    if not batch:
+        return
+    _resolve_categories(cursor, user_id, batch, category_ids, report)
+    for _, record in batch:
+        record['currency'] = record['currency'] or currency
+
+    # Counts include rows inserted by earlier batches of this import, which
+    # are taken back out so only rows stored before it are skipped
+    counts, stored_ids = _existing_keys(cursor, user_id, batch)
+    rows = []
+    for _, record in batch:
+        external_id = record['external_id']
+        if external_id and (external_id in stored_ids or external_id in seen.external_ids):
+            report.duplicates += 1
+            continue
+        key = _dedupe_key(record['transaction_date'], record['amount'], record['type'], record['description'],
+                          record['currency'])
+        duplicate = seen.occurrences[key] < counts[key] - seen.inserted[key]
+        seen.occurrences[key] += 1
+        if duplicate:
+            report.duplicates += 1
+            continue
+        if external_id:
+            seen.external_ids.add(external_id)
+        else:
+            seen.inserted[key] += 1
+        rows.append(record)
+
+    if rows and matcher:
+        report.auto_categorized += matcher.apply(rows)
+    if rows:
+        query = """
+        INSERT INTO transactions
+            (user_id, amount, type, category_id, description, transaction_date, currency, external_id)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """
+        cursor.executemany(query, [(user_id, r['amount'], r['type'], r['category_id'], r['description'],
+                                    r['transaction_date'], r['currency'], r['external_id']) for r in rows])
+        summary.record_many(cursor, user_id, rows)
+        report.inserted += len(rows)
+
+
+def import_statement(connection, user_id, stream, fmt, batch_size=DEFAULT_BATCH_SIZE,
+                     chunk_size=DEFAULT_CHUNK_SIZE, currency=None, currencies=None, matcher=None):
+    """Import a statement for `user_id` and return an ImportReport.
+
+    Rows are inserted `batch_size` at a time and committed every
+    `chunk_size` rows; a database error rolls back only the open chunk.
+    Rows the statement gives no currency are in `currency` (default: the
+    default currency); given `currencies`, rows in any other are errors.
+    A categorize.Matcher, if given, categorizes rows that have no category.
+    """
+    currency = currency or fx.DEFAULT_CURRENCY
+    report = ImportReport()
+    cursor = connection.cursor(buffered=True)
+    try:
+        cursor.execute("SELECT category_id, name FROM categories WHERE user_id = %s", (user_id,))
+        category_ids = {name.lower(): category_id for category_id, name in cursor.fetchall()}
+
+        batch = []
+        pending = 0
+        seen = _Seen()
+        for line, record in PARSERS[fmt](stream):
+            report.read += 1
+            if isinstance(record, ImportRowError):
+                report.add_error(line, str(record))
+                continue
+            if currencies is not None and (record['currency'] or currency) not in currencies:
+                report.add_error(line, f"No exchange rates for {record['currency']}")
+                continue
+            batch.append((line, record))
+            if len(batch) >= batch_size:
+                _flush(cursor, user_id, batch, category_ids, report, currency, matcher, seen)
+                pending += len(batch)
+                batch = []
+                if pending >= chunk_size:
+                    connection.commit()
+                    pending = 0
+        _flush(cursor, user_id, batch, category_ids, report, currency, matcher, seen)
+        connection.commit()
+    finally:
+        cursor.close()
+    return report
@@ -0,0 +1,482 @@
+"""Write-behind ingestion: transactions are journaled locally and written in batches.
+
+With INGEST_MODE=queue, add_transaction validates the form, appends the
+transaction to a journal (a local SQLite file at INGEST_JOURNAL, synced
+on every append) and redirects at once. A writer thread drains the
+journal into the database: up to INGEST_BATCH_SIZE entries per multi-row
+INSERT, folded into the monthly rollup and committed together. A batch
+that fails on a connection or server error stays in the journal and is
+retried with exponential backoff; an entry the database rejects outright
+is isolated from the rest of its batch and moved to the journal's
+failed_transactions table.
+
+Each entry carries a random ingest_id, stored with the transaction under
+a unique key, so a batch committed just before a crash (while still in
+the journal) is recognized on the retry and not posted twice. Worker
+processes on one host share the journal; an flock on a file beside it
+lets one of them drain at a time.
+
+Until an entry is written, `merge_pending` shows it on its owner's
+dashboard and in their totals, so users read their own writes. An entry
+stays in the journal for a moment after its batch commits, so callers
+first drop the ones already in the database (`unwritten`), which the
+totals they read already count.
+"""
+import fcntl
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+import db
+import fx
+import summary
+
+MODES = ('direct', 'queue')
+DEFAULT_BATCH_SIZE = 500
+THROUGHPUT_WINDOW = 60.0
+# DECIMAL(10,2) and VARCHAR(300) on transactions
+MAX_AMOUNT = Decimal('99999999.99')
+MAX_DESCRIPTION = 300
+CENT = Decimal('0.01')
+
+# Retrying these can't help: the entry itself is bad
+_REJECTED = db.IntegrityError + db.DataError
+
+JOURNAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_transactions (
+    entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ingest_id TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    amount TEXT NOT NULL,
+    type TEXT NOT NULL,
+    category_id INTEGER,
+    description TEXT NOT NULL,
+    transaction_date TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    currency TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_pending_user ON pending_transactions (user_id, entry_id);
+CREATE TABLE IF NOT EXISTS failed_transactions (
+    entry_id INTEGER PRIMARY KEY,
+    ingest_id TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    amount TEXT NOT NULL,
+    type TEXT NOT NULL,
+    category_id INTEGER,
+    description TEXT NOT NULL,
+    transaction_date TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    failed_at REAL NOT NULL,
+    error TEXT NOT NULL,
+    currency TEXT
+);
+"""
+
+_ENTRY_COLUMNS = ("entry_id, ingest_id, user_id, amount, type, category_id, description, transaction_date, "
+                  "enqueued_at, currency")
+
+_INSERT_QUERY = """
+INSERT INTO transactions (user_id, amount, type, category_id, description, transaction_date, ingest_id, currency)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+queue = None
+
+
+def validate(amount, transaction_type, category_id, description, transaction_date, category_ids):
+    """Check a transaction before it is acknowledged; returns (amount, date) or raises ValueError.
+
+    Queued entries are written later, so everything the database would
+    reject has to be caught here instead.
+    """
+    try:
+        amount = Decimal(str(amount)).quantize(CENT)
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount {amount!r}.")
+    if not amount.is_finite() or abs(amount) > MAX_AMOUNT:
+        raise ValueError(f"Amount {amount} is out of range.")
+    if transaction_type not in ('income', 'expense'):
+        raise ValueError(f"Unknown transaction type {transaction_type!r}.")
+    if category_id is not None and category_id not in category_ids:
+        raise ValueError(f"Unknown category {category_id}.")
+    if len(description) > MAX_DESCRIPTION:
+        raise ValueError(f"Description is longer than {MAX_DESCRIPTION} characters.")
+    if isinstance(transaction_date, str):
+        transaction_date = date.fromisoformat(transaction_date)
+    return amount, transaction_date
+
+
+def _entry(row):
+    entry = dict(row)
+    entry['amount'] = Decimal(entry['amount'])
+    entry['transaction_date'] = date.fromisoformat(entry['transaction_date'])
+    # Entries journaled before currencies existed are in the default one
+    entry['currency'] = entry['currency'] or fx.DEFAULT_CURRENCY
+    return entry
+
+
+class Journal:
+    """The local queue: an SQLite file in WAL mode, fsynced on every commit."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        connection = self._connection()
+        connection.executescript(JOURNAL_SCHEMA)
+        for table in ('pending_transactions', 'failed_transactions'):
+            columns = {row['name'] for row in connection.execute(f"PRAGMA table_info({table})")}
+            if 'currency' not in columns:
+                connection.execute(f"ALTER TABLE {table} ADD COLUMN currency TEXT")
+
+    def _connection(self):
+        # One connection per thread; sqlite3 connections aren't shared safely
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=FULL")
+            self._local.connection = connection
+        return connection
+
+    def append(self, user_id, amount, transaction_type, category_id, description, transaction_date,
+               currency=None):
+        query = f"""
+        INSERT INTO pending_transactions ({_ENTRY_COLUMNS})
+        VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """
+        cursor = self._connection().execute(query, (secrets.token_hex(16), user_id, str(amount), transaction_type,
+                                                    category_id, description, transaction_date.isoformat(),
+                                                    time.time(), currency or fx.DEFAULT_CURRENCY))
+        return cursor.lastrowid
+
+    def peek(self, limit):
+        """The oldest `limit` entries, left in the journal until `remove`."""
+        query = f"SELECT {_ENTRY_COLUMNS} FROM pending_transactions ORDER BY entry_id LIMIT ?"
+        return [_entry(row) for row in self._connection().execute(query, (limit,))]
+
+    def for_user(self, user_id):
+        """A user's pending entries, newest first."""
+        query = f"SELECT {_ENTRY_COLUMNS} FROM pending_transactions WHERE user_id = ? ORDER BY entry_id DESC"
+        return [_entry(row) for row in self._connection().execute(query, (user_id,))]
+
+    def remove(self, entry_ids):
+        placeholders = ', '.join(['?'] * len(entry_ids))
+        self._connection().execute(f"DELETE FROM pending_transactions WHERE entry_id IN ({placeholders})",
+                                   list(entry_ids))
+
+    def bury(self, entry, error):
+        """Move an entry the database won't accept to failed_transactions."""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            query = f"""
+            INSERT OR REPLACE INTO failed_transactions ({_ENTRY_COLUMNS}, failed_at, error)
+            SELECT {_ENTRY_COLUMNS}, ?, ? FROM pending_transactions WHERE entry_id = ?
+            """
+            connection.execute(query, (time.time(), error, entry['entry_id']))
+            connection.execute("DELETE FROM pending_transactions WHERE entry_id = ?", (entry['entry_id'],))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def stats(self):
+        """(pending entries, enqueued_at of the oldest or None, failed entries)."""
+        connection = self._connection()
+        depth, oldest = connection.execute(
+            "SELECT COUNT(*), MIN(enqueued_at) FROM pending_transactions").fetchone()
+        failed = connection.execute("SELECT COUNT(*) FROM failed_transactions").fetchone()[0]
+        return depth, oldest, failed
+
+
+def written_query(entries):
+    """The query selecting the ingest_id of each of `entries` already in `transactions`, and its params."""
+    placeholders = ', '.join(['%s'] * len(entries))
+    return (f"SELECT ingest_id FROM transactions WHERE ingest_id IN ({placeholders})",
+            [entry['ingest_id'] for entry in entries])
+
+
+def _already_written(cursor, entries):
+    cursor.execute(*written_query(entries))
+    return {row['ingest_id'] for row in cursor.fetchall()}
+
+
+class IngestQueue:
+    """The journal plus the daemon thread that drains it every `interval` seconds.
+
+    The writer is also woken early whenever a full batch has been queued
+    by this process.
+    """
+
+    def __init__(self, pool, journal, interval=0.5, batch_size=DEFAULT_BATCH_SIZE, retry_delay=1.0,
+                 max_retry_delay=60.0, on_written=None):
+        self.pool = pool
+        self.journal = journal
+        self.interval = interval
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.on_written = on_written
+        self._lock_file = open(journal.path + '.lock', 'a')
+        self._drain_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._queued_since_wake = 0
+        self._enqueued = 0
+        self._written = 0
+        self._duplicates = 0
+        self._batches = 0
+        self._rejected = 0
+        self._retries = 0
+        self._last_batch_size = None
+        self._last_lag = None
+        self._max_lag = 0.0
+        self._lag_total = 0.0
+        self._recent = deque()
+
+    def enqueue(self, user_id, amount, transaction_type, category_id, description, transaction_date,
+                category_ids, currency=None):
+        """Validate and journal a transaction (see `validate`); returns its entry id."""
+        amount, transaction_date = validate(amount, transaction_type, category_id, description,
+                                            transaction_date, category_ids)
+        entry_id = self.journal.append(user_id, amount, transaction_type, category_id, description,
+                                       transaction_date, currency)
+        with self._lock:
+            self._enqueued += 1
+            self._queued_since_wake += 1
+            wake = self._queued_since_wake >= self.batch_size
+            if wake:
+                self._queued_since_wake = 0
+        if wake:
+            self._wake.set()
+        return entry_id
+
+    def pending(self, user_id):
+        return self.journal.for_user(user_id)
+
+    def _write(self, entries):
+        with self.pool.connection() as connection:
+            cursor = connection.cursor(dictionary=True, buffered=True)
+            try:
+                written = _already_written(cursor, entries)
+                rows = [entry for entry in entries if entry['ingest_id'] not in written]
+                if rows:
+                    cursor.executemany(_INSERT_QUERY, [(r['user_id'], r['amount'], r['type'], r['category_id'],
+                                                        r['description'], r['transaction_date'], r['ingest_id'],
+                                                        r['currency'])
+                                                       for r in rows])
+                    summary.record_rows(cursor, rows)
+                connection.commit()
+            finally:
+                connection.rollback()
+                cursor.close()
+        with self._lock:
+            self._duplicates += len(entries) - len(rows)
+
+    def _post(self, entries):
+        # Halves a rejected batch until the bad entries are found; connection
+        # and server errors propagate and the batch is retried as a whole.
+        try:
+            self._write(entries)
+        except _REJECTED as err:
+            if len(entries) == 1:
+                self.journal.bury(entries[0], str(err))
+                with self._lock:
+                    self._rejected += 1
+                print(f"Queued transaction {entries[0]['ingest_id']} rejected: {err}")
+                return []
+            middle = len(entries) // 2
+            return self._post(entries[:middle]) + self._post(entries[middle:])
+        self.journal.remove([entry['entry_id'] for entry in entries])
+        return entries
+
+    def drain_once(self):
+        """Write one batch from the journal; returns how many entries it took off.
+
+        Returns 0 without writing if another process is draining.
+        """
+        with self._drain_lock:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            try:
+                entries = self.journal.peek(self.batch_size)
+                if not entries:
+                    return 0
+                written = self._post(entries)
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+        now = time.time()
+        lags = [now - entry['enqueued_at'] for entry in written]
+        with self._lock:
+            self._batches += 1
+            self._written += len(written)
+            self._last_batch_size = len(entries)
+            if lags:
+                self._last_lag = lags[-1]
+                self._max_lag = max(self._max_lag, max(lags))
+                self._lag_total += sum(lags)
+            self._recent.append((time.monotonic(), len(written)))
+        if self.on_written is not None:
+            for user_id in {entry['user_id'] for entry in written}:
+                self.on_written(user_id)
+        return len(entries)
+
+    def drain(self):
+        """Drain until the journal is empty; returns the number of entries taken off."""
+        total = 0
+        while True:
+            count = self.drain_once()
+            if not count:
+                return total
+            total += count
+
+    def _loop(self):
+        delay = self.interval
+        while not self._stop.is_set():
+            self._wake.wait(delay)
+            self._wake.clear()
+            try:
+                # Keep going while full batches are waiting
+                while self.drain_once() >= self.batch_size:
+                    pass
+                delay = self.interval
+            except db.Error as err:
+                with self._lock:
+                    self._retries += 1
+                print(f"Database error: {err}")
+                delay = self.retry_delay if delay < self.retry_delay else min(delay * 2, self.max_retry_delay)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='ingest-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def metrics(self):
+        depth, oldest, failed = self.journal.stats()
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and self._recent[0][0] < now - THROUGHPUT_WINDOW:
+                self._recent.popleft()
+            recent = sum(count for _, count in self._recent)
+            return {
+                'running': self._thread is not None and self._thread.is_alive(),
+                'pending': depth,
+                'oldest_pending_seconds': time.time() - oldest if oldest is not None else None,
+                'failed': failed,
+                'enqueued': self._enqueued,
+                'written': self._written,
+                'duplicates_skipped': self._duplicates,
+                'rejected': self._rejected,
+                'batches': self._batches,
+                'retries': self._retries,
+                'last_batch_size': self._last_batch_size,
+                'rows_per_second': recent / THROUGHPUT_WINDOW,
+                'lag_seconds': {
+                    'last': self._last_lag,
+                    'max': self._max_lag,
+                    'avg': self._lag_total / self._written if self._written else None,
+                },
+            }
+
+
+def pending(user_id):
+    """The user's journaled entries ([] with INGEST_MODE=direct)."""
+    if queue is None:
+        return []
+    return queue.pending(user_id)
+
+
+def drop_written(entries, written_rows):
+    """`entries` less those whose ingest_id is in `written_rows` (rows of written_query)."""
+    written = {row['ingest_id'] for row in written_rows}
+    return [entry for entry in entries if entry['ingest_id'] not in written]
+
+
+def unwritten(cursor, user_id):
+    """The user's journaled entries not yet in the database; `cursor` returns dict rows.
+
+    Read after the totals: an entry committed in between is then left out
+    of both for one request rather than counted twice.
+    """
+    entries = pending(user_id)
+    if not entries:
+        return entries
+    cursor.execute(*written_query(entries))
+    return drop_written(entries, cursor.fetchall())
+
+
+def merge_pending(entries, transactions, totals, categories, first_page, currency=None):
+    """Fold journaled entries (see `unwritten`) into a dashboard page and its totals.
+
+    Pending rows lead the first unfiltered page (`first_page`); they count
+    towards the totals on every page, converted to `currency` if given.
+    Returns (transactions, totals).
+    """
+    shown = {row.get('ingest_id') for row in transactions}
+    entries = [entry for entry in entries if entry['ingest_id'] not in shown]
+    if not entries:
+        return transactions, totals
+
+    names = {category['category_id']: category['name'] for category in categories}
+    amounts = [entry['amount'] for entry in entries]
+    foreign = [i for i, entry in enumerate(entries) if currency is not None and entry['currency'] != currency]
+    if foreign:
+        converted = fx.convert_amounts([amounts[i] for i in foreign], [entries[i]['currency'] for i in foreign],
+                                       [entries[i]['transaction_date'] for i in foreign], currency)
+        for i, cents in zip(foreign, converted):
+            amounts[i] = Decimal(cents).scaleb(-2)
+    total_income, total_expenses, spent_per_category = totals
+    spent_per_category = dict(spent_per_category)
+    for entry, amount in zip(entries, amounts):
+        entry['transaction_id'] = None
+        entry['category_name'] = names.get(entry['category_id'])
+        entry['pending'] = True
+        if entry['type'] == 'income':
+            total_income += amount
+        else:
+            total_expenses += amount
+            if entry['category_name']:
+                spent_per_category[entry['category_name']] = (
+                    spent_per_category.get(entry['category_name'], Decimal('0')) + amount)
+    if first_page:
+        # Stable, so pending entries come first within their date
+        transactions = sorted(entries + list(transactions), key=lambda row: row['transaction_date'], reverse=True)
+    return transactions, (total_income, total_expenses, spent_per_category)
+
+
+def init_app(app, pool, on_written=None):
+    global queue
+    mode = app.config.get('INGEST_MODE', 'direct')
+    if mode not in MODES:
+        raise ValueError(f"Unknown INGEST_MODE '{mode}'; use one of {', '.join(MODES)}.")
+    path = app.config.get('INGEST_JOURNAL', 'finance_tracker_ingest.sqlite3')
+    # A journal left by an earlier queue-mode run is still drained
+    if mode != 'queue' and not os.path.exists(path):
+        return None
+    queue = IngestQueue(
+        pool,
+        Journal(path),
+        interval=app.config.get('INGEST_INTERVAL', 0.5),
+        batch_size=app.config.get('INGEST_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+        retry_delay=app.config.get('INGEST_RETRY_DELAY', 1.0),
+        max_retry_delay=app.config.get('INGEST_MAX_RETRY_DELAY', 60.0),
+        on_written=on_written,
+    )
+    if queue.interval > 0:
+        queue.start()
+    return queue
@@ -0,0 +1,219 @@
+"""Query timing, per-request breakdowns and a Prometheus /metrics exposition.
+
+Connections handed out by the pool are wrapped so every cursor
+execute/executemany is timed and counted under a normalized SQL
+fingerprint. Statements slower than SLOW_QUERY_THRESHOLD_MS are logged
+together with their EXPLAIN plan. With SERVER_TIMING set, responses carry
+a Server-Timing header with the request's database time; it names the
+slowest queries, so it is off by default.
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+
+from flask import g, has_app_context
+
+import db
+
+slow_query_log = logging.getLogger('finance_tracker.slow_query')
+
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_NUMBER_RE = re.compile(r"\b\d+\b")
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.)*'")
+_PLACEHOLDER_LIST_RE = re.compile(r"\(\s*%s(?:\s*,\s*%s)+\s*\)")
+_UNION_VALUES_RE = re.compile(r"(?: UNION ALL SELECT %s(?:, %s)*)+")
+
+slow_query_threshold = 0.2
+
+
+def fingerprint(sql):
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _WHITESPACE_RE.sub(' ', sql).strip().rstrip(';')
+    sql = _UNION_VALUES_RE.sub(' UNION ALL ...', sql)
+    return _PLACEHOLDER_LIST_RE.sub('(%s, ...)', sql)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.total += 1
+        self.sum += value
+
+
+class QueryStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._rows = {}
+        self._statements = {}
+        self._acquire = Histogram(DURATION_BUCKETS)
+        self._slow = 0
+
+    def record(self, sql, seconds, rows):
+        key = fingerprint(sql)
+        query_id = hashlib.sha1(key.encode()).hexdigest()[:12]
+        with self._lock:
+            if query_id not in self._durations:
+                self._durations[query_id] = Histogram(DURATION_BUCKETS)
+                self._rows[query_id] = Histogram(ROW_BUCKETS)
+                self._statements[query_id] = key
+            self._durations[query_id].observe(seconds)
+            if rows is not None and rows >= 0:
+                self._rows[query_id].observe(rows)
+        return query_id, key
+
+    def record_acquire(self, seconds):
+        with self._lock:
+            self._acquire.observe(seconds)
+
+    def record_slow(self):
+        with self._lock:
+            self._slow += 1
+
+    def render(self, gauges=()):
+        """Prometheus text exposition of everything recorded so far."""
+        lines = []
+        with self._lock:
+            lines += ['# HELP db_query_info Normalized SQL for each query_id.', '# TYPE db_query_info gauge']
+            for query_id, statement in sorted(self._statements.items()):
+                lines.append(f'db_query_info{{query_id="{query_id}",statement="{_escape(statement[:300])}"}} 1')
+            _render_histograms(lines, 'db_query_duration_seconds', "Time spent executing each query.",
+                               self._durations)
+            _render_histograms(lines, 'db_query_rows', "Rows returned or affected per execution.", self._rows)
+            _render_histograms(lines, 'db_connection_acquire_seconds',
+                               "Time a request waited to check out its connection.", {None: self._acquire})
+            lines += ['# HELP db_slow_queries_total Queries slower than the slow-query threshold.',
+                      '# TYPE db_slow_queries_total counter', f'db_slow_queries_total {self._slow}']
+        for name, help_text, value in gauges:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+def _render_histograms(lines, name, help_text, histograms):
+    lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for query_id, histogram in sorted(histograms.items(), key=lambda item: item[0] or ''):
+        label = f'query_id="{query_id}",' if query_id else ''
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append(f'{name}_bucket{{{label}le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{label}le="+Inf"}} {histogram.total}')
+        suffix = f'{{{label.rstrip(",")}}}' if label else ''
+        lines.append(f'{name}_sum{suffix} {histogram.sum}')
+        lines.append(f'{name}_count{suffix} {histogram.total}')
+
+
+stats = QueryStats()
+
+
+def _track(sql, seconds, rows, connection, params, buffered):
+    query_id, key = stats.record(sql, seconds, rows)
+    if has_app_context():
+        g.setdefault('db_queries', []).append((query_id, seconds, rows))
+    if seconds >= slow_query_threshold:
+        stats.record_slow()
+        plan = _explain(connection, sql, params) if buffered else None
+        slow_query_log.warning("Slow query %s (%.1f ms, %s rows): %s\nEXPLAIN: %s",
+                               query_id, seconds * 1000, rows, key, plan)
+
+
+def _explain(connection, sql, params):
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    cursor = connection.cursor(dictionary=True, buffered=True)
+    try:
+        cursor.execute(('EXPLAIN QUERY PLAN ' if db.dialect == 'sqlite' else 'EXPLAIN ') + sql, params)
+        return cursor.fetchall()
+    except Exception as err:
+        return f"unavailable ({err})"
+    finally:
+        cursor.close()
+
+
+class InstrumentedCursor:
+    def __init__(self, cursor, connection, buffered):
+        self._cursor = cursor
+        self._connection = connection
+        self._buffered = buffered
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            _track(operation, time.perf_counter() - started, self._cursor.rowcount, self._connection, params,
+                   self._buffered)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            _track(operation, time.perf_counter() - started, self._cursor.rowcount, self._connection, None, False)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    def __init__(self, raw):
+        self.raw = raw
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self.raw.cursor(*args, **kwargs), self.raw, kwargs.get('buffered', False))
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+def server_timing():
+    """Server-Timing header value summarising this request's database time."""
+    queries = g.get('db_queries', [])
+    total = sum(seconds for _, seconds, _ in queries) * 1000
+    parts = [f'db;dur={total:.2f};desc="{len(queries)} queries"']
+    if 'db_acquire_seconds' in g:
+        parts.append(f'db-acquire;dur={g.db_acquire_seconds * 1000:.2f}')
+    slowest = sorted(queries, key=lambda query: query[1], reverse=True)[:5]
+    for rank, (query_id, seconds, _) in enumerate(slowest, 1):
+        parts.append(f'q{rank};dur={seconds * 1000:.2f};desc="{query_id}"')
+    return ', '.join(parts)
+
+
+def init_app(app, pool):
+    global slow_query_threshold
+    slow_query_threshold = app.config.get('SLOW_QUERY_THRESHOLD_MS', 200) / 1000
+    pool.wrapper = InstrumentedConnection
+    send_server_timing = app.config.get('SERVER_TIMING', False)
+
+    @app.after_request
+    def add_server_timing(response):
+        if 'db_acquire_seconds' in g:
+            stats.record_acquire(g.db_acquire_seconds)
+        if send_server_timing and ('db_queries' in g or 'db_acquire_seconds' in g):
+            response.headers['Server-Timing'] = server_timing()
+        return response
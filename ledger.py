@@ -0,0 +1,483 @@
+"""Per-user columnar ledgers: a compact in-memory copy of an active user's transactions.
+
+A ledger keeps one user's transactions (hot and archived) as parallel
+typed arrays sorted by (transaction_date, transaction_id):
+
+- ids: transaction ids (int64)
+- days: date ordinals (int32)
+- cents: amounts in integer cents (int64)
+- income: 1 for income, 0 for expense (int8)
+- categories: category ids, 0 when uncategorized (int64)
+- texts: indexes into an interned description table (int32)
+- currencies: indexes into the ledger's currency codes (int16)
+- archived: 1 for rows in the archive tier (int8)
+
+That is 36 bytes a transaction plus each distinct description once,
+instead of a dict per row. Income, expense and per-category spend totals
+are kept beside the arrays, per currency, and adjusted on every change.
+Totals in another currency add the rows in foreign currencies, converted
+in one fx.RateTable.convert call (cached until the ledger or the rates
+change).
+
+Ledgers are loaded on first use with one query of plain integers and
+strings, and kept in an LRU capped at LEDGER_MAX_BYTES. They answer the
+dashboard totals, its unsearched pages (a bisected date-range scan that
+skips archived rows, as TransactionRepo.page reads only the hot tier),
+budget spend and the analytics columns without a database round trip.
+Routes that change one row apply it to the resident ledger
+(`Ledgers.record`). Other writers (bulk edits, imports, recurring
+postings, ingestion) drop it instead (`Ledgers.invalidate`), and it is
+reloaded on next use. Both bump the user's 'ledger' version in the
+cache, which is how other processes' ledgers notice. So ledgers are only
+kept when the cache is coherent (a shared backend, or one process); see
+cache.py. LEDGER_TTL bounds how long a ledger is trusted even then.
+"""
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+from itertools import compress, islice
+
+import analytics
+import cache
+import db
+import fx
+import partitions
+from pagination import paginate
+from summary import UNCATEGORIZED
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# Rough per-string overhead of the interned table (list slot plus dict entry)
+_INTERN_OVERHEAD = 100
+
+_LOAD_QUERIES = {
+    'mysql': """
+    SELECT
+        transaction_id,
+        DATEDIFF(transaction_date, '1970-01-01'),
+        type = 'income',
+        COALESCE(category_id, 0),
+        CAST(ROUND(amount * 100) AS SIGNED),
+        description,
+        currency
+    FROM {table}
+    WHERE user_id = %s
+    """,
+    'sqlite': """
+    SELECT
+        transaction_id,
+        CAST(julianday(transaction_date) - julianday('1970-01-01') AS INTEGER),
+        type = 'income',
+        COALESCE(category_id, 0),
+        CAST(ROUND(amount * 100) AS INTEGER),
+        description,
+        currency
+    FROM {table}
+    WHERE user_id = %s
+    """,
+}
+
+ledgers = None
+
+
+def _cents(amount):
+    return int((Decimal(str(amount)) * 100).to_integral_value(ROUND_HALF_UP))
+
+
+def _ordinal(value):
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    return value.toordinal()
+
+
+def _amount(cents):
+    return Decimal(cents).scaleb(-2)
+
+
+class UserLedger:
+    def __init__(self, user_id, version):
+        self.user_id = user_id
+        # The cache's 'ledger' version this copy is current for
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.lock = threading.Lock()
+
+        self.ids = array('q')
+        self.days = array('i')
+        self.cents = array('q')
+        self.income = array('b')
+        self.categories = array('q')
+        self.texts = array('i')
+        self.currencies = array('h')
+        self.archived = array('b')
+        self.descriptions = []
+        self._interned = {}
+        self._text_bytes = 0
+        self.codes = []
+        self._code_index = {}
+
+        # Keyed by currency index; spent by (category_id, currency index)
+        self.income_cents = {}
+        self.expense_cents = {}
+        self.spent = {}
+        self.counts = {}
+        # (currency, rate table, totals) of the last converted totals call
+        self._converted = None
+
+    @classmethod
+    def from_rows(cls, user_id, version, rows):
+        """Build a ledger from _LOAD_QUERIES rows plus an archived flag, in any order."""
+        ledger = cls(user_id, version)
+        rows.sort(key=lambda row: (row[1], row[0]))
+        for transaction_id, epoch_day, is_income, category_id, cents, description, currency, archived in rows:
+            code = ledger._currency(currency)
+            ledger.ids.append(transaction_id)
+            ledger.days.append(epoch_day + _EPOCH_ORDINAL)
+            ledger.cents.append(cents)
+            ledger.income.append(1 if is_income else 0)
+            ledger.categories.append(category_id)
+            ledger.texts.append(ledger._intern(description))
+            ledger.currencies.append(code)
+            ledger.archived.append(archived)
+            ledger._aggregate(is_income, category_id, cents, code, 1)
+        return ledger
+
+    def _intern(self, description):
+        index = self._interned.get(description)
+        if index is None:
+            index = self._interned[description] = len(self.descriptions)
+            self.descriptions.append(description)
+            self._text_bytes += sys.getsizeof(description) + _INTERN_OVERHEAD
+        return index
+
+    def _currency(self, currency):
+        index = self._code_index.get(currency)
+        if index is None:
+            index = self._code_index[currency] = len(self.codes)
+            self.codes.append(currency)
+        return index
+
+    def _aggregate(self, is_income, category_id, cents, code, sign):
+        if is_income:
+            self.income_cents[code] = self.income_cents.get(code, 0) + sign * cents
+        else:
+            self.expense_cents[code] = self.expense_cents.get(code, 0) + sign * cents
+            key = (category_id, code)
+            self.spent[key] = self.spent.get(key, 0) + sign * cents
+        self.counts[code] = self.counts.get(code, 0) + sign
+        self._converted = None
+
+    def _columns(self):
+        return (self.ids, self.days, self.cents, self.income, self.categories, self.texts, self.currencies,
+                self.archived)
+
+    @property
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in self._columns()) + self._text_bytes
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _bounds(self, day, transaction_id):
+        """Positions just before and just after (day, transaction_id) in sort order."""
+        lo = bisect_left(self.days, day)
+        hi = bisect_right(self.days, day, lo)
+        return bisect_left(self.ids, transaction_id, lo, hi), bisect_right(self.ids, transaction_id, lo, hi)
+
+    def add(self, row):
+        """Insert a (hot tier) row with transaction_id, amount, type, category_id, description and transaction_date."""
+        with self.lock:
+            day = _ordinal(row['transaction_date'])
+            cents = _cents(row['amount'])
+            is_income = row['type'] == 'income'
+            category_id = row['category_id'] or UNCATEGORIZED
+            code = self._currency(row.get('currency') or fx.DEFAULT_CURRENCY)
+            position = self._bounds(day, row['transaction_id'])[0]
+            values = (row['transaction_id'], day, cents, 1 if is_income else 0, category_id,
+                      self._intern(row['description']), code, 0)
+            for column, value in zip(self._columns(), values):
+                column.insert(position, value)
+            self._aggregate(is_income, category_id, cents, code, 1)
+
+    def remove(self, transaction_id, transaction_date):
+        """Drop a transaction by id and date; False if the ledger doesn't have it."""
+        with self.lock:
+            position, end = self._bounds(_ordinal(transaction_date), transaction_id)
+            if position == end:
+                return False
+            self._aggregate(self.income[position], self.categories[position], self.cents[position],
+                            self.currencies[position], -1)
+            for column in self._columns():
+                del column[position]
+            return True
+
+    def _foreign(self, currency, lo=0, hi=None):
+        """Positions in [lo, hi) of rows not in `currency`."""
+        hi = len(self.ids) if hi is None else hi
+        target = self._code_index.get(currency, -1)
+        np = analytics.np
+        if np is not None:
+            codes = np.frombuffer(self.currencies, dtype=np.int16)[lo:hi]
+            return (np.flatnonzero(codes != target) + lo).tolist()
+        return [position for position in range(lo, hi) if self.currencies[position] != target]
+
+    def _convert(self, positions, currency):
+        """Cents of the rows at `positions`, converted to `currency` at each row's date."""
+        return fx.table().convert([self.cents[position] for position in positions],
+                                  [self.codes[self.currencies[position]] for position in positions],
+                                  [self.days[position] for position in positions], currency)
+
+    def totals(self, category_names, currency=None):
+        """(total_income, total_expenses, spent_per_category), as summary.fold_totals returns them.
+
+        Rows in currencies other than `currency` are converted to it, which
+        raises fx.MissingRate without rates. With no `currency`, amounts
+        are added up as stored, as summary.read_totals does.
+        """
+        with self.lock:
+            if currency is None:
+                income = sum(self.income_cents.values())
+                expenses = sum(self.expense_cents.values())
+                spent = {}
+                for (category_id, _), cents in self.spent.items():
+                    spent[category_id] = spent.get(category_id, 0) + cents
+            else:
+                target = self._code_index.get(currency)
+                income = self.income_cents.get(target, 0)
+                expenses = self.expense_cents.get(target, 0)
+                spent = {category_id: cents for (category_id, code), cents in self.spent.items() if code == target}
+            if currency is not None and any(count for code, count in self.counts.items() if code != target):
+                table = fx.table()
+                if self._converted is None or self._converted[:2] != (currency, table):
+                    self._converted = (currency, table, self._converted_totals(currency))
+                foreign_income, foreign_expenses, foreign_spent = self._converted[2]
+                income += foreign_income
+                expenses += foreign_expenses
+                for category_id, cents in foreign_spent.items():
+                    spent[category_id] = spent.get(category_id, 0) + cents
+        spent_per_category = {}
+        for category_id, cents in spent.items():
+            name = category_names.get(category_id)
+            if name and cents:
+                spent_per_category[name] = spent_per_category.get(name, Decimal('0')) + _amount(cents)
+        return _amount(income), _amount(expenses), spent_per_category
+
+    def _converted_totals(self, currency):
+        positions = self._foreign(currency)
+        income = expenses = 0
+        spent = {}
+        for position, cents in zip(positions, self._convert(positions, currency)):
+            if self.income[position]:
+                income += cents
+            else:
+                expenses += cents
+                category_id = self.categories[position]
+                spent[category_id] = spent.get(category_id, 0) + cents
+        return income, expenses, spent
+
+    def spend(self, category_id, start_date, end_date, currency=None):
+        """Expense cents in `category_id` between the two dates, inclusive, in `currency`."""
+        currency = currency or fx.DEFAULT_CURRENCY
+        with self.lock:
+            lo = bisect_left(self.days, start_date.toordinal())
+            hi = bisect_right(self.days, end_date.toordinal(), lo)
+            target = self._code_index.get(currency, -1)
+            spent = 0
+            foreign = []
+            for position in range(lo, hi):
+                if self.income[position] or self.categories[position] != category_id:
+                    continue
+                if self.currencies[position] == target:
+                    spent += self.cents[position]
+                else:
+                    foreign.append(position)
+            if foreign:
+                spent += sum(self._convert(foreign, currency))
+            return spent
+
+    def budget_spend(self, budgets):
+        """Budget rows, each with the `spent` BUDGET_SPEND_QUERY would give it, in the budget's currency."""
+        return [dict(budget, spent=_amount(self.spend(budget['category_id'], budget['start_date'],
+                                                      budget['end_date'], budget.get('currency'))))
+                for budget in budgets]
+
+    def analytics_inputs(self, start_date, end_date):
+        """(columns, opening_balance_cents) for analytics.compute, as TransactionRepo.analytics_inputs."""
+        np = analytics.np
+        with self.lock:
+            lo = bisect_left(self.days, start_date.toordinal())
+            hi = bisect_right(self.days, end_date.toordinal(), lo)
+            columns = (
+                np.frombuffer(self.days[lo:hi], dtype=np.int32).astype(np.int64) - _EPOCH_ORDINAL,
+                np.frombuffer(self.income[lo:hi], dtype=np.int8).astype(bool),
+                np.frombuffer(self.categories[lo:hi], dtype=np.int64),
+                np.frombuffer(self.cents[lo:hi], dtype=np.int64),
+            )
+            earlier_income = sum(compress(self.cents[:lo], self.income[:lo]))
+            opening = 2 * earlier_income - sum(self.cents[:lo])
+        return columns, opening
+
+    def _row(self, position, category_names):
+        category_id = self.categories[position] or None
+        return {
+            'transaction_id': self.ids[position],
+            'user_id': self.user_id,
+            'amount': _amount(self.cents[position]),
+            'type': 'income' if self.income[position] else 'expense',
+            'category_id': category_id,
+            'description': self.descriptions[self.texts[position]],
+            'transaction_date': date.fromordinal(self.days[position]),
+            'currency': self.codes[self.currencies[position]],
+            'category_name': category_names.get(category_id),
+        }
+
+    def page(self, before, after, limit, category_names):
+        """As TransactionRepo.page without a search: (rows, next_cursor, prev_cursor)."""
+        with self.lock:
+            if after is not None:
+                start = self._bounds(after[0].toordinal(), after[1])[1]
+                positions = range(start, len(self.ids))
+            else:
+                end = len(self.ids) if before is None else self._bounds(before[0].toordinal(), before[1])[0]
+                positions = range(end - 1, -1, -1)
+            # Archived rows are mostly the oldest, so few are skipped before a page fills
+            hot = (position for position in positions if not self.archived[position])
+            rows = [self._row(position, category_names) for position in islice(hot, limit + 1)]
+        return paginate(rows, limit, before, after)
+
+
+def load(cursor, user_id, version):
+    """Read a user's transactions from every tier into a new UserLedger."""
+    rows = []
+    # tier_queries gives the archive first
+    for (query, params), archived in zip(partitions.tier_queries(_LOAD_QUERIES[db.dialect], (user_id,)), (1, 0)):
+        cursor.execute(query, params)
+        rows.extend(tuple(row) + (archived,) for row in cursor.fetchall())
+    return UserLedger.from_rows(user_id, version, rows)
+
+
+class Ledgers:
+    """The resident ledgers, least recently used first, within `max_bytes` in total."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=300.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._ledgers = OrderedDict()
+        self._lock = threading.Lock()
+        # Serializes version bumps with the updates they stamp (see record)
+        self._record_lock = threading.Lock()
+        self._hits = 0
+        self._loads = 0
+        self._updates = 0
+        self._invalidations = 0
+        self._evictions = 0
+
+    @staticmethod
+    def _version(user_id):
+        return cache.user_cache.version(user_id, 'ledger')
+
+    def _fresh(self, ledger, version):
+        return ledger.version == version and time.monotonic() - ledger.loaded_at < self.ttl
+
+    def resident(self, user_id):
+        """The user's ledger if it is loaded and current, else None; never loads."""
+        version = self._version(user_id)
+        with self._lock:
+            ledger = self._ledgers.get(user_id)
+            if ledger is None or not self._fresh(ledger, version):
+                return None
+            self._ledgers.move_to_end(user_id)
+            self._hits += 1
+            return ledger
+
+    def get(self, user_id, loader):
+        """The user's ledger, calling loader(version) to build it when missing or stale."""
+        ledger = self.resident(user_id)
+        if ledger is not None:
+            return ledger
+        # The version is read before the load, so a write landing meanwhile
+        # leaves the new ledger stale rather than silently missing it.
+        ledger = loader(self._version(user_id))
+        with self._lock:
+            self._ledgers[user_id] = ledger
+            self._ledgers.move_to_end(user_id)
+            self._loads += 1
+            self._evict()
+        return ledger
+
+    def _evict(self):
+        total = sum(ledger.nbytes for ledger in self._ledgers.values())
+        while total > self.max_bytes and len(self._ledgers) > 1:
+            _, evicted = self._ledgers.popitem(last=False)
+            total -= evicted.nbytes
+            self._evictions += 1
+
+    def record(self, user_id, old=None, new=None):
+        """Apply a committed single-row change: `old` is removed, `new` added.
+
+        Rows need transaction_id and transaction_date; `new` also needs
+        amount, type, category_id and description.
+        """
+        with self._record_lock:
+            before = self._version(user_id)
+            cache.user_cache.invalidate(user_id, 'ledger')
+            after = self._version(user_id)
+            with self._lock:
+                ledger = self._ledgers.get(user_id)
+            # A ledger already behind another change can't be patched up to date
+            if ledger is None or ledger.version != before:
+                return
+            try:
+                if old is not None and not ledger.remove(old['transaction_id'], old['transaction_date']):
+                    raise KeyError(old['transaction_id'])
+                if new is not None:
+                    ledger.add(new)
+            except (KeyError, TypeError, ValueError, ArithmeticError):
+                self.invalidate(user_id)
+                return
+            ledger.version = after
+        with self._lock:
+            self._updates += 1
+            self._evict()
+
+    def invalidate(self, user_id):
+        """Drop the user's ledger here and mark copies elsewhere stale."""
+        cache.user_cache.invalidate(user_id, 'ledger')
+        with self._lock:
+            self._ledgers.pop(user_id, None)
+            self._invalidations += 1
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'users': len(self._ledgers),
+                'rows': sum(len(ledger) for ledger in self._ledgers.values()),
+                'bytes': sum(ledger.nbytes for ledger in self._ledgers.values()),
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'loads': self._loads,
+                'updates': self._updates,
+                'invalidations': self._invalidations,
+                'evictions': self._evictions,
+            }
+
+
+def resident(user_id):
+    """The user's current ledger, or None if ledgers are off or it isn't loaded."""
+    return ledgers.resident(user_id) if ledgers is not None else None
+
+
+def init_app(app):
+    global ledgers
+    max_bytes = app.config.get('LEDGER_MAX_BYTES', DEFAULT_MAX_BYTES)
+    # LEDGER_MAX_BYTES=0 turns ledgers off; every read goes to the database.
+    # They are off too when other processes' writes can't reach them.
+    enabled = max_bytes > 0 and cache.user_cache.coherent
+    ledgers = Ledgers(max_bytes, app.config.get('LEDGER_TTL', 300.0)) if enabled else None
+    return ledgers
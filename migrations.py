@@ -0,0 +1,334 @@
+"""Versioned schema migrations, recorded in `schema_version`.
+
+Migrations are plain functions registered with @migration(version, name)
+and applied in version order by `flask schema upgrade`. App startup only
+reads the current version and warns when it is behind (see `check`); it
+never issues DDL.
+
+MySQL commits DDL implicitly, so a migration can't be rolled back as a
+unit. Each step therefore checks information_schema before acting, and a
+migration interrupted part-way is simply run again by the next upgrade.
+Indexes are built online (ALGORITHM=INPLACE, LOCK=NONE) so reads and
+writes continue while they build.
+
+Changes to `transactions` columns or indexes must be applied to
+`transactions_archive` too: EXCHANGE PARTITION needs identical tables.
+
+On the SQLite backend the baseline is sqlite_store.SCHEMA, and the
+helpers below issue the SQLite form of each statement.
+"""
+import time
+
+import categorize
+import db
+import fx
+import partitions
+import recurring
+import search
+import sqlite_store
+import summary
+
+LOCK_NAME = 'finance_tracker.migrations'
+LOCK_TIMEOUT = 60
+
+CREATE_VERSION_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INT PRIMARY KEY,
+    name VARCHAR(200) NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    duration_ms INT NOT NULL
+);
+"""
+
+MIGRATIONS = []
+
+current = None
+
+
+def migration(version, name):
+    def register(function):
+        assert not MIGRATIONS or version > MIGRATIONS[-1][0], "migrations must be registered in version order"
+        MIGRATIONS.append((version, name, function))
+        return function
+    return register
+
+
+def latest():
+    return MIGRATIONS[-1][0]
+
+
+def ensure_index(cursor, table, name, columns, kind=''):
+    if db.dialect == 'sqlite':
+        # FULLTEXT has no SQLite index form; search uses FTS5 (see sqlite_store.py)
+        if kind != 'FULLTEXT':
+            cursor.execute(f"CREATE {kind} INDEX IF NOT EXISTS {name} ON {table} {columns}")
+        return
+    query = """
+    SELECT 1 FROM information_schema.statistics
+    WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    LIMIT 1
+    """
+    cursor.execute(query, (table, name))
+    if cursor.fetchone() is None:
+        # FULLTEXT builds can't run with LOCK=NONE; they still allow reads
+        lock = 'SHARED' if kind == 'FULLTEXT' else 'NONE'
+        cursor.execute(f"ALTER TABLE {table} ADD {kind} INDEX {name} {columns}, ALGORITHM=INPLACE, LOCK={lock}")
+        print(f"✅ Index {name} created on {table}.")
+
+
+def ensure_column(cursor, table, name, definition):
+    if db.dialect == 'sqlite':
+        query = "SELECT 1 FROM pragma_table_info(%s) WHERE name = %s"
+    else:
+        query = """
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        LIMIT 1
+        """
+    cursor.execute(query, (table, name))
+    if cursor.fetchone() is None:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+        print(f"✅ Column {name} added to {table}.")
+
+
+@migration(1, 'baseline schema')
+def baseline(cursor, config):
+    # Everything the old create_tables() built. Each step checks before it
+    # acts, so it also adopts databases created before migrations existed.
+    if db.dialect == 'sqlite':
+        sqlite_store.create_schema(cursor)
+        return
+
+    # Create the users table first, as other tables depend on it
+    create_users_table_query = """
+    CREATE TABLE IF NOT EXISTS users ( 
+    id INT AUTO_INCREMENT PRIMARY KEY, 
+    username VARCHAR(250) NOT NULL UNIQUE,
+    password VARCHAR(250) NOT NULL
+    )
+    """
+    cursor.execute(create_users_table_query)
+    print("✅ Users table ensured to exist.")
+
+    # Create the categories table, which depends on the users table
+    create_categories_table_query = """
+    CREATE TABLE IF NOT EXISTS categories (
+        category_id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(250) NOT NULL,
+        user_id INT,
+        createdBy INT NOT NULL,
+        createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        modifiedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (createdBy) REFERENCES users(id)
+    );
+    """
+    cursor.execute(create_categories_table_query)
+    print("✅ Categories table ensured to exist.")
+    ensure_index(cursor, 'categories', 'ft_categories_name', '(name)', kind='FULLTEXT')
+
+    # Create the transactions table. It is range-partitioned by date (see
+    # partitions.py), so it can't carry foreign keys and its primary key
+    # includes transaction_date.
+    create_transactions_table_query = """
+    CREATE TABLE IF NOT EXISTS transactions (
+        transaction_id INT AUTO_INCREMENT,
+        user_id INT NOT NULL,
+        amount DECIMAL(10,2) NOT NULL,
+        type ENUM('income','expense') NOT NULL,
+        category_id INT,
+        description VARCHAR(300) NOT NULL,
+        transaction_date DATE NOT NULL,
+        createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        modifiedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (transaction_id, transaction_date)
+    );
+    """
+    cursor.execute(create_transactions_table_query)
+    print("✅ Transactions table ensured to exist.")
+
+    # Composite index backing the dashboard's keyset pagination
+    ensure_index(cursor, 'transactions', 'idx_transactions_user_date_id',
+                  '(user_id, transaction_date, transaction_id)')
+    # Range-join index for evaluating each budget over its own period
+    ensure_index(cursor, 'transactions', 'idx_transactions_user_category_date',
+                  '(user_id, category_id, transaction_date)')
+    # Occurrences posted by recurring rules; the unique key makes posting idempotent
+    ensure_column(cursor, 'transactions', 'recurring_id', 'INT NULL')
+    ensure_index(cursor, 'transactions', 'uq_transactions_recurring_date', '(recurring_id, transaction_date)',
+                  kind='UNIQUE')
+    # Partition by date (converting an existing table) and create the archive tier
+    partitions.ensure(cursor, config['TRANSACTIONS_PARTITION_UNIT'], config['TRANSACTIONS_PARTITIONS_AHEAD'])
+    # FULLTEXT index serving the dashboard search box, kept beside the partitioned table
+    search.ensure_search_table(cursor)
+
+    # Create the budgets table
+    create_budgets_table_query = """
+    CREATE TABLE IF NOT EXISTS budgets (
+        budget_id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        category_id INT NOT NULL,
+        amount DECIMAL(10, 2) NOT NULL,
+        start_date DATE NOT NULL,
+        end_date DATE NOT NULL,
+        createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        modifiedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (category_id) REFERENCES categories(category_id)
+    );
+    """
+    cursor.execute(create_budgets_table_query)
+    print("✅ Budgets table ensured to exist.")
+
+    # Create the recurring rules table
+    cursor.execute(recurring.CREATE_RECURRING_TABLE_QUERY)
+    print("✅ Recurring transactions table ensured to exist.")
+
+    # Create the rollup table read by the dashboard totals
+    cursor.execute(summary.CREATE_SUMMARY_TABLE_QUERY)
+    print("✅ Summary table ensured to exist.")
+
+
+@migration(2, 'budgets (user_id, category_id, start_date) index')
+def budgets_lookup_index(cursor, config):
+    # Serves set_budget's duplicate check and the per-category budget join.
+    # transactions(user_id, transaction_date) needs no index of its own: it
+    # is the leading prefix of idx_transactions_user_date_id.
+    ensure_index(cursor, 'budgets', 'idx_budgets_user_category_start', '(user_id, category_id, start_date)')
+
+
+@migration(3, 'transactions ingest_id')
+def transactions_ingest_id(cursor, config):
+    # Identifies rows written from the ingestion journal (see ingest.py); the
+    # unique key lets a retried batch skip entries it already committed.
+    for table in ('transactions', partitions.ARCHIVE_TABLE):
+        ensure_column(cursor, table, 'ingest_id', 'CHAR(32) NULL')
+        ensure_index(cursor, table, 'uq_transactions_ingest_date', '(ingest_id, transaction_date)', kind='UNIQUE')
+
+
+@migration(4, 'currencies and exchange rates')
+def currencies(cursor, config):
+    # Existing rows are in the one currency the app used to assume.
+    default = fx.check_code(config.get('DEFAULT_CURRENCY', fx.DEFAULT_CURRENCY))
+    for table in ('transactions', partitions.ARCHIVE_TABLE, 'budgets'):
+        ensure_column(cursor, table, 'currency', f"CHAR(3) NOT NULL DEFAULT '{default}'")
+    # Lets totals read back only the rows in other currencies (summary.FOREIGN_TOTALS_QUERY)
+    for table in ('transactions', partitions.ARCHIVE_TABLE):
+        ensure_index(cursor, table, 'idx_transactions_user_currency', '(user_id, currency)')
+    cursor.execute(fx.CREATE_FX_RATES_TABLE_QUERY)
+    print("✅ Exchange rates table ensured to exist.")
+
+
+@migration(5, 'category rules')
+def category_rules(cursor, config):
+    cursor.execute(categorize.CREATE_RULES_QUERIES[db.dialect])
+    print("✅ Category rules table ensured to exist.")
+    ensure_index(cursor, 'category_rules', 'idx_category_rules_user', '(user_id, priority, rule_id)')
+
+
+@migration(6, 'fill summary rollup')
+def fill_summary(cursor, config):
+    # Migration 1 creates the rollup empty; on a database that already has
+    # transactions the dashboard totals would read zero until it is filled.
+    rows = summary.rebuild(cursor)
+    print(f"✅ Summary rollup rebuilt ({rows} rows).")
+
+
+@migration(7, 'transactions external_id')
+def transactions_external_id(cursor, config):
+    # A statement's own id for the row (OFX FITID), which imports dedupe on
+    for table in ('transactions', partitions.ARCHIVE_TABLE):
+        ensure_column(cursor, table, 'external_id', 'VARCHAR(255) NULL')
+        # One name on MySQL, like the other indexes both tables share; SQLite
+        # index names are database-wide, so there each table gets its own
+        name = f'idx_{table}_user_external' if db.dialect == 'sqlite' else 'idx_transactions_user_external'
+        ensure_index(cursor, table, name, '(user_id, external_id)')
+
+
+@migration(8, 'exchange rates version')
+def fx_rates_version(cursor, config):
+    cursor.execute(fx.CREATE_FX_RATES_VERSION_TABLE_QUERY)
+    print("✅ Exchange rates version table ensured to exist.")
+
+
+@migration(9, 'search index owner tokens')
+def search_owner_tokens(cursor, config):
+    # Bounds each description search to the searching user's rows (see search.py)
+    search.index_by_owner(cursor)
+
+
+def current_version(cursor):
+    if db.dialect == 'sqlite':
+        query = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    else:
+        query = """
+        SELECT 1 FROM information_schema.tables
+        WHERE table_schema = DATABASE() AND table_name = 'schema_version'
+        LIMIT 1
+        """
+    cursor.execute(query)
+    if cursor.fetchone() is None:
+        return 0
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+
+def pending(cursor):
+    version = current_version(cursor)
+    return [entry for entry in MIGRATIONS if entry[0] > version]
+
+
+def upgrade(connection, config, target=None):
+    """Apply pending migrations up to `target` (default: all); return [(version, name, seconds)]."""
+    cursor = connection.cursor(buffered=True)
+    named_lock = db.dialect == 'mysql'
+    if named_lock:
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, LOCK_TIMEOUT))
+        if not cursor.fetchone()[0]:
+            cursor.close()
+            raise RuntimeError("Another schema upgrade is in progress.")
+
+    applied = []
+    try:
+        cursor.execute(CREATE_VERSION_TABLE_QUERY)
+        for version, name, function in pending(cursor):
+            if target is not None and version > target:
+                break
+            started = time.perf_counter()
+            function(cursor, config)
+            seconds = time.perf_counter() - started
+            cursor.execute("INSERT INTO schema_version (version, name, duration_ms) VALUES (%s, %s, %s)",
+                           (version, name, int(seconds * 1000)))
+            connection.commit()
+            print(f"✅ Migration {version} ({name}) applied in {seconds:.1f}s.")
+            applied.append((version, name, seconds))
+    finally:
+        if named_lock:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+            cursor.fetchall()
+        cursor.close()
+    return applied
+
+
+def check(pool):
+    """Read the database's schema version and warn if it doesn't match this code."""
+    try:
+        with pool.connection() as connection:
+            cursor = connection.cursor(buffered=True)
+            version = current_version(cursor)
+            cursor.close()
+    except db.Error as err:
+        print(f"Database error: {err}")
+        return None
+    if version < latest():
+        print(f"⚠️ Database schema is at version {version}, this code expects {latest()}; "
+              f"run 'flask schema upgrade'.")
+    elif version > latest():
+        print(f"⚠️ Database schema version {version} is newer than this code ({latest()}).")
+    return version
+
+
+def init_app(app, pool):
+    global current
+    current = check(pool)
+    return current
@@ -0,0 +1,74 @@
+"""Keyset (seek) pagination over (transaction_date, transaction_id)."""
+import base64
+import binascii
+from datetime import date
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(transaction_date, transaction_id):
+    raw = f"{transaction_date.isoformat()}|{transaction_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Return (date, id) for a cursor token, or None if it is malformed."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        date_part, id_part = raw.split('|')
+        return date.fromisoformat(date_part), int(id_part)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def page_size(value):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def seek_clause(before=None, after=None):
+    """SQL fragment, params and sort direction for one page of transactions.
+
+    `before` walks towards older rows (next page), `after` towards newer ones
+    (previous page). The predicate is written out in expanded form so MySQL
+    can range-scan the (user_id, transaction_date, transaction_id) index,
+    with a plain date bound in front so it can also prune partitions.
+    """
+    if after is not None:
+        after_date, after_id = after
+        clause = (" AND t.transaction_date >= %s"
+                  " AND (t.transaction_date > %s OR (t.transaction_date = %s AND t.transaction_id > %s))")
+        return clause, [after_date, after_date, after_date, after_id], 'ASC'
+    if before is not None:
+        before_date, before_id = before
+        clause = (" AND t.transaction_date <= %s"
+                  " AND (t.transaction_date < %s OR (t.transaction_date = %s AND t.transaction_id < %s))")
+        return clause, [before_date, before_date, before_date, before_id], 'DESC'
+    return "", [], 'DESC'
+
+
+def paginate(rows, size, before=None, after=None):
+    """Trim a `size + 1` row fetch and work out the neighbouring cursors.
+
+    Rows come back newest first. Returns (rows, next_cursor, prev_cursor).
+    """
+    has_more = len(rows) > size
+    rows = rows[:size]
+    if after is not None:
+        rows.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = before is not None, has_more
+
+    next_cursor = prev_cursor = None
+    if rows and has_older:
+        next_cursor = encode_cursor(rows[-1]['transaction_date'], rows[-1]['transaction_id'])
+    if rows and has_newer:
+        prev_cursor = encode_cursor(rows[0]['transaction_date'], rows[0]['transaction_id'])
+    return rows, next_cursor, prev_cursor
@@ -0,0 +1,246 @@
+"""Range partitioning of `transactions` by date, and an archive tier for cold partitions.
+
+`transactions` is partitioned by RANGE COLUMNS(transaction_date) with one
+partition per year (or month), named after the period it starts (p2024,
+p202401), plus a catch-all `pmax`. `ensure` converts an unpartitioned
+table and keeps partitions defined a few periods ahead of today.
+
+`archive` moves cold partitions into `transactions_archive`, a table of the
+same structure partitioned the same way. Each move swaps the partition
+out through an empty staging table with EXCHANGE PARTITION, so it is a
+metadata change, not a row copy. The emptied hot partition is kept, so a
+late insert for an archived period still lands in its own range. Archived
+rows are read-only. The dashboard, search, budgets and edits read
+`transactions`; export, analytics, imports' duplicate check and the
+summary rebuild read both tiers (`all_tiers`, `tier_queries`).
+
+MySQL does not allow foreign keys or FULLTEXT indexes on partitioned
+tables, and every unique key has to include transaction_date. That is
+why the primary key is (transaction_id, transaction_date) and description
+search uses the `transaction_search` side table (see search.py).
+"""
+from datetime import date
+
+HOT_TABLE = 'transactions'
+ARCHIVE_TABLE = 'transactions_archive'
+UNITS = ('year', 'month')
+DEFAULT_AHEAD = 2
+
+
+def period_start(day, unit):
+    return date(day.year, 1, 1) if unit == 'year' else date(day.year, day.month, 1)
+
+
+def next_period(start, unit):
+    if unit == 'year':
+        return date(start.year + 1, 1, 1)
+    return date(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def previous_period(start, unit):
+    if unit == 'year':
+        return date(start.year - 1, 1, 1)
+    return date(start.year - (start.month == 1), (start.month - 2) % 12 + 1, 1)
+
+
+def partition_name(start, unit):
+    return f"p{start.year}" if unit == 'year' else f"p{start.year}{start.month:02d}"
+
+
+def window_start(anchor, unit):
+    """Lower date bound covering `anchor`'s period and the one before it.
+
+    Bounding a query by this lets MySQL prune to at most two partitions.
+    """
+    return previous_period(period_start(anchor, unit), unit)
+
+
+def all_tiers(query, params=()):
+    """`query` (with a {table} placeholder) over both tiers as one UNION ALL."""
+    tables = (HOT_TABLE, ARCHIVE_TABLE)
+    return ' UNION ALL '.join(query.format(table=table) for table in tables), list(params) * len(tables)
+
+
+def tier_queries(query, params=()):
+    """`query` (with a {table} placeholder) once per tier, archive first (oldest rows first)."""
+    return [(query.format(table=table), list(params)) for table in (ARCHIVE_TABLE, HOT_TABLE)]
+
+
+def list_partitions(cursor, table):
+    """[(name, upper_bound, approximate_rows)] in order; `pmax` has upper_bound None."""
+    query = """
+    SELECT partition_name, partition_description, table_rows
+    FROM information_schema.partitions
+    WHERE table_schema = DATABASE() AND table_name = %s AND partition_name IS NOT NULL
+    ORDER BY partition_ordinal_position
+    """
+    cursor.execute(query, (table,))
+    partitions = []
+    for name, description, rows in cursor.fetchall():
+        bound = None if description == 'MAXVALUE' else date.fromisoformat(description.strip("'"))
+        partitions.append((name, bound, rows))
+    return partitions
+
+
+def _definitions(bounds, unit):
+    parts = [f"PARTITION {partition_name(previous_period(upper, unit), unit)} VALUES LESS THAN ('{upper}')"
+             for upper in bounds]
+    return ', '.join(parts + ["PARTITION pmax VALUES LESS THAN (MAXVALUE)"])
+
+
+def _table_exists(cursor, table):
+    query = """
+    SELECT 1 FROM information_schema.tables
+    WHERE table_schema = DATABASE() AND table_name = %s
+    LIMIT 1
+    """
+    cursor.execute(query, (table,))
+    return cursor.fetchone() is not None
+
+
+def _convert(cursor, unit, ahead, today):
+    query = """
+    SELECT constraint_name FROM information_schema.table_constraints
+    WHERE table_schema = DATABASE() AND table_name = %s AND constraint_type = 'FOREIGN KEY'
+    """
+    cursor.execute(query, (HOT_TABLE,))
+    for (name,) in cursor.fetchall():
+        cursor.execute(f"ALTER TABLE {HOT_TABLE} DROP FOREIGN KEY {name}")
+
+    query = """
+    SELECT DISTINCT index_name FROM information_schema.statistics
+    WHERE table_schema = DATABASE() AND table_name = %s AND index_type = 'FULLTEXT'
+    """
+    cursor.execute(query, (HOT_TABLE,))
+    for (name,) in cursor.fetchall():
+        cursor.execute(f"ALTER TABLE {HOT_TABLE} DROP INDEX {name}")
+
+    query = """
+    SELECT column_name FROM information_schema.key_column_usage
+    WHERE table_schema = DATABASE() AND table_name = %s AND constraint_name = 'PRIMARY'
+    """
+    cursor.execute(query, (HOT_TABLE,))
+    if [row[0] for row in cursor.fetchall()] == ['transaction_id']:
+        cursor.execute(f"ALTER TABLE {HOT_TABLE} DROP PRIMARY KEY, ADD PRIMARY KEY (transaction_id, transaction_date)")
+
+    cursor.execute(f"SELECT MIN(transaction_date) FROM {HOT_TABLE}")
+    oldest = cursor.fetchone()[0] or today
+    upper = next_period(period_start(min(oldest, today), unit), unit)
+    last = next_period(period_start(today, unit), unit)
+    for _ in range(ahead):
+        last = next_period(last, unit)
+    bounds = []
+    while upper <= last:
+        bounds.append(upper)
+        upper = next_period(upper, unit)
+    cursor.execute(f"ALTER TABLE {HOT_TABLE} PARTITION BY RANGE COLUMNS(transaction_date) "
+                   f"({_definitions(bounds, unit)})")
+    print(f"✅ {HOT_TABLE} partitioned by {unit} ({len(bounds)} partitions).")
+
+
+def add_future(cursor, unit, ahead=DEFAULT_AHEAD, today=None):
+    """Split `pmax` so every period up to `ahead` after today has its own partition."""
+    today = today or date.today()
+    target = next_period(period_start(today, unit), unit)
+    for _ in range(ahead):
+        target = next_period(target, unit)
+
+    bounds = [upper for _, upper, _ in list_partitions(cursor, HOT_TABLE) if upper is not None]
+    upper = bounds[-1] if bounds else next_period(period_start(today, unit), unit)
+    new = [] if bounds else [upper]
+    while upper < target:
+        upper = next_period(upper, unit)
+        new.append(upper)
+    if new:
+        cursor.execute(f"ALTER TABLE {HOT_TABLE} REORGANIZE PARTITION pmax INTO ({_definitions(new, unit)})")
+    return [partition_name(previous_period(upper, unit), unit) for upper in new]
+
+
+def _ensure_archive(cursor):
+    if _table_exists(cursor, ARCHIVE_TABLE):
+        return
+    cursor.execute(f"CREATE TABLE {ARCHIVE_TABLE} LIKE {HOT_TABLE}")
+    # Archive partitions are added one by one as hot partitions are moved across
+    cursor.execute(f"ALTER TABLE {ARCHIVE_TABLE} PARTITION BY RANGE COLUMNS(transaction_date) "
+                   f"(PARTITION pmax VALUES LESS THAN (MAXVALUE))")
+    print(f"✅ {ARCHIVE_TABLE} created.")
+
+
+def ensure(cursor, unit='year', ahead=DEFAULT_AHEAD, today=None):
+    """Partition `transactions` if it isn't yet, add upcoming partitions and create the archive tier."""
+    today = today or date.today()
+    if not list_partitions(cursor, HOT_TABLE):
+        _convert(cursor, unit, ahead, today)
+    added = add_future(cursor, unit, ahead, today)
+    _ensure_archive(cursor)
+    return added
+
+
+def _is_empty(cursor, source):
+    cursor.execute(f"SELECT 1 FROM {source} LIMIT 1")
+    return cursor.fetchone() is None
+
+
+def _archive_partition(cursor, connection, name, upper):
+    if name not in [archived for archived, _, _ in list_partitions(cursor, ARCHIVE_TABLE)]:
+        cursor.execute(f"ALTER TABLE {ARCHIVE_TABLE} REORGANIZE PARTITION pmax INTO "
+                       f"(PARTITION {name} VALUES LESS THAN ('{upper}'), PARTITION pmax VALUES LESS THAN (MAXVALUE))")
+
+    staging = f"{HOT_TABLE}_exchange_{name}"
+    if not _table_exists(cursor, staging):
+        if _is_empty(cursor, f"{HOT_TABLE} PARTITION ({name})"):
+            return 0
+        cursor.execute(f"CREATE TABLE {staging} LIKE {HOT_TABLE}")
+        cursor.execute(f"ALTER TABLE {staging} REMOVE PARTITIONING")
+    # A staging table left by an interrupted run already holds that run's rows
+    if _is_empty(cursor, staging):
+        cursor.execute(f"ALTER TABLE {HOT_TABLE} EXCHANGE PARTITION {name} WITH TABLE {staging}")
+
+    cursor.execute(f"SELECT COUNT(*) FROM {staging}")
+    moved = cursor.fetchone()[0]
+    if _is_empty(cursor, f"{ARCHIVE_TABLE} PARTITION ({name})"):
+        cursor.execute(f"ALTER TABLE {ARCHIVE_TABLE} EXCHANGE PARTITION {name} WITH TABLE {staging}")
+    else:
+        # Late rows for a period archived earlier: too few to matter, so copy them
+        cursor.execute(f"INSERT INTO {ARCHIVE_TABLE} SELECT * FROM {staging}")
+        connection.commit()
+    cursor.execute(f"DROP TABLE {staging}")
+
+    # EXCHANGE doesn't fire the search triggers; archived rows leave search here
+    cursor.execute(f"""
+    DELETE s FROM transaction_search s
+    JOIN {ARCHIVE_TABLE} PARTITION ({name}) a ON a.transaction_id = s.transaction_id
+    """)
+    connection.commit()
+    return moved
+
+
+def archive(connection, before):
+    """Move every hot partition that ends on or before `before` into the archive tier.
+
+    Returns [(partition_name, rows_moved)] for the partitions that held rows.
+    """
+    cursor = connection.cursor(buffered=True)
+    try:
+        moved = []
+        for name, upper, _ in list_partitions(cursor, HOT_TABLE):
+            if upper is None or upper > before:
+                break
+            rows = _archive_partition(cursor, connection, name, upper)
+            if rows:
+                moved.append((name, rows))
+        return moved
+    finally:
+        cursor.close()
+
+
+def explain_partitions(cursor, query, params):
+    """The partitions MySQL will read for `query`, per table alias, from EXPLAIN."""
+    cursor.execute('EXPLAIN ' + query, params)
+    columns = [column[0] for column in cursor.description]
+    plan = {}
+    for row in cursor.fetchall():
+        row = dict(zip(columns, row))
+        if row.get('partitions'):
+            plan[row['table']] = row['partitions'].split(',')
+    return plan
@@ -0,0 +1,292 @@
+"""Recurring transaction rules and the scheduler that posts their occurrences.
+
+A rule repeats every `interval_count` days, weeks, months or years from
+`start_date` until `end_date` (or indefinitely). `next_occurrence` counts
+the occurrences already posted and `next_run_date` is the date of the
+next one, so a run after downtime catches up on every missed date.
+
+Due rules for all users are processed in batches: each batch posts its
+occurrences with one executemany, folds them into the monthly rollup,
+advances the rules and commits, so a failure leaves every rule either
+posted for that batch or untouched. On MySQL, runs are serialized across
+app instances with a named lock (SQLite's write lock already does it),
+and a unique key on
+transactions (recurring_id, transaction_date) guarantees an occurrence
+is never posted twice.
+"""
+import threading
+import time
+from calendar import monthrange
+from datetime import date, timedelta
+
+import db
+import summary
+
+FREQUENCIES = ('daily', 'weekly', 'monthly', 'yearly')
+DEFAULT_BATCH_SIZE = 1000
+# Caps how far a single rule catches up per batch; a rule still behind
+# stays due and is picked up again by the next batch of the same run.
+MAX_OCCURRENCES_PER_BATCH = 366
+LOCK_NAME = 'finance_tracker.recurring'
+
+CREATE_RECURRING_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS recurring_transactions (
+    recurring_id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    amount DECIMAL(10,2) NOT NULL,
+    type ENUM('income','expense') NOT NULL,
+    category_id INT,
+    description VARCHAR(300) NOT NULL,
+    frequency ENUM('daily','weekly','monthly','yearly') NOT NULL,
+    interval_count INT NOT NULL DEFAULT 1,
+    start_date DATE NOT NULL,
+    end_date DATE,
+    next_occurrence INT NOT NULL DEFAULT 0,
+    next_run_date DATE,
+    createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    modifiedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX idx_recurring_next_run (next_run_date, recurring_id),
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    FOREIGN KEY (category_id) REFERENCES categories(category_id)
+);
+"""
+
+_RULE_COLUMNS = """
+    recurring_id, user_id, amount, type, category_id, description,
+    frequency, interval_count, start_date, end_date, next_occurrence
+"""
+
+scheduler = None
+
+
+def _add_months(day, months):
+    index = day.month - 1 + months
+    year, month = day.year + index // 12, index % 12 + 1
+    # A rule on the 31st falls on the last day of shorter months
+    return date(year, month, min(day.day, monthrange(year, month)[1]))
+
+
+def occurrence(start_date, frequency, interval_count, n):
+    """The date of the `n`th (0-based) occurrence of a rule."""
+    step = n * interval_count
+    if frequency == 'daily':
+        return start_date + timedelta(days=step)
+    if frequency == 'weekly':
+        return start_date + timedelta(weeks=step)
+    if frequency == 'monthly':
+        return _add_months(start_date, step)
+    return _add_months(start_date, 12 * step)
+
+
+def _due_rules(cursor, today, batch_size):
+    query = f"""
+    SELECT {_RULE_COLUMNS}
+    FROM recurring_transactions
+    WHERE next_run_date <= %s
+    ORDER BY next_run_date, recurring_id
+    LIMIT %s
+    FOR UPDATE
+    """
+    cursor.execute(query, (today, batch_size))
+    return cursor.fetchall()
+
+
+def _already_posted(cursor, rows):
+    if not rows:
+        return set()
+    ids = sorted({row['recurring_id'] for row in rows})
+    placeholders = ', '.join(['%s'] * len(ids))
+    query = f"""
+    SELECT recurring_id, transaction_date
+    FROM transactions
+    WHERE recurring_id IN ({placeholders}) AND transaction_date BETWEEN %s AND %s
+    """
+    dates = [row['transaction_date'] for row in rows]
+    cursor.execute(query, ids + [min(dates), max(dates)])
+    return {(row['recurring_id'], row['transaction_date']) for row in cursor.fetchall()}
+
+
+def _advance(cursor, advances):
+    if db.dialect == 'sqlite':
+        # No round trips to save on an embedded database
+        query = "UPDATE recurring_transactions SET next_occurrence = %s, next_run_date = %s WHERE recurring_id = %s"
+        cursor.executemany(query, [(n, day, recurring_id) for recurring_id, n, day in advances])
+        return
+    # One UPDATE joined against the new positions, rather than a round trip per rule
+    values = ' UNION ALL '.join(['SELECT %s AS recurring_id, %s AS next_occurrence, %s AS next_run_date']
+                                + ['SELECT %s, %s, %s'] * (len(advances) - 1))
+    query = f"""
+    UPDATE recurring_transactions r
+    JOIN ({values}) v ON r.recurring_id = v.recurring_id
+    SET r.next_occurrence = v.next_occurrence, r.next_run_date = v.next_run_date
+    """
+    cursor.execute(query, [value for advance in advances for value in advance])
+
+
+def post_due(cursor, rules, today):
+    """Post every occurrence of `rules` due on or before `today`; return the rows posted.
+
+    `rules` must be locked by the caller (SELECT ... FOR UPDATE) and the
+    caller owns the commit.
+    """
+    rows = []
+    advances = []
+    for rule in rules:
+        n = rule['next_occurrence']
+        stop = n + MAX_OCCURRENCES_PER_BATCH
+        day = occurrence(rule['start_date'], rule['frequency'], rule['interval_count'], n)
+        while day <= today and (rule['end_date'] is None or day <= rule['end_date']) and n < stop:
+            rows.append({
+                'user_id': rule['user_id'],
+                'amount': rule['amount'],
+                'type': rule['type'],
+                'category_id': rule['category_id'],
+                'description': rule['description'],
+                'transaction_date': day,
+                'recurring_id': rule['recurring_id'],
+            })
+            n += 1
+            day = occurrence(rule['start_date'], rule['frequency'], rule['interval_count'], n)
+        finished = rule['end_date'] is not None and day > rule['end_date']
+        advances.append((rule['recurring_id'], n, None if finished else day))
+
+    posted = _already_posted(cursor, rows)
+    rows = [row for row in rows if (row['recurring_id'], row['transaction_date']) not in posted]
+    if rows:
+        query = """
+        INSERT INTO transactions (user_id, amount, type, category_id, description, transaction_date, recurring_id)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """
+        cursor.executemany(query, [(r['user_id'], r['amount'], r['type'], r['category_id'], r['description'],
+                                    r['transaction_date'], r['recurring_id']) for r in rows])
+        summary.record_rows(cursor, rows)
+    if advances:
+        _advance(cursor, advances)
+    return rows
+
+
+def catch_up(cursor, recurring_id, today=None):
+    """Post the due occurrences of one rule (e.g. right after it is created)."""
+    query = f"SELECT {_RULE_COLUMNS} FROM recurring_transactions WHERE recurring_id = %s FOR UPDATE"
+    cursor.execute(query, (recurring_id,))
+    return post_due(cursor, cursor.fetchall(), today or date.today())
+
+
+def materialize(connection, today=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Post all due occurrences for every user, committing once per batch of rules.
+
+    Returns a dict with the number of rules processed, transactions posted
+    and the set of affected user ids, or None if another instance holds
+    the scheduler lock.
+    """
+    today = today or date.today()
+    cursor = connection.cursor(dictionary=True, buffered=True)
+    named_lock = db.dialect == 'mysql'
+    if named_lock:
+        cursor.execute("SELECT GET_LOCK(%s, 0) AS acquired", (LOCK_NAME,))
+        if not cursor.fetchone()['acquired']:
+            cursor.close()
+            return None
+
+    result = {'rules': 0, 'posted': 0, 'user_ids': set()}
+    try:
+        while True:
+            rules = _due_rules(cursor, today, batch_size)
+            if not rules:
+                break
+            rows = post_due(cursor, rules, today)
+            connection.commit()
+            result['rules'] += len(rules)
+            result['posted'] += len(rows)
+            result['user_ids'].update(row['user_id'] for row in rows)
+    finally:
+        connection.rollback()
+        if named_lock:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+            cursor.fetchall()
+        cursor.close()
+    return result
+
+
+class Scheduler:
+    """Runs `materialize` on a daemon thread every `interval` seconds."""
+
+    def __init__(self, pool, interval=3600.0, batch_size=DEFAULT_BATCH_SIZE, on_posted=None):
+        self.pool = pool
+        self.interval = interval
+        self.batch_size = batch_size
+        self.on_posted = on_posted
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._runs = 0
+        self._skipped = 0
+        self._failures = 0
+        self._posted = 0
+        self._last_run_at = None
+        self._last_run_seconds = None
+
+    def run_once(self, today=None):
+        started = time.perf_counter()
+        with self.pool.connection() as connection:
+            result = materialize(connection, today, self.batch_size)
+        with self._lock:
+            if result is None:
+                self._skipped += 1
+                return None
+            self._runs += 1
+            self._posted += result['posted']
+            self._last_run_at = time.time()
+            self._last_run_seconds = time.perf_counter() - started
+        if self.on_posted is not None:
+            for user_id in result['user_ids']:
+                self.on_posted(user_id)
+        return result
+
+    def _loop(self):
+        # The first run waits briefly so startup (and create_tables) can finish
+        delay = min(self.interval, 30.0)
+        while not self._stop.wait(delay):
+            try:
+                result = self.run_once()
+                if result and result['posted']:
+                    print(f"Posted {result['posted']} recurring transactions for {len(result['user_ids'])} users.")
+            except db.Error as err:
+                with self._lock:
+                    self._failures += 1
+                print(f"Database error: {err}")
+            delay = self.interval
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='recurring-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'interval': self.interval,
+                'running': self._thread is not None and self._thread.is_alive(),
+                'runs': self._runs,
+                'skipped_locked': self._skipped,
+                'failures': self._failures,
+                'posted': self._posted,
+                'last_run_at': self._last_run_at,
+                'last_run_seconds': self._last_run_seconds,
+            }
+
+
+def init_app(app, pool, on_posted=None):
+    global scheduler
+    scheduler = Scheduler(
+        pool,
+        interval=app.config.get('RECURRING_INTERVAL', 3600.0),
+        batch_size=app.config.get('RECURRING_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+        on_posted=on_posted,
+    )
+    if scheduler.interval > 0:
+        scheduler.start()
+    return scheduler
@@ -0,0 +1,363 @@
+"""Data access for the routes: users, categories, transactions, budgets, recurring and category rules.
+
+Routes go through these repositories instead of running SQL themselves.
+They work on whichever backend db.init_app selected (MySQL, or the
+embedded SQLite store in sqlite_store.py) over the request's pooled
+connection. The SQL is shared; the few statements the two dialects write
+differently are chosen by the modules that own them (search, summary,
+analytics, recurring, migrations). Write methods never commit: the route
+calls `commit()` once, after all of its changes.
+"""
+from datetime import datetime
+
+from flask import current_app, g
+
+import analytics
+import budgeting
+import bulk
+import categorize
+import db
+import export
+import fx
+import importer
+import ledger
+import partitions
+import recurring
+import search
+import summary
+from pagination import paginate, seek_clause
+
+USERNAME_QUERY = "SELECT username FROM users WHERE id = %s"
+CATEGORIES_QUERY = "SELECT category_id, name FROM categories WHERE user_id = %s"
+TRANSACTION_QUERY = "SELECT * FROM transactions WHERE transaction_id = %s AND user_id = %s"
+BUDGET_QUERY = "SELECT * FROM budgets WHERE budget_id = %s AND user_id = %s"
+
+RECURRING_QUERY = """
+SELECT r.recurring_id, r.amount, r.type, r.description, r.frequency, r.interval_count,
+       r.start_date, r.end_date, r.next_run_date, c.name AS category_name
+FROM recurring_transactions r
+LEFT JOIN categories c ON r.category_id = c.category_id
+WHERE r.user_id = %s
+ORDER BY r.next_run_date IS NULL, r.next_run_date, r.recurring_id
+"""
+
+# The current row, locked so the rollup delta is computed against what is overwritten
+_LOCK_TRANSACTION_QUERY = """
+SELECT transaction_id, amount, type, category_id, transaction_date
+FROM transactions
+WHERE transaction_id = %s AND user_id = %s
+FOR UPDATE
+"""
+
+
+def page_window(before, after, unit):
+    # Pages walking back in time first look only at the partitions holding
+    # the cursor's (or today's) period and the one before, so MySQL prunes
+    # the rest; most pages fill from there. SQLite has no partitions.
+    if after is not None or db.dialect != 'mysql':
+        return None
+    anchor = before[0] if before is not None else datetime.now().date()
+    return partitions.window_start(anchor, unit)
+
+
+def page_query(user_id, search_query, before, after, limit, since=None, min_token_size=search.MIN_TOKEN_SIZE):
+    """SQL and params for one dashboard page of transactions (`limit + 1` rows)."""
+    query = """
+    SELECT
+        t.*, c.name AS category_name
+    FROM
+        transactions t
+    LEFT JOIN
+        categories c ON t.category_id = c.category_id
+    WHERE
+        t.user_id = %s
+    """
+    params = [user_id]
+
+    if search_query:
+        search_sql, search_params = search.search_clause(search_query, user_id, min_token_size)
+        query += search_sql
+        params.extend(search_params)
+
+    if since is not None:
+        query += " AND t.transaction_date >= %s"
+        params.append(since)
+
+    # Only fetch one page, seeking past the cursor instead of using OFFSET
+    seek_sql, seek_params, direction = seek_clause(before, after)
+    query += seek_sql
+    params.extend(seek_params)
+    query += f" ORDER BY t.transaction_date {direction}, t.transaction_id {direction} LIMIT %s;"
+    params.append(limit + 1)
+    return query, tuple(params)
+
+
+class Repository:
+    def __init__(self, connection, cursor, config):
+        # Callables returning the request's connection and a new cursor on it
+        self._connection = connection
+        self._cursor = cursor
+        self._config = config
+
+    def _fetchall(self, query, params):
+        cursor = self._cursor(dictionary=True)
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+    def _fetchone(self, query, params):
+        cursor = self._cursor(dictionary=True)
+        cursor.execute(query, params)
+        return cursor.fetchone()
+
+
+class UserRepo(Repository):
+    def by_username(self, username):
+        return self._fetchone("SELECT * FROM users WHERE username = %s", (username,))
+
+    def username(self, user_id):
+        user = self._fetchone(USERNAME_QUERY, (user_id,))
+        return user['username'] if user else None
+
+    def create(self, username, password_hash):
+        """Insert a user; a taken username raises one of db.IntegrityError."""
+        cursor = self._cursor()
+        cursor.execute("INSERT INTO users (username, password) VALUES (%s, %s)", (username, password_hash))
+        return cursor.lastrowid
+
+
+class CategoryRepo(Repository):
+    def for_user(self, user_id):
+        return self._fetchall(CATEGORIES_QUERY, (user_id,))
+
+    def create(self, user_id, name):
+        cursor = self._cursor()
+        cursor.execute("INSERT INTO categories (name, user_id, createdBy) VALUES (%s, %s, %s)",
+                       (name, user_id, user_id))
+        return cursor.lastrowid
+
+
+class TransactionRepo(Repository):
+    def page_query(self, user_id, search_query, before, after, limit, since=None):
+        return page_query(user_id, search_query, before, after, limit, since,
+                          self._config['FULLTEXT_MIN_TOKEN_SIZE'])
+
+    def page(self, user_id, search_query, before, after, limit):
+        """One page of transactions, newest first: (rows, next_cursor, prev_cursor)."""
+        cursor = self._cursor(dictionary=True)
+        since = page_window(before, after, self._config['TRANSACTIONS_PARTITION_UNIT'])
+        cursor.execute(*self.page_query(user_id, search_query, before, after, limit, since))
+        rows = cursor.fetchall()
+        if since is not None and len(rows) <= limit:
+            # Not a full page within the recent partitions; look through the rest
+            cursor.execute(*self.page_query(user_id, search_query, before, after, limit))
+            rows = cursor.fetchall()
+        return paginate(rows, limit, before, after)
+
+    def get(self, user_id, transaction_id):
+        return self._fetchone(TRANSACTION_QUERY, (transaction_id, user_id))
+
+    def totals(self, user_id, currency=None):
+        """(total_income, total_expenses, spent_per_category), read from the per-month rollup.
+
+        In `currency` if given (see summary.read_totals).
+        """
+        return summary.read_totals(self._cursor(dictionary=True), user_id, currency)
+
+    def add(self, user_id, amount, transaction_type, category_id, description, transaction_date, currency):
+        cursor = self._cursor()
+        query = """
+        INSERT INTO transactions (user_id, amount, type, category_id, description, transaction_date, currency)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """
+        cursor.execute(query, (user_id, amount, transaction_type, category_id, description, transaction_date,
+                               currency))
+        transaction_id = cursor.lastrowid
+        summary.record_change(cursor, user_id, new={'amount': amount, 'type': transaction_type,
+                                                    'category_id': category_id,
+                                                    'transaction_date': transaction_date})
+        return transaction_id
+
+    def update(self, user_id, transaction_id, amount, transaction_type, category_id, description,
+               transaction_date, currency):
+        """Overwrite a transaction; returns the row replaced, or None if there is no such row of the user's."""
+        cursor = self._cursor(dictionary=True)
+        cursor.execute(_LOCK_TRANSACTION_QUERY, (transaction_id, user_id))
+        old = cursor.fetchone()
+        if old is None:
+            return None
+        query = """
+        UPDATE transactions
+        SET amount = %s, type = %s, category_id = %s, description = %s, transaction_date = %s, currency = %s
+        WHERE transaction_id = %s AND user_id = %s
+        """
+        cursor.execute(query, (amount, transaction_type, category_id, description, transaction_date, currency,
+                               transaction_id, user_id))
+        summary.record_change(cursor, user_id, old=old,
+                              new={'amount': amount, 'type': transaction_type, 'category_id': category_id,
+                                   'transaction_date': transaction_date})
+        return old
+
+    def delete(self, user_id, transaction_id):
+        """Delete a transaction; returns the row deleted, or None if there is no such row of the user's."""
+        cursor = self._cursor(dictionary=True)
+        cursor.execute(_LOCK_TRANSACTION_QUERY, (transaction_id, user_id))
+        old = cursor.fetchone()
+        if old is None:
+            return None
+        cursor.execute("DELETE FROM transactions WHERE transaction_id = %s AND user_id = %s",
+                       (transaction_id, user_id))
+        summary.record_change(cursor, user_id, old=old)
+        return old
+
+    def bulk(self, user_id, operation):
+        """Apply a parsed bulk.parse() operation; see bulk.apply."""
+        return bulk.apply(self._cursor(dictionary=True), user_id, operation,
+                          self._config['FULLTEXT_MIN_TOKEN_SIZE'])
+
+    def import_statement(self, user_id, stream, fmt, currency=None, matcher=None):
+        # Commits every IMPORT_CHUNK_SIZE rows itself
+        return importer.import_statement(self._connection(), user_id, stream, fmt,
+                                         batch_size=self._config['IMPORT_BATCH_SIZE'],
+                                         chunk_size=self._config['IMPORT_CHUNK_SIZE'],
+                                         currency=currency, currencies=fx.currencies(), matcher=matcher)
+
+    def export(self, fmt, user_id, start_date=None, end_date=None, category_id=None, uncategorized=False):
+        """The encoded export as a generator; it reads on its own connection as it is consumed."""
+        return export.stream(fmt, export.build_query(user_id, start_date, end_date, category_id, uncategorized))
+
+    def analytics_inputs(self, user_id, start_date, end_date):
+        """(columns, opening_balance_cents) for analytics.compute."""
+        cursor = self._cursor()
+        columns = analytics.load_columns(cursor, user_id, start_date, end_date)
+        return columns, analytics.opening_balance(cursor, user_id, start_date)
+
+    def ledger(self, user_id, version):
+        """All of the user's transactions as a ledger.UserLedger."""
+        return ledger.load(self._cursor(), user_id, version)
+
+
+class BudgetRepo(Repository):
+    def spend_rows(self, user_id):
+        """budgeting.load_spend: the budget rows and their foreign-currency spend, unconverted."""
+        return budgeting.load_spend(self._cursor(dictionary=True), user_id)
+
+    def definitions(self, user_id):
+        """The user's budgets without their spend, for ledger.UserLedger.budget_spend."""
+        return self._fetchall(budgeting.BUDGETS_QUERY, (user_id,))
+
+    def get(self, user_id, budget_id):
+        return self._fetchone(BUDGET_QUERY, (budget_id, user_id))
+
+    def exists(self, user_id, category_id, start_date):
+        cursor = self._cursor()
+        query = """
+        SELECT COUNT(*) FROM budgets
+        WHERE user_id = %s AND category_id = %s AND start_date = %s
+        """
+        cursor.execute(query, (user_id, category_id, start_date))
+        return cursor.fetchone()[0] > 0
+
+    def create(self, user_id, category_id, amount, start_date, end_date, currency):
+        cursor = self._cursor()
+        query = """
+        INSERT INTO budgets (user_id, category_id, amount, start_date, end_date, currency)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        """
+        cursor.execute(query, (user_id, category_id, amount, start_date, end_date, currency))
+        return cursor.lastrowid
+
+    def update(self, user_id, budget_id, amount, start_date, end_date, currency):
+        cursor = self._cursor()
+        query = """
+        UPDATE budgets
+        SET amount = %s, start_date = %s, end_date = %s, currency = %s
+        WHERE budget_id = %s AND user_id = %s
+        """
+        cursor.execute(query, (amount, start_date, end_date, currency, budget_id, user_id))
+        return cursor.rowcount > 0
+
+    def delete(self, user_id, budget_id):
+        cursor = self._cursor()
+        cursor.execute("DELETE FROM budgets WHERE budget_id = %s AND user_id = %s", (budget_id, user_id))
+        return cursor.rowcount > 0
+
+
+class RecurringRepo(Repository):
+    def for_user(self, user_id):
+        return self._fetchall(RECURRING_QUERY, (user_id,))
+
+    def create(self, user_id, amount, transaction_type, category_id, description, frequency, interval_count,
+               start_date, end_date):
+        """Add a rule and post its occurrences already due; returns the rows posted."""
+        cursor = self._cursor(dictionary=True)
+        query = """
+        INSERT INTO recurring_transactions
+            (user_id, amount, type, category_id, description, frequency, interval_count,
+             start_date, end_date, next_run_date)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """
+        cursor.execute(query, (user_id, amount, transaction_type, category_id, description, frequency,
+                               interval_count, start_date, end_date, start_date))
+        return recurring.catch_up(cursor, cursor.lastrowid)
+
+    def delete(self, user_id, recurring_id):
+        # Transactions already posted by the rule are kept
+        cursor = self._cursor()
+        query = "DELETE FROM recurring_transactions WHERE recurring_id = %s AND user_id = %s"
+        cursor.execute(query, (recurring_id, user_id))
+        return cursor.rowcount > 0
+
+
+class RuleRepo(Repository):
+    def for_user(self, user_id):
+        return self._fetchall(categorize.RULES_QUERY, (user_id,))
+
+    def count(self, user_id):
+        cursor = self._cursor()
+        cursor.execute("SELECT COUNT(*) FROM category_rules WHERE user_id = %s", (user_id,))
+        return cursor.fetchone()[0]
+
+    def create(self, user_id, rule):
+        """Insert a categorize.parse() rule; its category must be one of the user's."""
+        cursor = self._cursor()
+        query = """
+        INSERT INTO category_rules (user_id, category_id, kind, pattern, min_amount, max_amount, type, priority)
+        SELECT %s, category_id, %s, %s, %s, %s, %s, %s
+        FROM categories
+        WHERE category_id = %s AND user_id = %s
+        """
+        cursor.execute(query, (user_id, rule['kind'], rule['pattern'], rule['min_amount'], rule['max_amount'],
+                               rule['type'], rule['priority'], rule['category_id'], user_id))
+        return cursor.lastrowid if cursor.rowcount > 0 else None
+
+    def delete(self, user_id, rule_id):
+        cursor = self._cursor()
+        cursor.execute("DELETE FROM category_rules WHERE rule_id = %s AND user_id = %s", (rule_id, user_id))
+        return cursor.rowcount > 0
+
+    def backfill(self, user_id, matcher):
+        # Commits every IMPORT_BATCH_SIZE rows itself
+        return categorize.backfill(self._connection(), user_id, matcher, self._config['IMPORT_BATCH_SIZE'])
+
+
+class Repositories:
+    """The repositories for one connection, plus its commit."""
+
+    def __init__(self, connection, cursor, config):
+        self._connection = connection
+        self.users = UserRepo(connection, cursor, config)
+        self.categories = CategoryRepo(connection, cursor, config)
+        self.transactions = TransactionRepo(connection, cursor, config)
+        self.budgets = BudgetRepo(connection, cursor, config)
+        self.recurring = RecurringRepo(connection, cursor, config)
+        self.rules = RuleRepo(connection, cursor, config)
+
+    def commit(self):
+        self._connection().commit()
+
+
+def get_repos():
+    """The current request's repositories, on its pooled connection."""
+    if 'repos' not in g:
+        g.repos = Repositories(db.get_db, db.get_cursor, current_app.config)
+    return g.repos
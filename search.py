@@ -0,0 +1,182 @@
+"""Dashboard search backed by FULLTEXT indexes on descriptions and category names.
+
+`transactions` is partitioned, and MySQL can't put a FULLTEXT index on a
+partitioned table, so descriptions are mirrored into `transaction_search`
+by triggers and matched there. The SQLite backend mirrors them into an
+FTS5 table instead (see sqlite_store.py).
+
+Both indexes cover every user's rows, so each row also carries its
+owner's token (`owner_token`) and every match requires it: the index
+then only yields the searching user's rows, rather than every account's
+matches for user_id to filter afterwards. On MySQL the token is part of
+the indexed `document`; a search word that is a prefix of the user's own
+token would match all of their rows, so such searches scan with LIKE.
+"""
+import re
+
+import db
+import sqlite_store
+
+# InnoDB ignores tokens shorter than innodb_ft_min_token_size (3 by default)
+MIN_TOKEN_SIZE = 3
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+OWNER_PREFIX = 'owner'
+
+CREATE_SEARCH_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS transaction_search (
+    transaction_id INT PRIMARY KEY,
+    user_id INT NOT NULL,
+    description VARCHAR(300) NOT NULL,
+    document VARCHAR(330) NOT NULL DEFAULT '',
+    FULLTEXT INDEX ft_transaction_search_document (document)
+);
+"""
+
+# The owner token followed by the description; see owner_token
+_DOCUMENT = "CONCAT('" + OWNER_PREFIX + "', {row}.user_id, ' ', {row}.description)"
+
+TRIGGERS = {
+    'trg_transactions_search_insert': f"""
+    CREATE TRIGGER trg_transactions_search_insert AFTER INSERT ON transactions FOR EACH ROW
+        INSERT INTO transaction_search (transaction_id, user_id, description, document)
+        VALUES (NEW.transaction_id, NEW.user_id, NEW.description, {_DOCUMENT.format(row='NEW')})
+    """,
+    'trg_transactions_search_update': f"""
+    CREATE TRIGGER trg_transactions_search_update AFTER UPDATE ON transactions FOR EACH ROW
+        UPDATE transaction_search SET description = NEW.description, document = {_DOCUMENT.format(row='NEW')}
+        WHERE transaction_id = NEW.transaction_id AND description <> NEW.description
+    """,
+    'trg_transactions_search_delete': """
+    CREATE TRIGGER trg_transactions_search_delete AFTER DELETE ON transactions FOR EACH ROW
+        DELETE FROM transaction_search WHERE transaction_id = OLD.transaction_id
+    """,
+}
+
+
+def ensure_search_table(cursor):
+    """Create the description index table and its triggers, backfilling it the first time."""
+    cursor.execute(CREATE_SEARCH_TABLE_QUERY)
+    query = """
+    SELECT trigger_name FROM information_schema.triggers
+    WHERE trigger_schema = DATABASE() AND event_object_table = 'transactions'
+    """
+    cursor.execute(query)
+    existing = {row[0] for row in cursor.fetchall()}
+    missing = [name for name in TRIGGERS if name not in existing]
+    for name in missing:
+        cursor.execute(TRIGGERS[name])
+    if missing:
+        cursor.execute(f"""
+        INSERT IGNORE INTO transaction_search (transaction_id, user_id, description, document)
+        SELECT transaction_id, user_id, description, {_DOCUMENT.format(row='transactions')} FROM transactions
+        """)
+        print(f"✅ Search index triggers created ({cursor.rowcount} descriptions indexed).")
+
+
+def index_by_owner(cursor):
+    """Move a search table from before owner tokens over to them (see the module docstring)."""
+    if db.dialect == 'sqlite':
+        sqlite_store.rebuild_search(cursor)
+        return
+    query = """
+    SELECT 1 FROM information_schema.columns
+    WHERE table_schema = DATABASE() AND table_name = 'transaction_search' AND column_name = 'document'
+    """
+    cursor.execute(query)
+    if cursor.fetchone() is None:
+        cursor.execute("ALTER TABLE transaction_search ADD COLUMN document VARCHAR(330) NOT NULL DEFAULT ''")
+    # The old triggers don't write `document`; replace them before backfilling
+    # so no row written meanwhile is left without it.
+    for name, trigger in TRIGGERS.items():
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(trigger)
+    cursor.execute(f"""
+    UPDATE transaction_search s JOIN transactions ON transactions.transaction_id = s.transaction_id
+    SET s.description = transactions.description, s.document = {_DOCUMENT.format(row='transactions')}
+    WHERE s.document = ''
+    """)
+    print(f"✅ Owner tokens added to {cursor.rowcount} search rows.")
+    query = """
+    SELECT index_name FROM information_schema.statistics
+    WHERE table_schema = DATABASE() AND table_name = 'transaction_search' AND index_type = 'FULLTEXT'
+    """
+    cursor.execute(query)
+    indexes = {row[0] for row in cursor.fetchall()}
+    if 'ft_transaction_search_document' not in indexes:
+        cursor.execute("ALTER TABLE transaction_search ADD FULLTEXT INDEX ft_transaction_search_document (document), "
+                       "ALGORITHM=INPLACE, LOCK=SHARED")
+    if 'ft_transaction_search_description' in indexes:
+        cursor.execute("ALTER TABLE transaction_search DROP INDEX ft_transaction_search_description")
+    print("✅ Search index now covers owner tokens.")
+
+
+def owner_token(user_id):
+    """The word every one of `user_id`'s search rows is indexed with."""
+    return f"{OWNER_PREFIX}{user_id}"
+
+
+def boolean_query(search_query, min_token_size=MIN_TOKEN_SIZE):
+    """Turn free text into a BOOLEAN MODE query that requires every word as a prefix.
+
+    Returns None when any word is too short for the FULLTEXT index to serve,
+    in which case the caller should fall back to a LIKE scan.
+    """
+    tokens = _TOKEN_RE.findall(search_query)
+    if not tokens or any(len(token) < min_token_size for token in tokens):
+        return None
+    return ' '.join(f"+{token}*" for token in tokens)
+
+
+def _sqlite_search_clause(search_query, user_id):
+    tokens = _TOKEN_RE.findall(search_query)
+    pattern = f"%{search_query}%"
+    if not tokens:
+        return " AND (t.description LIKE %s OR c.name LIKE %s)", [pattern, pattern]
+    # FTS5 has no minimum token size; every word must match as a prefix.
+    # The owner token is in its own column, so words can't match it.
+    words = ' '.join(f'"{token}"*' for token in tokens)
+    match = f'owner : "{owner_token(user_id)}" AND description : ({words})'
+    clause = """
+    AND (
+        t.transaction_id IN (
+            SELECT rowid FROM transaction_search
+            WHERE transaction_search MATCH %s AND user_id = %s
+        )
+        OR t.category_id IN (
+            SELECT category_id FROM categories
+            WHERE user_id = %s AND name LIKE %s
+        )
+    )
+    """
+    return clause, [match, user_id, user_id, pattern]
+
+
+def search_clause(search_query, user_id, min_token_size=MIN_TOKEN_SIZE):
+    """SQL fragment and params restricting `t` (joined to `c`) to matching rows."""
+    if db.dialect == 'sqlite':
+        return _sqlite_search_clause(search_query, user_id)
+    against = boolean_query(search_query, min_token_size)
+    token = owner_token(user_id)
+    if against is not None and any(token.startswith(word.lower()) for word in _TOKEN_RE.findall(search_query)):
+        against = None
+    if against is None:
+        pattern = f"%{search_query}%"
+        return " AND (t.description LIKE %s OR c.name LIKE %s)", [pattern, pattern]
+
+    # Both matches are resolved as subqueries so each side of the OR can
+    # use its own FULLTEXT index.
+    clause = """
+    AND (
+        t.transaction_id IN (
+            SELECT transaction_id FROM transaction_search
+            WHERE MATCH(document) AGAINST (%s IN BOOLEAN MODE) AND user_id = %s
+        )
+        OR t.category_id IN (
+            SELECT category_id FROM categories
+            WHERE user_id = %s AND MATCH(name) AGAINST (%s IN BOOLEAN MODE)
+        )
+    )
+    """
+    return clause, [f"+{token} {against}", user_id, user_id, against]
@@ -0,0 +1,240 @@
+"""Server-side sessions: the cookie carries only a random session id.
+
+Session data is kept in a store chosen with SESSION_BACKEND:
+
+- 'file' (default): one JSON file per session under SESSION_DIR (by
+  default `sessions` in the app's instance folder), shared by every
+  worker process on the host. The directory must belong to the app's
+  user and be closed to everyone else, or the store refuses to start;
+- 'memory': an in-process LRU of up to SESSION_MAX_ENTRIES sessions, for
+  single-process deployments.
+
+Records expire PERMANENT_SESSION_LIFETIME after their last change and are
+deleted when the session is cleared (logout). Because the data no longer
+travels in the cookie, the session can hold the logged-in user's context:
+the username is stored at login and the category list is cached with a
+version token (see `cached`), so pages need no identity queries.
+"""
+import os
+import re
+import secrets
+import stat
+import tempfile
+import threading
+import time
+
+from flask import session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+import cache
+
+BACKENDS = ('file', 'memory')
+PURGE_EVERY = 1000
+
+_SID_RE = re.compile(r"[A-Za-z0-9_-]{43}")
+
+interface = None
+
+
+def _new_sid():
+    return secrets.token_urlsafe(32)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid or _new_sid()
+        self.new = new
+        self.modified = False
+        self.previous_sid = None
+
+
+class MemoryStore:
+    def __init__(self, max_entries=10000, ttl=31 * 86400.0):
+        self._sessions = cache.LRUCache(max_entries, ttl)
+
+    def get(self, sid):
+        found, data = self._sessions.get(sid)
+        return dict(data) if found else None
+
+    def set(self, sid, data):
+        self._sessions.set(sid, dict(data))
+
+    def delete(self, sid):
+        self._sessions.delete(sid)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class FileStore:
+    # What Flask's cookie sessions use: JSON, plus tuples, dates and markup
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, directory, ttl=31 * 86400.0):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        check_directory(directory)
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _path(self, sid):
+        return os.path.join(self.directory, sid)
+
+    def get(self, sid):
+        path = self._path(sid)
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                self.delete(sid)
+                return None
+            with open(path, encoding='utf-8') as file:
+                data = self.serializer.loads(file.read())
+        except (OSError, ValueError):
+            return None
+        return data if isinstance(data, dict) else None
+
+    def set(self, sid, data):
+        # Written to a temporary file and renamed, so readers never see half a session
+        fd, temporary = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(self.serializer.dumps(dict(data)))
+        os.replace(temporary, self._path(sid))
+        with self._lock:
+            self._writes += 1
+            purge = self._writes % PURGE_EVERY == 0
+        if purge:
+            self.purge()
+
+    def delete(self, sid):
+        try:
+            os.remove(self._path(sid))
+        except FileNotFoundError:
+            pass
+
+    def purge(self):
+        """Delete expired session files; returns how many were removed."""
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def __len__(self):
+        return sum(1 for entry in os.scandir(self.directory) if not entry.name.startswith('.'))
+
+
+def check_directory(directory):
+    """Raise RuntimeError unless `directory` is a real directory owned by this user and closed to others."""
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError(f"Session directory {directory} must be a directory owned by this user "
+                           f"with no access for group or others (chmod 700).")
+
+
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._loads = 0
+        self._misses = 0
+        self._writes = 0
+        self._deletes = 0
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and _SID_RE.fullmatch(sid):
+            data = self.store.get(sid)
+            with self._lock:
+                self._loads += 1
+                self._misses += data is None
+            if data is not None:
+                return ServerSession(data, sid)
+        return ServerSession(new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.previous_sid is not None:
+            self.store.delete(session.previous_sid)
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                with self._lock:
+                    self._deletes += 1
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.modified:
+            self.store.set(session.sid, session)
+            with self._lock:
+                self._writes += 1
+        if session.modified or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name, session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+        response.vary.add('Cookie')
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'backend': type(self.store).__name__,
+                'sessions': len(self.store),
+                'loads': self._loads,
+                'misses': self._misses,
+                'writes': self._writes,
+                'deletes': self._deletes,
+            }
+
+
+def regenerate():
+    """Move the current session to a fresh id (on login), dropping the old record."""
+    if session.previous_sid is None and not session.new:
+        session.previous_sid = session.sid
+    session.sid = _new_sid()
+    session.modified = True
+
+
+def cached(name, version):
+    """A value kept in the session by `remember`, or None if it was stored at another version."""
+    entry = session.get(name)
+    if entry is not None and entry['version'] == version:
+        return entry['value']
+    return None
+
+
+def remember(name, version, value):
+    session[name] = {'version': version, 'value': value}
+    return value
+
+
+def init_app(app):
+    global interface
+    backend = app.config.get('SESSION_BACKEND', 'file')
+    ttl = app.permanent_session_lifetime.total_seconds()
+    if backend == 'file':
+        store = FileStore(app.config.get('SESSION_DIR') or os.path.join(app.instance_path, 'sessions'), ttl)
+    elif backend == 'memory':
+        store = MemoryStore(app.config.get('SESSION_MAX_ENTRIES', 10000), ttl)
+    else:
+        raise ValueError(f"Unknown SESSION_BACKEND '{backend}'; use one of {', '.join(BACKENDS)}.")
+    interface = ServerSessionInterface(store)
+    app.session_interface = interface
+    return interface
@@ -0,0 +1,379 @@
+"""Embedded SQLite backend, selected with DB_BACKEND=sqlite.
+
+The database is one local file opened in WAL mode, so readers don't block
+the writer and every query is an in-process call with no network hop. It
+suits single-node installs and test or benchmark runs.
+
+Connections are wrapped to look like mysql.connector's, so the
+repositories and the rest of the app run the same SQL on both backends:
+
+- `%s` placeholders are rewritten to `?`;
+- `SELECT ... FOR UPDATE` opens a `BEGIN IMMEDIATE` transaction instead,
+  since SQLite locks the database for writing rather than single rows;
+- `cursor(dictionary=True)` returns dict rows;
+- DATE, TIMESTAMP and DECIMAL columns come back as date, datetime and
+  Decimal, and computed REAL values (sums of amounts) as Decimal rounded
+  to cents, as MySQL's DECIMAL(..., 2) arithmetic would return them;
+- NUMERIC columns (exchange rates) come back as unrounded Decimal.
+
+SCHEMA mirrors the MySQL tables and indexes. Partitioning has no SQLite
+equivalent: `transactions_archive` exists so that reads over both tiers
+work, and simply stays empty. Description search uses an FTS5 table kept
+in sync by triggers, like `transaction_search` on MySQL.
+"""
+import re
+import sqlite3
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+
+_FOR_UPDATE_RE = re.compile(r"\s+FOR\s+UPDATE\s*;?\s*$", re.IGNORECASE)
+_CENT = Decimal('0.01')
+
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+# Every DECIMAL column holds cents; stored whole amounts come back as integers
+sqlite3.register_converter('DECIMAL', lambda value: Decimal(value.decode()).quantize(_CENT))
+# NUMERIC columns are exchange rates, read back with every stored digit
+sqlite3.register_converter('NUMERIC', lambda value: Decimal(value.decode()))
+
+# `owner` holds search.owner_token(user_id), which every MATCH requires
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS transaction_search USING fts5(
+    owner, description, user_id UNINDEXED, tokenize = 'unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS trg_transactions_search_insert AFTER INSERT ON transactions BEGIN
+    INSERT INTO transaction_search (rowid, owner, description, user_id)
+    VALUES (NEW.transaction_id, 'owner' || NEW.user_id, NEW.description, NEW.user_id);
+END;
+CREATE TRIGGER IF NOT EXISTS trg_transactions_search_update AFTER UPDATE OF description ON transactions BEGIN
+    UPDATE transaction_search SET description = NEW.description WHERE rowid = NEW.transaction_id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_transactions_search_delete AFTER DELETE ON transactions BEGIN
+    DELETE FROM transaction_search WHERE rowid = OLD.transaction_id;
+END;
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username VARCHAR(250) NOT NULL UNIQUE,
+    password VARCHAR(250) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS categories (
+    category_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(250) NOT NULL,
+    user_id INT REFERENCES users(id),
+    createdBy INT NOT NULL REFERENCES users(id),
+    createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    modifiedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+-- InnoDB indexes foreign key columns implicitly; SQLite doesn't
+CREATE INDEX IF NOT EXISTS idx_categories_user ON categories (user_id);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INT NOT NULL,
+    amount DECIMAL(10,2) NOT NULL,
+    type TEXT NOT NULL CHECK (type IN ('income', 'expense')),
+    category_id INT,
+    description VARCHAR(300) NOT NULL,
+    transaction_date DATE NOT NULL,
+    createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    modifiedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    recurring_id INT
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_user_date_id ON transactions (user_id, transaction_date, transaction_id);
+CREATE INDEX IF NOT EXISTS idx_transactions_user_category_date ON transactions (user_id, category_id, transaction_date);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_transactions_recurring_date ON transactions (recurring_id, transaction_date);
+
+CREATE TABLE IF NOT EXISTS transactions_archive (
+    transaction_id INTEGER PRIMARY KEY,
+    user_id INT NOT NULL,
+    amount DECIMAL(10,2) NOT NULL,
+    type TEXT NOT NULL CHECK (type IN ('income', 'expense')),
+    category_id INT,
+    description VARCHAR(300) NOT NULL,
+    transaction_date DATE NOT NULL,
+    createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    modifiedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    recurring_id INT
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_archive_user_date_id
+    ON transactions_archive (user_id, transaction_date, transaction_id);
+
+""" + SEARCH_SCHEMA + """
+
+CREATE TABLE IF NOT EXISTS budgets (
+    budget_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INT NOT NULL REFERENCES users(id),
+    category_id INT NOT NULL REFERENCES categories(category_id),
+    amount DECIMAL(10, 2) NOT NULL,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    modifiedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_budgets_category ON budgets (category_id);
+
+CREATE TABLE IF NOT EXISTS recurring_transactions (
+    recurring_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INT NOT NULL REFERENCES users(id),
+    amount DECIMAL(10,2) NOT NULL,
+    type TEXT NOT NULL CHECK (type IN ('income', 'expense')),
+    category_id INT REFERENCES categories(category_id),
+    description VARCHAR(300) NOT NULL,
+    frequency TEXT NOT NULL CHECK (frequency IN ('daily', 'weekly', 'monthly', 'yearly')),
+    interval_count INT NOT NULL DEFAULT 1,
+    start_date DATE NOT NULL,
+    end_date DATE,
+    next_occurrence INT NOT NULL DEFAULT 0,
+    next_run_date DATE,
+    createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    modifiedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_recurring_next_run ON recurring_transactions (next_run_date, recurring_id);
+CREATE INDEX IF NOT EXISTS idx_recurring_user ON recurring_transactions (user_id);
+
+CREATE TABLE IF NOT EXISTS user_category_month_summary (
+    user_id INT NOT NULL REFERENCES users(id),
+    category_id INT NOT NULL DEFAULT 0,
+    month DATE NOT NULL,
+    income DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    expenses DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    transaction_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, category_id, month)
+);
+"""
+
+# MySQL's ON UPDATE CURRENT_TIMESTAMP
+_MODIFIED_AT_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS trg_{table}_modified_at AFTER UPDATE ON {table}
+WHEN NEW.modifiedAt IS OLD.modifiedAt BEGIN
+    UPDATE {table} SET modifiedAt = CURRENT_TIMESTAMP WHERE {key} = NEW.{key};
+END;
+"""
+_MODIFIED_AT_TABLES = {
+    'categories': 'category_id',
+    'transactions': 'transaction_id',
+    'budgets': 'budget_id',
+    'recurring_transactions': 'recurring_id',
+}
+
+
+def create_schema(cursor):
+    """Create every table, index and trigger that doesn't exist yet."""
+    script = SCHEMA + ''.join(_MODIFIED_AT_TRIGGER.format(table=table, key=key)
+                              for table, key in _MODIFIED_AT_TABLES.items())
+    cursor.executescript(script)
+    print("✅ SQLite schema ensured to exist.")
+
+
+def rebuild_search(cursor):
+    """Recreate an FTS5 table from before the `owner` column, refilled from `transactions`."""
+    cursor.execute("SELECT 1 FROM pragma_table_info('transaction_search') WHERE name = 'owner'")
+    if cursor.fetchone() is not None:
+        return
+    for trigger in ('insert', 'update', 'delete'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_transactions_search_{trigger}")
+    cursor.execute("DROP TABLE IF EXISTS transaction_search")
+    cursor.executescript(SEARCH_SCHEMA)
+    cursor.execute("""
+    INSERT INTO transaction_search (rowid, owner, description, user_id)
+    SELECT transaction_id, 'owner' || user_id, description, user_id FROM transactions
+    """)
+    print(f"✅ Search index rebuilt ({cursor.rowcount} descriptions indexed).")
+
+
+def _value(value):
+    if isinstance(value, float):
+        return Decimal(repr(value)).quantize(_CENT)
+    return value
+
+
+class Cursor:
+    def __init__(self, connection, dictionary=False):
+        self._connection = connection
+        self._cursor = connection.sqlite.cursor()
+        self._dictionary = dictionary
+
+    def execute(self, operation, params=None):
+        operation, locking = _FOR_UPDATE_RE.subn('', operation.replace('%s', '?'))
+        if locking and not self._connection.in_transaction:
+            self._cursor.execute('BEGIN IMMEDIATE')
+        self._cursor.execute(operation, tuple(params) if params else ())
+
+    def executemany(self, operation, seq_params):
+        self._cursor.executemany(operation.replace('%s', '?'), [tuple(params) for params in seq_params])
+
+    def executescript(self, script):
+        self._cursor.executescript(script)
+
+    def _row(self, row):
+        values = [_value(value) for value in row]
+        if self._dictionary:
+            return dict(zip(self.column_names, values))
+        return tuple(values)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return None if row is None else self._row(row)
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        return (self._row(row) for row in self._cursor)
+
+    @property
+    def column_names(self):
+        return tuple(column[0] for column in self._cursor.description or ())
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def with_rows(self):
+        return self._cursor.description is not None
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+
+class Connection:
+    def __init__(self, connection):
+        self.sqlite = connection
+
+    def cursor(self, dictionary=False, buffered=True):
+        # Results are read from the local file on demand, so buffered and
+        # unbuffered cursors behave the same
+        return Cursor(self, dictionary)
+
+    @property
+    def in_transaction(self):
+        return self.sqlite.in_transaction
+
+    def commit(self):
+        self.sqlite.commit()
+
+    def rollback(self):
+        self.sqlite.rollback()
+
+    def close(self):
+        self.sqlite.close()
+
+
+class SQLitePool:
+    """Reusable connections to one SQLite file, with the same interface as db.ConnectionPool.
+
+    Opening a connection is cheap, so checkouts never wait: up to `size`
+    connections are kept between requests and any extra are closed on
+    release. Concurrent writers wait up to `timeout` seconds for the lock.
+    """
+
+    def __init__(self, path, size=5, timeout=10.0):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.wrapper = None
+
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._checked_out = 0
+        self._acquires = 0
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=self.timeout, detect_types=sqlite3.PARSE_DECLTYPES,
+                                     check_same_thread=False)
+        connection.execute('PRAGMA journal_mode = WAL')
+        # Durable at every checkpoint rather than every commit, which is safe in WAL mode
+        connection.execute('PRAGMA synchronous = NORMAL')
+        connection.execute('PRAGMA foreign_keys = ON')
+        return Connection(connection)
+
+    def acquire(self):
+        with self._lock:
+            connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                self._opened += 1
+            self._checked_out += 1
+            self._acquires += 1
+        if connection is None:
+            try:
+                connection = self._connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                    self._checked_out -= 1
+                raise
+        return self.wrapper(connection) if self.wrapper else connection
+
+    def release(self, connection):
+        connection = getattr(connection, 'raw', connection)
+        keep = True
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+        except sqlite3.Error:
+            keep = False
+
+        with self._lock:
+            self._checked_out -= 1
+            if keep and len(self._idle) < self.size:
+                self._idle.append(connection)
+            else:
+                self._opened -= 1
+                keep = False
+        if not keep:
+            connection.close()
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+            self._opened -= len(idle)
+        for connection in idle:
+            connection.close()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'max_overflow': None,
+                'timeout': self.timeout,
+                'open': self._opened,
+                'idle': len(self._idle),
+                'checked_out': self._checked_out,
+                'overflow_in_use': max(0, self._opened - self.size),
+                'acquires': self._acquires,
+                'timeouts': 0,
+                'health_check_failures': 0,
+                'avg_wait_ms': 0.0,
+                'max_wait_ms': 0.0,
+            }
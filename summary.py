@@ -0,0 +1,248 @@
+"""Per-user, per-category, per-month rollup of transactions.
+
+The rollup is kept in step with `transactions` by the write routes, which
+apply the delta between the old and new row inside the same database
+transaction. `rebuild` and `verify` recompute it from scratch, from both
+the hot and the archive tier of transactions.
+"""
+from datetime import date
+from decimal import Decimal
+
+import db
+import fx
+import partitions
+
+# category_id 0 stands in for "no category" so it can be part of the primary key
+UNCATEGORIZED = 0
+
+CREATE_SUMMARY_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS user_category_month_summary (
+    user_id INT NOT NULL,
+    category_id INT NOT NULL DEFAULT 0,
+    month DATE NOT NULL,
+    income DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    expenses DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    transaction_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, category_id, month),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+"""
+
+_MONTH_EXPRESSIONS = {
+    'mysql': "DATE_SUB(transaction_date, INTERVAL DAYOFMONTH(transaction_date) - 1 DAY)",
+    'sqlite': "date(transaction_date, 'start of month')",
+}
+
+_AGGREGATE_SELECT = """
+SELECT
+    user_id,
+    COALESCE(category_id, 0) AS category_id,
+    {month} AS month,
+    SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END) AS income,
+    SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END) AS expenses,
+    COUNT(*) AS transaction_count
+FROM ({source}) t
+GROUP BY user_id, COALESCE(category_id, 0), month
+"""
+
+
+def _aggregate(where, params):
+    source = "SELECT user_id, category_id, transaction_date, type, amount FROM {table} " + where
+    source, params = partitions.all_tiers(source, params)
+    return _AGGREGATE_SELECT.format(source=source, month=_MONTH_EXPRESSIONS[db.dialect]), params
+
+
+def _month(value):
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    return value.replace(day=1)
+
+
+def _accumulate(deltas, user_id, row, sign):
+    amount = Decimal(str(row['amount'])) * sign
+    key = (user_id, row['category_id'] or UNCATEGORIZED, _month(row['transaction_date']))
+    income, expenses, count = deltas.get(key, (Decimal('0'), Decimal('0'), 0))
+    if row['type'] == 'income':
+        income += amount
+    else:
+        expenses += amount
+    deltas[key] = (income, expenses, count + sign)
+
+
+_UPSERT_QUERIES = {
+    'mysql': """
+    INSERT INTO user_category_month_summary
+        (user_id, category_id, month, income, expenses, transaction_count)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        income = income + VALUES(income),
+        expenses = expenses + VALUES(expenses),
+        transaction_count = transaction_count + VALUES(transaction_count)
+    """,
+    'sqlite': """
+    INSERT INTO user_category_month_summary
+        (user_id, category_id, month, income, expenses, transaction_count)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON CONFLICT (user_id, category_id, month) DO UPDATE SET
+        income = income + excluded.income,
+        expenses = expenses + excluded.expenses,
+        transaction_count = transaction_count + excluded.transaction_count
+    """,
+}
+
+
+def _upsert(cursor, deltas):
+    if not deltas:
+        return
+    cursor.executemany(_UPSERT_QUERIES[db.dialect], [key + values for key, values in deltas.items()])
+
+    shrunk = [key for key, (_, _, count) in deltas.items() if count < 0]
+    if shrunk:
+        query = """
+        DELETE FROM user_category_month_summary
+        WHERE user_id = %s AND category_id = %s AND month = %s AND transaction_count <= 0
+        """
+        cursor.executemany(query, shrunk)
+
+
+def record_change(cursor, user_id, old=None, new=None):
+    """Apply the difference between `old` and `new` transaction rows.
+
+    Either side may be None (insert or delete). Rows need `amount`, `type`,
+    `category_id` and `transaction_date`. The caller owns the commit.
+    """
+    deltas = {}
+    if old is not None:
+        _accumulate(deltas, user_id, old, -1)
+    if new is not None:
+        _accumulate(deltas, user_id, new, 1)
+    _upsert(cursor, deltas)
+
+
+def record_many(cursor, user_id, rows, sign=1):
+    """Add (sign=1) or remove (sign=-1) a batch of rows with one delta per key."""
+    deltas = {}
+    for row in rows:
+        _accumulate(deltas, user_id, row, sign)
+    _upsert(cursor, deltas)
+
+
+def record_changes(cursor, user_id, old_rows=(), new_rows=()):
+    """As record_change for many rows at once, folded into one delta per key."""
+    deltas = {}
+    for row in old_rows:
+        _accumulate(deltas, user_id, row, -1)
+    for row in new_rows:
+        _accumulate(deltas, user_id, row, 1)
+    _upsert(cursor, deltas)
+
+
+def record_rows(cursor, rows, sign=1):
+    """As record_many, for rows spanning several users (each row carries `user_id`)."""
+    deltas = {}
+    for row in rows:
+        _accumulate(deltas, row['user_id'], row, sign)
+    _upsert(cursor, deltas)
+
+
+READ_TOTALS_QUERY = """
+SELECT
+    s.category_id,
+    c.name AS category_name,
+    SUM(s.income) AS income,
+    SUM(s.expenses) AS expenses
+FROM user_category_month_summary s
+LEFT JOIN categories c ON s.category_id = c.category_id
+WHERE s.user_id = %s
+GROUP BY s.category_id, c.name
+"""
+
+
+# The rollup adds amounts up whatever their currency. Rows in other
+# currencies than the one reported are read back per day so fx.convert_totals
+# can swap them for their converted amounts; idx_transactions_user_currency
+# keeps this to the foreign rows.
+FOREIGN_TOTALS_QUERY = """
+SELECT COALESCE(category_id, 0) AS category_id, currency, transaction_date, type, SUM(amount) AS amount
+FROM ({source}) t
+GROUP BY COALESCE(category_id, 0), currency, transaction_date, type
+"""
+
+
+def foreign_totals_query(user_id, currency):
+    """FOREIGN_TOTALS_QUERY and its params, over every tier."""
+    source, params = partitions.all_tiers(
+        "SELECT category_id, currency, transaction_date, type, amount FROM {table} "
+        "WHERE user_id = %s AND currency <> %s", (user_id, currency))
+    return FOREIGN_TOTALS_QUERY.format(source=source), params
+
+
+def read_totals(cursor, user_id, currency=None):
+    """Return (total_income, total_expenses, spent_per_category) from the rollup.
+
+    With `currency`, amounts in other currencies are converted to it (which
+    raises fx.MissingRate when there are no rates for them).
+    """
+    cursor.execute(READ_TOTALS_QUERY, (user_id,))
+    rows = cursor.fetchall()
+    if currency is not None:
+        cursor.execute(*foreign_totals_query(user_id, currency))
+        rows = fx.convert_totals(rows, cursor.fetchall(), currency)
+    return fold_totals(rows)
+
+
+def fold_totals(rows):
+    """Reduce READ_TOTALS_QUERY dict rows to (total_income, total_expenses, spent_per_category)."""
+    total_income = Decimal('0')
+    total_expenses = Decimal('0')
+    spent_per_category = {}
+    for row in rows:
+        income = row['income'] or Decimal('0')
+        expenses = row['expenses'] or Decimal('0')
+        total_income += income
+        total_expenses += expenses
+        if row['category_name'] and expenses:
+            # Several rows can share a name (same-named categories)
+            name = row['category_name']
+            spent_per_category[name] = spent_per_category.get(name, Decimal('0')) + expenses
+    return total_income, total_expenses, spent_per_category
+
+
+def rebuild(cursor, user_id=None):
+    """Recompute the rollup from `transactions`, for one user or everyone."""
+    if user_id is None:
+        cursor.execute("DELETE FROM user_category_month_summary")
+        where, params = "", ()
+    else:
+        cursor.execute("DELETE FROM user_category_month_summary WHERE user_id = %s", (user_id,))
+        where, params = "WHERE user_id = %s", (user_id,)
+    aggregate, params = _aggregate(where, params)
+    query = ("INSERT INTO user_category_month_summary "
+             "(user_id, category_id, month, income, expenses, transaction_count) " + aggregate)
+    cursor.execute(query, params)
+    return cursor.rowcount
+
+
+def verify(cursor, user_id=None):
+    """Compare the rollup against a fresh aggregate and return the drifted keys.
+
+    Each entry is (key, expected, actual), where key is
+    (user_id, category_id, month) and the values are
+    (income, expenses, transaction_count) tuples or None when missing.
+    """
+    where, params = ("", ()) if user_id is None else ("WHERE user_id = %s", (user_id,))
+
+    cursor.execute(*_aggregate(where, params))
+    # SQLite returns the computed month as text
+    expected = {(r[0], r[1], _month(r[2])): (r[3], r[4], r[5]) for r in cursor.fetchall()}
+
+    cursor.execute(
+        "SELECT user_id, category_id, month, income, expenses, transaction_count "
+        "FROM user_category_month_summary " + where, params)
+    actual = {(r[0], r[1], r[2]): (r[3], r[4], r[5]) for r in cursor.fetchall()}
+
+    drift = []
+    for key in sorted(expected.keys() | actual.keys()):
+        if expected.get(key) != actual.get(key):
+            drift.append((key, expected.get(key), actual.get(key)))
+    return drift
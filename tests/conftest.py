@@ -0,0 +1,86 @@
+"""Run the app on the SQLite backend against a throwaway database.
+
+The environment is set before `app` is first imported, since the app
+reads its configuration at import time.
+"""
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+_SCRATCH = tempfile.mkdtemp(prefix='finance_tests_')
+os.environ.update(
+    DB_BACKEND='sqlite',
+    SQLITE_PATH=os.path.join(_SCRATCH, 'finance.sqlite3'),
+    SESSION_DIR=os.path.join(_SCRATCH, 'sessions'),
+    INGEST_MODE='direct',
+    INGEST_JOURNAL=os.path.join(_SCRATCH, 'journal.sqlite3'),
+    RECURRING_INTERVAL='0',
+    BCRYPT_LOG_ROUNDS='4',
+)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as finance_app  # noqa: E402
+import cache  # noqa: E402
+import db  # noqa: E402
+import migrations  # noqa: E402
+
+_usernames = itertools.count(1)
+
+
+@pytest.fixture(scope='session')
+def app():
+    with db.pool.connection() as connection:
+        migrations.upgrade(connection, finance_app.app.config)
+    return finance_app.app
+
+
+@pytest.fixture
+def connection(app):
+    with db.pool.connection() as connection:
+        yield connection
+
+
+@pytest.fixture
+def user_id(connection):
+    """A new user with no transactions."""
+    cursor = connection.cursor()
+    cursor.execute("INSERT INTO users (username, password) VALUES (%s, %s)", (f"user{next(_usernames)}", 'x'))
+    connection.commit()
+    user_id = cursor.lastrowid
+    cursor.close()
+    return user_id
+
+
+@pytest.fixture
+def add_category(connection, user_id):
+    def add(name):
+        cursor = connection.cursor()
+        cursor.execute("INSERT INTO categories (name, user_id, createdBy) VALUES (%s, %s, %s)",
+                       (name, user_id, user_id))
+        connection.commit()
+        category_id = cursor.lastrowid
+        cursor.close()
+        return category_id
+    return add
+
+
+@pytest.fixture
+def client(app, user_id):
+    """A test client logged in as `user_id`."""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+        session['username'] = f"user{user_id}"
+    return client
+
+
+@pytest.fixture
+def coherent_cache(monkeypatch):
+    """A per-process cache declared coherent, as with CACHE_SINGLE_PROCESS=1."""
+    user_cache = cache.UserCache(cache.LRUCache(), coherent=True)
+    monkeypatch.setattr(cache, 'user_cache', user_cache)
+    return user_cache
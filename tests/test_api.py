@@ -0,0 +1,45 @@
+import gzip
+import json
+
+
+def _etag(response):
+    return response.headers['ETag'].strip('"')
+
+
+def test_unchanged_data_revalidates_with_304(client, coherent_cache):
+    first = client.get('/api/totals')
+    assert first.status_code == 200 and first.headers['Cache-Control'] == 'private, no-cache'
+    again = client.get('/api/totals', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304 and again.data == b''
+    # Another query string is another representation
+    assert client.get('/api/totals?x=1', headers={'If-None-Match': first.headers['ETag']}).status_code == 200
+
+
+def test_a_write_changes_the_etag(client, coherent_cache):
+    etag = client.get('/api/categories').headers['ETag']
+    client.post('/add_category', data={'category_name': 'Food'})
+    response = client.get('/api/categories', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+    assert [category['name'] for category in response.json['categories']] == ['Food']
+
+
+def test_no_etags_without_a_coherent_cache(client):
+    response = client.get('/api/totals')
+    assert response.status_code == 200 and 'ETag' not in response.headers
+
+
+def test_large_responses_are_gzipped_with_their_own_etag(client, coherent_cache):
+    for number in range(40):
+        client.post('/add_category', data={'category_name': f"Category number {number}"})
+    plain = client.get('/api/categories')
+    response = client.get('/api/categories', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip' and 'Accept-Encoding' in response.headers['Vary']
+    assert json.loads(gzip.decompress(response.data)) == plain.json
+    assert _etag(response) == _etag(plain) + '-gz'
+    # Either form revalidates
+    assert client.get('/api/categories', headers={'If-None-Match': response.headers['ETag'],
+                                                  'Accept-Encoding': 'gzip'}).status_code == 304
+
+
+def test_api_needs_a_login(app):
+    assert app.test_client().get('/api/totals').status_code == 401
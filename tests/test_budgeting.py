@@ -0,0 +1,69 @@
+import io
+from datetime import date
+from decimal import Decimal
+
+import budgeting
+import fx
+
+
+def _budget(cursor, user_id, category_id, amount, start_date, end_date, currency='ZAR'):
+    cursor.execute("INSERT INTO budgets (user_id, category_id, amount, start_date, end_date, currency) "
+                   "VALUES (%s, %s, %s, %s, %s, %s)", (user_id, category_id, amount, start_date, end_date, currency))
+
+
+def _spend(cursor, user_id, category_id, amount, transaction_date, transaction_type='expense', currency='ZAR'):
+    cursor.execute("INSERT INTO transactions (user_id, amount, type, category_id, description, transaction_date, "
+                   "currency) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                   (user_id, amount, transaction_type, category_id, 'row', transaction_date, currency))
+
+
+def _load(connection, user_id):
+    cursor = connection.cursor(dictionary=True, buffered=True)
+    rows = budgeting.load(cursor, user_id)
+    cursor.close()
+    return {(row['category_name'], row['start_date'].month): row for row in rows}
+
+
+def test_spend_counts_only_each_budgets_own_window(connection, user_id, add_category):
+    food, rent = add_category('Food'), add_category('Rent')
+    cursor = connection.cursor()
+    _budget(cursor, user_id, food, '100', date(2024, 1, 1), date(2024, 1, 31))
+    _budget(cursor, user_id, food, '100', date(2024, 2, 1), date(2024, 2, 29))
+    _budget(cursor, user_id, rent, '500', date(2024, 1, 1), date(2024, 1, 31))
+    _spend(cursor, user_id, food, '30', date(2024, 1, 31))
+    _spend(cursor, user_id, food, '45', date(2024, 2, 1))
+    _spend(cursor, user_id, food, '1000', date(2024, 2, 2), 'income')
+    _spend(cursor, user_id, food, '9', date(2023, 12, 31))
+    connection.commit()
+    cursor.close()
+
+    budgets = _load(connection, user_id)
+    assert {key: row['spent'] for key, row in budgets.items()} == {
+        ('Food', 1): Decimal('30.00'), ('Food', 2): Decimal('45.00'), ('Rent', 1): Decimal('0')}
+
+
+def test_foreign_spend_is_converted_to_the_budget_currency(connection, user_id, add_category):
+    fx.import_rates(connection, io.StringIO("date,currency,rate\n2024-01-01,GBP,0.8547\n2024-01-01,ZAR,20.4567\n"),
+                    fx.rates.base)
+    fx.rates.reload()
+    food = add_category('Food')
+    cursor = connection.cursor()
+    _budget(cursor, user_id, food, '5000', date(2024, 1, 1), date(2024, 1, 31))
+    _spend(cursor, user_id, food, '10', date(2024, 1, 5))
+    _spend(cursor, user_id, food, '100', date(2024, 1, 6), currency='GBP')
+    connection.commit()
+    cursor.close()
+    assert _load(connection, user_id)[('Food', 1)]['spent'] == Decimal('10.00') + Decimal('2393.44')
+
+
+def test_progress_projects_the_burn_rate():
+    row = {'amount': Decimal('310'), 'spent': Decimal('100'), 'start_date': date(2024, 1, 1),
+           'end_date': date(2024, 1, 31)}
+    [early] = budgeting.progress([row], today=date(2024, 1, 5))
+    assert (early['elapsed_days'], early['burn_rate'], early['projected_spend']) == (5, Decimal('20.00'),
+                                                                                   Decimal('620.00'))
+    assert (early['status'], early['projected_overspend'], early['remaining']) == ('at_risk', Decimal('310.00'),
+                                                                                  Decimal('210'))
+    assert budgeting.progress([row], today=date(2024, 1, 31))[0]['status'] == 'on_track'
+    assert budgeting.progress([row], today=date(2023, 12, 1))[0]['status'] == 'upcoming'
+    assert budgeting.progress([dict(row, spent=Decimal('311'))], today=date(2024, 1, 5))[0]['status'] == 'over'
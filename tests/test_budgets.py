@@ -0,0 +1,61 @@
+import io
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+import fx
+
+
+@pytest.fixture
+def budget(client, connection, user_id, add_category):
+    category_id = add_category('Food')
+    client.post('/set_budget', data={'category_id': category_id, 'budget_amount': '300',
+                                     'budget_start_date': '2024-01-01'})
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute("SELECT * FROM budgets WHERE user_id = %s", (user_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    assert row['end_date'] == date(2024, 1, 31)
+    return row
+
+
+def _stored(connection, budget_id):
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute("SELECT amount, start_date, end_date, currency FROM budgets WHERE budget_id = %s", (budget_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    return row
+
+
+def test_update_budget_stores_dates(client, connection, budget):
+    client.post(f"/update_budget/{budget['budget_id']}",
+                data={'amount': '250', 'start_date': '2024-02-01', 'end_date': '2024-02-29'})
+    row = _stored(connection, budget['budget_id'])
+    assert (row['amount'], row['start_date'], row['end_date']) == (Decimal('250.00'), date(2024, 2, 1),
+                                                                   date(2024, 2, 29))
+
+
+@pytest.mark.parametrize('start_date, end_date', [('01/02/2024', '2024-02-29'), ('2024-02-30', '2024-03-01'),
+                                                  ('2024-03-01', '2024-02-01')])
+def test_update_budget_rejects_bad_dates(client, connection, budget, start_date, end_date):
+    response = client.post(f"/update_budget/{budget['budget_id']}",
+                           data={'amount': '250', 'start_date': start_date, 'end_date': end_date})
+    assert response.status_code == 302
+    assert _stored(connection, budget['budget_id'])['start_date'] == date(2024, 1, 1)
+    assert client.get('/dashboard').status_code == 200
+
+
+def test_update_budget_changes_the_currency(client, connection, budget):
+    rates = "date,currency,rate\n2024-01-01,GBP,0.8547\n2024-01-01,ZAR,20.4567\n"
+    fx.import_rates(connection, io.StringIO(rates), fx.rates.base)
+    fx.rates.reload()
+    data = {'amount': '250', 'start_date': '2024-01-01', 'end_date': '2024-01-31'}
+    client.post(f"/update_budget/{budget['budget_id']}", data=dict(data, currency='gbp'))
+    assert _stored(connection, budget['budget_id'])['currency'] == 'GBP'
+
+    # Unknown codes and currencies without rates leave the budget as it was
+    for currency in ('POUNDS', 'XYZ'):
+        client.post(f"/update_budget/{budget['budget_id']}", data=dict(data, amount='1', currency=currency))
+        assert _stored(connection, budget['budget_id'])['amount'] == Decimal('250.00')
+    assert client.get('/dashboard').status_code == 200
@@ -0,0 +1,80 @@
+from datetime import date
+
+import pytest
+
+import summary
+
+
+@pytest.fixture
+def ids(connection, user_id, add_category):
+    add_category('Food')
+    cursor = connection.cursor()
+    inserted = []
+    for day, description in ((1, 'Coffee'), (2, 'Coffee'), (3, 'Rent')):
+        cursor.execute("INSERT INTO transactions (user_id, amount, type, description, transaction_date) "
+                       "VALUES (%s, %s, %s, %s, %s)", (user_id, '4.00', 'expense', description, date(2024, 1, day)))
+        inserted.append(cursor.lastrowid)
+    summary.rebuild(cursor, user_id)
+    connection.commit()
+    cursor.close()
+    return inserted
+
+
+def _rows(connection, user_id):
+    cursor = connection.cursor(dictionary=True, buffered=True)
+    cursor.execute("SELECT transaction_id, category_id, transaction_date FROM transactions WHERE user_id = %s "
+                   "ORDER BY transaction_id", (user_id,))
+    rows = cursor.fetchall()
+    cursor.close()
+    cursor = connection.cursor(buffered=True)
+    assert summary.verify(cursor, user_id) == []
+    cursor.close()
+    return rows
+
+
+def _category(connection, user_id):
+    cursor = connection.cursor()
+    cursor.execute("SELECT category_id FROM categories WHERE user_id = %s", (user_id,))
+    category_id = cursor.fetchone()[0]
+    cursor.close()
+    return category_id
+
+
+def test_categorize_by_ids_reports_each_id(client, connection, user_id, ids):
+    food = _category(connection, user_id)
+    response = client.post('/api/transactions/bulk', json={'action': 'categorize', 'ids': [ids[0], 999999],
+                                                            'category_id': food})
+    assert response.status_code == 200
+    assert response.json['results'] == [{'transaction_id': ids[0], 'status': 'updated'},
+                                        {'transaction_id': 999999, 'status': 'not_found'}]
+    # Already in the category: nothing to change
+    response = client.post('/api/transactions/bulk', json={'action': 'categorize', 'ids': [ids[0]],
+                                                            'category_id': food})
+    assert response.json['unchanged'] == 1
+    assert [row['category_id'] for row in _rows(connection, user_id)] == [food, None, None]
+
+
+def test_redate_and_delete_by_filter(client, connection, user_id, ids):
+    response = client.post('/api/transactions/bulk', json={'action': 'redate', 'filter': {'q': 'coffee'},
+                                                            'transaction_date': '2024-02-01'})
+    assert response.json['updated'] == 2
+    assert [row['transaction_date'] for row in _rows(connection, user_id)] == [date(2024, 2, 1)] * 2 + [
+        date(2024, 1, 3)]
+
+    response = client.post('/api/transactions/bulk', json={'action': 'delete', 'filter': {'end': '2024-01-31'}})
+    assert response.json['deleted'] == 1
+    assert [row['transaction_id'] for row in _rows(connection, user_id)] == ids[:2]
+
+
+@pytest.mark.parametrize('payload', [
+    {'action': 'delete'},
+    {'action': 'delete', 'ids': [1], 'filter': {'q': 'x'}},
+    {'action': 'delete', 'ids': [True]},
+    {'action': 'redate', 'ids': [1], 'transaction_date': '2024-02-30'},
+    {'action': 'categorize', 'ids': [1]},
+    {'action': 'categorize', 'ids': [1], 'category_id': 999999},
+    {'action': 'delete', 'filter': {'owner': 1}},
+])
+def test_invalid_operations_change_nothing(client, connection, user_id, ids, payload):
+    assert client.post('/api/transactions/bulk', json=payload).status_code == 400
+    assert [row['transaction_id'] for row in _rows(connection, user_id)] == ids
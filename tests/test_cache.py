@@ -0,0 +1,55 @@
+import cache
+
+
+def _loader(values):
+    calls = []
+
+    def load():
+        calls.append(None)
+        return values[len(calls) - 1]
+    return load, calls
+
+
+def test_loads_are_cached_until_invalidated():
+    user_cache = cache.UserCache(cache.LRUCache(), coherent=True)
+    load, calls = _loader(['first', 'second'])
+    assert user_cache.get_or_load(1, 'categories', load) == 'first'
+    assert user_cache.get_or_load(1, 'categories', load) == 'first'
+    user_cache.invalidate(1, 'categories')
+    assert user_cache.get_or_load(1, 'categories', load) == 'second'
+    assert len(calls) == 2
+
+
+def test_a_load_racing_an_invalidation_is_not_stored():
+    user_cache = cache.UserCache(cache.LRUCache(), coherent=True)
+
+    def stale():
+        # A write lands while the old value is being read
+        user_cache.invalidate(1, 'budgets')
+        return 'stale'
+    assert user_cache.get_or_load(1, 'budgets', stale) == 'stale'
+    assert user_cache.get_or_load(1, 'budgets', lambda: 'fresh') == 'fresh'
+
+
+def test_nothing_is_cached_without_coherence():
+    user_cache = cache.UserCache(cache.LRUCache(), coherent=False)
+    load, calls = _loader(['first', 'second'])
+    user_cache.get_or_load(1, 'categories', load)
+    assert user_cache.get_or_load(1, 'categories', load) == 'second'
+    assert user_cache.version(1, 'data') != user_cache.version(1, 'data')
+
+
+def test_lru_evicts_the_least_recently_used():
+    entries = cache.LRUCache(max_entries=2)
+    entries.set('a', 1)
+    entries.set('b', 2)
+    entries.get('a')
+    entries.set('c', 3)
+    assert [entries.get(key)[0] for key in 'abc'] == [True, False, True]
+
+
+def test_writes_invalidate_cached_categories(client, coherent_cache):
+    assert client.get('/api/categories').json['categories'] == []
+    client.post('/add_category', data={'category_name': 'Food'})
+    assert [category['name'] for category in client.get('/api/categories').json['categories']] == ['Food']
+    assert coherent_cache.metrics()['by_name']['categories']['invalidations'] == 1
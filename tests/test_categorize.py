@@ -0,0 +1,148 @@
+import random
+import re
+from decimal import Decimal
+
+import pytest
+
+from categorize import AmountIndex, Automaton, Matcher, RuleError, parse, required_literal
+
+
+def test_automaton_finds_overlapping_patterns():
+    automaton = Automaton([('he', 0), ('she', 1), ('his', 2), ('hers', 3)])
+    assert sorted(automaton.ranks('ushers')) == [0, 1, 3]
+    assert list(automaton.ranks('this')) == [2]
+    assert list(automaton.ranks('xyz')) == []
+
+
+def test_automaton_is_case_insensitive():
+    automaton = Automaton([('Uber', 0), ('ıstanbul', 1)])
+    assert list(automaton.ranks('UBER TRIP')) == [0]
+    assert list(automaton.ranks('Flight ISTANBUL')) == [1]
+
+
+def test_automaton_reports_each_occurrence():
+    assert list(Automaton([('aa', 0)]).ranks('aaaa')) == [0, 0, 0]
+
+
+@pytest.mark.parametrize('pattern, literal', [
+    (r'uber\s*eats', 'uber'),
+    (r'^netflix\.com', 'netflix.com'),
+    (r'colou?r chart', 'r chart'),
+    (r'spar\b', 'spar'),
+    (r'\$\d+ fee', ' fee'),
+    (r'coffee|tea', None),
+    (r'ab', None),
+    (r'x{2}abcdef', None),
+    (r'(uber) eats', None),
+    (r'[abc]+ store', None),
+])
+def test_required_literal(pattern, literal):
+    assert required_literal(pattern) == literal
+
+
+@pytest.mark.parametrize('pattern', [r'uber\s*eats', r'^netflix\.com', r'colou?r chart', r'\$\d+ fee'])
+def test_required_literal_is_in_every_match(pattern):
+    literal = required_literal(pattern)
+    for text in ('UBER   EATS order', 'netflix.com/bill', 'color chart', 'colour chart', '$25 fee'):
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            assert literal.casefold() in match.group(0).casefold()
+
+
+def _first_in_range(rules, amount, transaction_type):
+    for rank, low, high, rule_type in sorted(rules):
+        if ((rule_type is None or rule_type == transaction_type)
+                and (low is None or amount >= low) and (high is None or amount <= high)):
+            return rank
+    return None
+
+
+def test_amount_index_matches_a_linear_scan():
+    rng = random.Random(7)
+    bounds = [None] + [Decimal(value) for value in range(0, 200, 5)]
+    rules = []
+    for rank in range(60):
+        low, high = rng.choice(bounds), rng.choice(bounds)
+        if low is not None and high is not None and low > high:
+            low, high = high, low
+        rules.append((rank, low, high, rng.choice((None, 'income', 'expense'))))
+    rng.shuffle(rules)
+    index = AmountIndex(rules)
+    for amount in [Decimal(value) / 4 for value in range(-4, 900)]:
+        for transaction_type in ('income', 'expense'):
+            assert index.first(amount, transaction_type) == _first_in_range(rules, amount, transaction_type)
+
+
+def test_amount_index_bounds_are_inclusive():
+    index = AmountIndex([(0, Decimal('10'), Decimal('20'), None)])
+    assert index.first(Decimal('10'), 'expense') == 0
+    assert index.first(Decimal('20'), 'expense') == 0
+    assert index.first(Decimal('20.01'), 'expense') is None
+    assert AmountIndex([]).first(Decimal('1'), 'income') is None
+
+
+def _rule(rule_id, kind, pattern=None, min_amount=None, max_amount=None, transaction_type=None, priority=0):
+    return {'rule_id': rule_id, 'category_id': 100 + rule_id, 'kind': kind, 'pattern': pattern,
+            'min_amount': min_amount, 'max_amount': max_amount, 'type': transaction_type, 'priority': priority}
+
+
+def _first_matching(rules, description, amount, transaction_type):
+    """What Matcher.match should return: the first rule, in order, that matches on its own."""
+    amount = Decimal(str(amount))
+    for rule in sorted(rules, key=lambda rule: (rule['priority'], rule['rule_id'])):
+        if rule['type'] is not None and rule['type'] != transaction_type:
+            continue
+        if rule['min_amount'] is not None and amount < rule['min_amount']:
+            continue
+        if rule['max_amount'] is not None and amount > rule['max_amount']:
+            continue
+        if rule['kind'] == 'substring' and rule['pattern'].casefold() not in description.casefold():
+            continue
+        if rule['kind'] == 'regex' and not re.search(rule['pattern'], description, re.IGNORECASE):
+            continue
+        return rule['category_id']
+    return None
+
+
+def test_matcher_agrees_with_trying_rules_in_order():
+    rng = random.Random(11)
+    words = ['uber', 'eats', 'spar', 'coffee', 'netflix', 'rent', 'salary', 'fuel', 'shell', 'woolworths']
+    regexes = [r'uber\s*eats', r'^netflix', r'coffee|tea', r'sh(e|o)ll', r'rent\b', r'\d{4}', r'fuel.*shell']
+    rules = []
+    for rule_id in range(1, 80):
+        kind = rng.choice(('substring', 'regex', 'amount'))
+        low = rng.choice((None, Decimal(rng.randint(0, 100))))
+        high = rng.choice((None, Decimal(rng.randint(100, 300))))
+        if kind == 'amount' and low is None and high is None:
+            high = Decimal(50)
+        pattern = {'substring': rng.choice(words)[:rng.randint(3, 6)], 'regex': rng.choice(regexes),
+                   'amount': None}[kind]
+        rules.append(_rule(rule_id, kind, pattern, low, high, rng.choice((None, 'income', 'expense')),
+                           rng.randint(0, 5)))
+    matcher = Matcher(rules)
+    assert len(matcher) == len(rules)
+    for _ in range(2000):
+        description = ' '.join(rng.choice(words + ['1234', 'Tea', 'UBER  EATS']) for _ in range(rng.randint(1, 4)))
+        amount = Decimal(rng.randint(0, 40000)) / 100
+        transaction_type = rng.choice(('income', 'expense'))
+        assert matcher.match(description, amount, transaction_type) == _first_matching(
+            rules, description, amount, transaction_type), (description, amount, transaction_type)
+
+
+def test_matcher_respects_priority_over_rule_id():
+    rules = [_rule(1, 'substring', 'coffee', priority=5), _rule(2, 'regex', r'coff?ee', priority=1)]
+    assert Matcher(rules).match('Coffee shop', 10, 'expense') == 102
+
+
+def test_matcher_apply_fills_only_uncategorized_rows():
+    matcher = Matcher([_rule(1, 'amount', max_amount=Decimal('10'))])
+    rows = [{'category_id': None, 'description': 'a', 'amount': Decimal('5'), 'type': 'expense'},
+            {'category_id': 7, 'description': 'b', 'amount': Decimal('5'), 'type': 'expense'},
+            {'category_id': None, 'description': 'c', 'amount': Decimal('50'), 'type': 'expense'}]
+    assert matcher.apply(rows) == 1
+    assert [row['category_id'] for row in rows] == [101, 7, None]
+
+
+def test_parse_rejects_backreferences():
+    with pytest.raises(RuleError):
+        parse({'kind': 'regex', 'category_id': '1', 'pattern': r'(a)\1'})
@@ -0,0 +1,54 @@
+import pytest
+from mysql.connector.errors import PoolError
+
+import db
+
+
+class _Connection:
+    def __init__(self):
+        self.in_transaction = False
+        self.rolled_back = self.closed = False
+
+    def rollback(self):
+        self.rolled_back = True
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+
+class _Pool(db.ConnectionPool):
+    # Pool bookkeeping only; no MySQL server is involved
+    def _connect(self):
+        connection = _Connection()
+        connection._pool_created_at = connection._pool_used_at = 0.0
+        return connection
+
+
+def test_connections_are_reused_and_overflow_is_closed():
+    pool = _Pool({}, size=1, max_overflow=1, timeout=0.01, check_interval=float('inf'), recycle=float('inf'))
+    first, second = pool.acquire(), pool.acquire()
+    with pytest.raises(PoolError):
+        pool.acquire()
+    assert pool.metrics()['timeouts'] == 1
+
+    # Only `size` connections are kept: the one released while another is out is closed
+    pool.release(second)
+    first.in_transaction = True
+    pool.release(first)
+    assert second.closed and first.rolled_back and not first.closed
+    assert pool.acquire() is first
+    assert pool.metrics()['open'] == 1
+
+
+def test_a_request_checks_out_one_connection(app, client, add_category):
+    add_category('Food')
+    # Besides the test's own connection
+    checked_out = db.pool.metrics()['checked_out']
+    assert client.get('/dashboard').status_code == 200
+    assert db.pool.metrics()['checked_out'] == checked_out
+
+    with app.test_request_context():
+        assert db.get_db() is db.get_db()
+        assert db.pool.metrics()['checked_out'] == checked_out + 1
+    assert db.pool.metrics()['checked_out'] == checked_out
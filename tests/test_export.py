@@ -0,0 +1,51 @@
+import csv
+import io
+import json
+from datetime import date
+
+import pytest
+
+import export
+import partitions
+
+
+@pytest.fixture
+def rows(connection, user_id, add_category, monkeypatch):
+    # Several chunks per tier
+    monkeypatch.setattr(export, 'CHUNK_SIZE', 2)
+    food = add_category('Food')
+    cursor = connection.cursor()
+    query = ("INSERT INTO {table} (user_id, amount, type, category_id, description, transaction_date) "
+             "VALUES (%s, %s, %s, %s, %s, %s)")
+    for day in (1, 2, 3):
+        cursor.execute(query.format(table=partitions.ARCHIVE_TABLE),
+                       (user_id, '1.00', 'expense', food, f"old {day}", date(2020, 1, day)))
+    for day in (5, 4, 6):
+        cursor.execute(query.format(table='transactions'),
+                       (user_id, '2.50', 'expense', None if day == 6 else food, f"new {day}", date(2024, 1, day)))
+    connection.commit()
+    cursor.close()
+    return food
+
+
+def test_csv_exports_both_tiers_in_date_order(client, rows):
+    response = client.get('/export?format=csv')
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'] == 'attachment; filename=transactions.csv'
+    lines = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [line['description'] for line in lines] == ['old 1', 'old 2', 'old 3', 'new 4', 'new 5', 'new 6']
+    assert lines[0]['category_name'] == 'Food' and lines[-1]['category_name'] == ''
+
+
+def test_ndjson_export_applies_filters(client, rows):
+    response = client.get('/export?format=ndjson&start=2024-01-05&category=none')
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [(line['description'], line['amount']) for line in lines] == [('new 6', '2.50')]
+
+    response = client.get(f'/export?format=ndjson&end=2020-01-02&category={rows}')
+    assert len(response.get_data(as_text=True).splitlines()) == 2
+
+
+@pytest.mark.parametrize('query', ['format=xml', 'start=yesterday', 'category=food'])
+def test_bad_export_requests_are_rejected(client, query):
+    assert client.get(f'/export?{query}').status_code == 400
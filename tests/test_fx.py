@@ -0,0 +1,60 @@
+import io
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+import fx
+
+RATES = """date,currency,rate
+2024-01-01,GBP,0.8547
+2024-01-01,ZAR,20.4567
+2024-01-01,JPY,0.00123
+2024-02-01,GBP,0.9
+"""
+
+
+@pytest.fixture
+def rates(connection):
+    fx.import_rates(connection, io.StringIO(RATES), fx.rates.base)
+    return fx.rates.reload()
+
+
+def test_rates_keep_their_decimals_on_sqlite(rates):
+    assert fx.convert_amounts([Decimal('100.00')], ['GBP'], [date(2024, 1, 15)], 'ZAR') == [239344]
+    # A rate below half a cent is not rounded away
+    assert fx.convert_amounts([Decimal('1.00')], ['EUR'], [date(2024, 1, 15)], 'JPY') == [0]
+    assert fx.convert_amounts([Decimal('1.00')], ['JPY'], [date(2024, 1, 15)], 'EUR') == [81301]
+
+
+def test_the_rate_on_or_before_each_date_is_used(rates):
+    converted = fx.convert_amounts([Decimal('9.00')] * 3, 'GBP',
+                                   [date(2023, 12, 1), date(2024, 1, 31), '2024-02-01'], 'EUR')
+    assert converted == [1053, 1053, 1000]
+
+
+def test_missing_rates_raise(rates):
+    with pytest.raises(fx.MissingRate) as raised:
+        fx.convert_amounts([Decimal('1.00')], ['USD'], [date(2024, 1, 1)], 'ZAR')
+    assert raised.value.currencies == ['USD']
+    with pytest.raises(fx.MissingRate):
+        fx.require_rates('USD')
+    fx.require_rates('GBP')
+
+
+def test_an_import_reaches_other_processes_through_the_version(connection, rates):
+    other = fx.Rates(fx.rates.pool, fx.rates.base, check_interval=0)
+    assert other.table().version == rates.version
+    fx.import_rates(connection, io.StringIO("date,currency,rate\n2024-03-01,GBP,0.85\n"), fx.rates.base)
+    assert other.table().version == rates.version + 1
+
+
+def test_convert_totals_swaps_foreign_amounts(rates):
+    rows = [{'category_id': 1, 'category_name': 'Food', 'income': Decimal('0'), 'expenses': Decimal('110.00')}]
+    foreign = [{'category_id': 1, 'currency': 'GBP', 'transaction_date': date(2024, 1, 2), 'type': 'expense',
+                'amount': Decimal('100.00')},
+               {'category_id': 2, 'currency': 'GBP', 'transaction_date': date(2024, 1, 2), 'type': 'expense',
+                'amount': Decimal('5.00')}]
+    converted = fx.convert_totals(rows, foreign, 'ZAR')
+    # Category 2 has no rollup row to swap the amount out of, so it is left alone
+    assert converted == [dict(rows[0], expenses=Decimal('10.00') + Decimal('2393.44'))]
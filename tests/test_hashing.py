@@ -0,0 +1,35 @@
+import threading
+
+import pytest
+
+import hashing
+
+
+@pytest.fixture
+def hasher():
+    hasher = hashing.PasswordHasher(rounds=4, workers=1, max_queue=0, timeout=0.05)
+    yield hasher
+    hasher.shutdown()
+
+
+def test_hashes_check(hasher):
+    pw_hash = hasher.generate('secret')
+    assert hasher.check(pw_hash, 'secret')
+    assert not hasher.check(pw_hash, 'wrong')
+    assert not hasher.check('not a hash', 'secret')
+
+
+def test_a_timed_out_hash_keeps_its_slot_until_it_finishes(hasher):
+    release = threading.Event()
+    with pytest.raises(hashing.HasherBusy, match='timed out'):
+        hasher._run(release.wait)
+    # Still running: the pool's one slot isn't free yet
+    with pytest.raises(hashing.HasherBusy, match='saturated'):
+        hasher.check('not a hash', 'secret')
+    assert hasher.metrics()['in_flight'] == 1
+
+    release.set()
+    hasher._executor.submit(lambda: None).result()
+    assert not hasher.check('not a hash', 'secret')
+    metrics = hasher.metrics()
+    assert (metrics['in_flight'], metrics['timed_out'], metrics['rejected']) == (0, 1, 1)
@@ -0,0 +1,85 @@
+import io
+
+import importer
+import summary
+
+CSV_HEADER = "date,description,amount\n"
+
+OFX = """OFXHEADER:100
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><CURDEF>ZAR
+<BANKACCTFROM><ACCTID>12345</BANKACCTFROM>
+<BANKTRANLIST>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240105<TRNAMT>-3.50<FITID>A1<NAME>COFFEE</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240105<TRNAMT>-3.50<FITID>A2<NAME>COFFEE</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+
+def _import(connection, user_id, text, fmt='csv', **kwargs):
+    return importer.import_statement(connection, user_id, io.StringIO(text), fmt, **kwargs)
+
+
+def _count(connection, user_id):
+    cursor = connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM transactions WHERE user_id = %s", (user_id,))
+    count = cursor.fetchone()[0]
+    cursor.close()
+    return count
+
+
+def test_identical_rows_in_one_file_are_all_imported(connection, user_id):
+    report = _import(connection, user_id, CSV_HEADER + "2024-01-05,COFFEE,-3.50\n" * 2)
+    assert (report.inserted, report.duplicates) == (2, 0)
+    assert _count(connection, user_id) == 2
+
+
+def test_reimport_skips_only_as_many_rows_as_are_stored(connection, user_id):
+    _import(connection, user_id, CSV_HEADER + "2024-01-05,COFFEE,-3.50\n" * 2)
+
+    report = _import(connection, user_id, CSV_HEADER + "2024-01-05,COFFEE,-3.50\n" * 2)
+    assert (report.inserted, report.duplicates) == (0, 2)
+
+    report = _import(connection, user_id, CSV_HEADER + "2024-01-05,COFFEE,-3.50\n" * 3 + "2024-01-06,TEA,-2\n")
+    assert (report.inserted, report.duplicates) == (2, 2)
+    assert _count(connection, user_id) == 4
+
+
+def test_repeats_across_batches_are_not_duplicates(connection, user_id):
+    _import(connection, user_id, CSV_HEADER + "2024-01-05,COFFEE,-3.50\n")
+    report = _import(connection, user_id, CSV_HEADER + "2024-01-05,COFFEE,-3.50\n" * 5, batch_size=2)
+    assert (report.inserted, report.duplicates) == (4, 1)
+    assert _count(connection, user_id) == 5
+
+
+def test_ofx_rows_dedupe_on_fitid(connection, user_id):
+    report = _import(connection, user_id, OFX, 'ofx')
+    assert (report.inserted, report.duplicates) == (2, 0)
+    report = _import(connection, user_id, OFX, 'ofx')
+    assert (report.inserted, report.duplicates) == (0, 2)
+
+    cursor = connection.cursor()
+    cursor.execute("SELECT external_id FROM transactions WHERE user_id = %s ORDER BY external_id", (user_id,))
+    assert [row[0] for row in cursor.fetchall()] == ['12345:A1', '12345:A2']
+    cursor.close()
+
+
+def test_imports_keep_the_rollup_in_step(connection, user_id):
+    _import(connection, user_id, CSV_HEADER + "2024-01-05,COFFEE,-3.50\n2024-02-01,SALARY,1000\n")
+    _import(connection, user_id, CSV_HEADER + "2024-01-05,COFFEE,-3.50\n" * 2)
+    cursor = connection.cursor(buffered=True)
+    assert summary.verify(cursor, user_id) == []
+    cursor.close()
+
+
+def test_bad_rows_are_reported_and_skipped(connection, user_id):
+    report = _import(connection, user_id, CSV_HEADER + "not a date,COFFEE,-3.50\n2024-01-05,,-1\n2024-01-05,OK,-1\n")
+    assert report.inserted == 1
+    assert [error['line'] for error in report.errors] == [2, 3]
+
+
+def test_out_of_range_amounts_are_rejected_rows(connection, user_id):
+    report = _import(connection, user_id, CSV_HEADER + "2024-01-05,HOUSE,-123456789.00\n2024-01-05,NAN,NaN\n"
+                                                      "2024-01-05,OK,-99999999.99\n")
+    assert report.inserted == 1
+    assert [error['line'] for error in report.errors] == [2, 3]
+    assert _count(connection, user_id) == 1
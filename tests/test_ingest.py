@@ -0,0 +1,79 @@
+import io
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+import db
+import fx
+import ingest
+import summary
+
+ZERO = (Decimal('0'), Decimal('0'), {})
+RATES = "date,currency,rate\n2024-01-01,GBP,0.8547\n2024-01-01,ZAR,20.4567\n"
+
+
+@pytest.fixture
+def queue(app, tmp_path, monkeypatch):
+    """A queue-mode journal whose writer only runs when a test drains it."""
+    queue = ingest.IngestQueue(db.pool, ingest.Journal(str(tmp_path / 'journal.sqlite3')))
+    monkeypatch.setattr(ingest, 'queue', queue)
+    return queue
+
+
+def _enqueue(queue, user_id, amount, transaction_type='expense', category_id=None, currency=None,
+             transaction_date=date(2024, 1, 5)):
+    category_ids = {category_id} if category_id else set()
+    queue.enqueue(user_id, amount, transaction_type, category_id, 'Queued', transaction_date, category_ids, currency)
+
+
+def _unwritten(connection, user_id):
+    cursor = connection.cursor(dictionary=True, buffered=True)
+    entries = ingest.unwritten(cursor, user_id)
+    cursor.close()
+    return entries
+
+
+def test_pending_entries_lead_the_first_page_and_count_in_totals(queue, connection, user_id, add_category):
+    food = add_category('Food')
+    _enqueue(queue, user_id, '12.50', category_id=food)
+    _enqueue(queue, user_id, '100', 'income', transaction_date=date(2024, 1, 1))
+    written = [{'transaction_id': 1, 'transaction_date': date(2024, 1, 3), 'ingest_id': None}]
+    categories = [{'category_id': food, 'name': 'Food'}]
+
+    transactions, totals = ingest.merge_pending(_unwritten(connection, user_id), written, ZERO, categories,
+                                                first_page=True)
+    assert [row['transaction_id'] for row in transactions] == [None, 1, None]
+    assert transactions[0]['category_name'] == 'Food' and transactions[0]['pending']
+    assert totals == (Decimal('100.00'), Decimal('12.50'), {'Food': Decimal('12.50')})
+
+    # Later pages still count them, but don't list them
+    transactions, totals = ingest.merge_pending(_unwritten(connection, user_id), written, ZERO, categories,
+                                                first_page=False)
+    assert transactions == written
+    assert totals[1] == Decimal('12.50')
+
+
+def test_written_entries_are_not_merged_twice(queue, connection, user_id):
+    _enqueue(queue, user_id, '7')
+    assert queue.drain_once() == 1
+    assert _unwritten(connection, user_id) == []
+    cursor = connection.cursor(buffered=True)
+    assert summary.verify(cursor, user_id) == []
+    cursor.close()
+
+
+def test_pending_entries_are_converted(queue, connection, user_id):
+    fx.import_rates(connection, io.StringIO(RATES), fx.rates.base)
+    fx.rates.reload()
+    _enqueue(queue, user_id, '100', currency='GBP')
+    _, totals = ingest.merge_pending(_unwritten(connection, user_id), [], ZERO, [], first_page=True,
+                                     currency='ZAR')
+    assert totals[1] == Decimal('2393.44')
+
+
+def test_dashboard_shows_pending_entries_without_rates(queue, client, user_id):
+    _enqueue(queue, user_id, '5', currency='XYZ')
+    response = client.get('/dashboard')
+    assert response.status_code == 200
+    assert b'No exchange rates for XYZ.' in response.data
@@ -0,0 +1,30 @@
+from flask import Flask
+
+import db
+import instrumentation
+
+
+def test_server_timing_is_off_by_default(client, add_category):
+    add_category('Food')
+    response = client.get('/dashboard')
+    assert response.status_code == 200
+    assert 'Server-Timing' not in response.headers
+
+
+def test_server_timing_names_the_slowest_queries_when_enabled(app):
+    profiled = Flask(__name__)
+    profiled.config['SERVER_TIMING'] = True
+    instrumentation.init_app(profiled, db.pool)
+
+    @profiled.route('/query')
+    def query():
+        with db.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT COUNT(*) FROM users WHERE user_id > %s", (0,))
+            cursor.fetchall()
+            cursor.close()
+        return 'ok'
+
+    timing = profiled.test_client().get('/query').headers['Server-Timing']
+    assert timing.startswith('db;dur=') and '"1 queries"' in timing
+    assert 'q1;dur=' in timing
@@ -0,0 +1,104 @@
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+import ledger
+import summary
+from pagination import decode_cursor
+from repositories import get_repos
+
+
+@pytest.fixture
+def rows(connection, user_id, add_category):
+    """Seventy transactions over a few weeks, several on most days, in random insert order."""
+    categories = [None, add_category('Food'), add_category('Rent')]
+    rng = random.Random(3)
+    days = [date(2024, 1, 1) + timedelta(days=rng.randint(0, 20)) for _ in range(70)]
+    cursor = connection.cursor()
+    inserted = []
+    for day in days:
+        row = {'amount': Decimal(rng.randint(100, 9999)) / 100, 'type': rng.choice(('income', 'expense')),
+               'category_id': rng.choice(categories), 'description': f"row {len(inserted)}", 'transaction_date': day}
+        cursor.execute("INSERT INTO transactions (user_id, amount, type, category_id, description, transaction_date) "
+                       "VALUES (%s, %s, %s, %s, %s, %s)",
+                       (user_id, row['amount'], row['type'], row['category_id'], row['description'], day))
+        inserted.append(dict(row, transaction_id=cursor.lastrowid))
+    summary.record_many(cursor, user_id, inserted)
+    connection.commit()
+    cursor.close()
+    return inserted
+
+
+def _load(connection, user_id):
+    cursor = connection.cursor()
+    book = ledger.load(cursor, user_id, 0)
+    cursor.close()
+    return book
+
+
+def _ids(page):
+    return [row['transaction_id'] for row in page[0]]
+
+
+def test_pages_match_the_database(app, connection, user_id, rows):
+    book = _load(connection, user_id)
+    assert len(book) == len(rows)
+    with app.app_context():
+        repos = get_repos()
+        before = after = None
+        pages = 0
+        # Walk back to the oldest page, then forward again to the newest
+        for direction in ('next', 'prev'):
+            while True:
+                expected = repos.transactions.page(user_id, '', before, after, 8)
+                actual = book.page(before, after, 8, {})
+                assert _ids(actual) == _ids(expected)
+                assert actual[1:] == expected[1:]
+                pages += 1
+                token = expected[1] if direction == 'next' else expected[2]
+                if token is None:
+                    break
+                before, after = (decode_cursor(token), None) if direction == 'next' else (None, decode_cursor(token))
+            if direction == 'next':
+                before, after = None, decode_cursor(expected[2])
+    # Every page both ways
+    assert pages == 2 * (len(rows) // 8 + 1) - 1
+
+
+def test_archived_rows_are_not_paged(user_id):
+    load_rows = [(transaction_id, 19723 + transaction_id, 0, 0, 100, 'x', 'ZAR', transaction_id % 2)
+                 for transaction_id in range(1, 11)]
+    book = ledger.UserLedger.from_rows(user_id, 0, load_rows)
+    page = book.page(None, None, 3, {})
+    assert _ids(page) == [10, 8, 6]
+    assert book.page(decode_cursor(page[1]), None, 3, {})[0][-1]['transaction_id'] == 2
+    # Archived rows still count towards the totals
+    assert book.totals({})[1] == Decimal('10.00')
+
+
+def test_add_and_remove_keep_totals_with_the_rollup(connection, user_id, rows):
+    book = _load(connection, user_id)
+    cursor = connection.cursor(dictionary=True, buffered=True)
+    cursor.execute("SELECT category_id, name FROM categories WHERE user_id = %s", (user_id,))
+    names = {row['category_id']: row['name'] for row in cursor.fetchall()}
+
+    removed = rows[10]
+    assert book.remove(removed['transaction_id'], removed['transaction_date'])
+    assert not book.remove(removed['transaction_id'], removed['transaction_date'])
+    cursor.execute("DELETE FROM transactions WHERE transaction_id = %s", (removed['transaction_id'],))
+    summary.record_change(cursor, user_id, old=removed)
+
+    added = dict(rows[0], transaction_id=rows[-1]['transaction_id'] + 1000, amount=Decimal('12.34'))
+    book.add(added)
+    cursor.execute("INSERT INTO transactions (transaction_id, user_id, amount, type, category_id, description, "
+                   "transaction_date) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                   (added['transaction_id'], user_id, added['amount'], added['type'], added['category_id'],
+                    added['description'], added['transaction_date']))
+    summary.record_change(cursor, user_id, new=added)
+    connection.commit()
+
+    assert book.totals(names) == summary.read_totals(cursor, user_id)
+    assert _ids(book.page(None, None, 200, names)) == _ids(_load(connection, user_id).page(None, None, 200, names))
+    cursor.close()
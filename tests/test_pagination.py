@@ -0,0 +1,47 @@
+from datetime import date
+
+import pytest
+
+from pagination import MAX_PAGE_SIZE, decode_cursor, encode_cursor, page_size
+from repositories import get_repos
+
+
+def test_cursors_round_trip():
+    assert decode_cursor(encode_cursor(date(2024, 1, 5), 42)) == (date(2024, 1, 5), 42)
+
+
+@pytest.mark.parametrize('token', [None, '', 'x', '!!!', encode_cursor(date(2024, 1, 5), 1)[:-2]])
+def test_malformed_cursors_are_ignored(token):
+    assert decode_cursor(token) is None
+
+
+@pytest.mark.parametrize('value, size', [(None, 50), ('abc', 50), ('0', 1), ('25', 25), ('100000', MAX_PAGE_SIZE)])
+def test_page_size_is_bounded(value, size):
+    assert page_size(value) == size
+
+
+def test_pages_walk_rows_sharing_a_date(app, connection, user_id):
+    cursor = connection.cursor()
+    for day in (3, 3, 3, 2, 2, 1, 1):
+        cursor.execute("INSERT INTO transactions (user_id, amount, type, description, transaction_date) "
+                       "VALUES (%s, %s, %s, %s, %s)", (user_id, '1.00', 'expense', 'row', date(2024, 1, day)))
+    connection.commit()
+    cursor.close()
+
+    with app.app_context():
+        repos = get_repos()
+        pages = []
+        before = None
+        while True:
+            rows, next_cursor, prev_cursor = repos.transactions.page(user_id, '', before, None, 3)
+            pages.append([(row['transaction_date'].day, row['transaction_id']) for row in rows])
+            if next_cursor is None:
+                break
+            before = decode_cursor(next_cursor)
+        seen = [key for page in pages for key in page]
+        assert [len(page) for page in pages] == [3, 3, 1]
+        assert seen == sorted(seen, reverse=True) and len(set(seen)) == 7
+
+        # Back from the last page to the one before it
+        rows, _, _ = repos.transactions.page(user_id, '', None, decode_cursor(prev_cursor), 3)
+        assert [(row['transaction_date'].day, row['transaction_id']) for row in rows] == pages[1]
@@ -0,0 +1,60 @@
+import pytest
+
+import db
+import search
+from repositories import get_repos
+
+
+@pytest.fixture
+def other_user(connection):
+    cursor = connection.cursor()
+    cursor.execute("INSERT INTO users (username, password) VALUES (%s, %s)", ('search other', 'x'))
+    connection.commit()
+    user_id = cursor.lastrowid
+    cursor.close()
+    return user_id
+
+
+def _add(connection, user_id, description):
+    cursor = connection.cursor()
+    cursor.execute("INSERT INTO transactions (user_id, amount, type, description, transaction_date) "
+                   "VALUES (%s, %s, %s, %s, %s)", (user_id, '1.00', 'expense', description, '2024-01-05'))
+    connection.commit()
+    cursor.close()
+
+
+def _search(app, user_id, query):
+    with app.app_context():
+        rows = get_repos().transactions.page(user_id, query, None, None, 20)[0]
+    return sorted(row['description'] for row in rows)
+
+
+def test_search_only_finds_the_users_own_rows(app, connection, user_id, other_user):
+    _add(connection, user_id, 'Coffee beans')
+    _add(connection, user_id, 'Rent')
+    _add(connection, other_user, 'Coffee machine')
+    assert _search(app, user_id, 'coff') == ['Coffee beans']
+    assert _search(app, other_user, 'coffee') == ['Coffee machine']
+    # The owner token is indexed too, but isn't something a search can match
+    assert _search(app, user_id, search.owner_token(user_id)) == []
+
+
+def test_search_follows_description_updates(app, connection, user_id):
+    _add(connection, user_id, 'Groceries')
+    cursor = connection.cursor()
+    cursor.execute("UPDATE transactions SET description = %s WHERE user_id = %s", ('Takeaway', user_id))
+    connection.commit()
+    cursor.close()
+    assert _search(app, user_id, 'groceries') == []
+    assert _search(app, user_id, 'take') == ['Takeaway']
+
+
+def test_mysql_matches_require_the_owner_token(monkeypatch):
+    monkeypatch.setattr(db, 'dialect', 'mysql')
+    clause, params = search.search_clause('coffee beans', 42)
+    assert 'MATCH(document)' in clause
+    assert params == ['+owner42 +coffee* +beans*', 42, 42, '+coffee* +beans*']
+    # Words too short for the index, or prefixes of the owner token, scan with LIKE instead
+    for query in ('tv', 'own'):
+        clause, params = search.search_clause(query, 42)
+        assert 'LIKE' in clause and params == [f"%{query}%"] * 2
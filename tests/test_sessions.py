@@ -0,0 +1,29 @@
+import pytest
+
+import sessions
+
+
+def test_pages_dont_rewrite_the_session_without_a_coherent_cache(client, add_category):
+    add_category('Food')
+    assert client.get('/dashboard').status_code == 200
+    writes = sessions.interface.metrics()['writes']
+    for _ in range(3):
+        assert client.get('/dashboard').status_code == 200
+    assert sessions.interface.metrics()['writes'] == writes
+
+
+def test_file_store_keeps_sessions_as_json(tmp_path):
+    store = sessions.FileStore(str(tmp_path / 'sessions'))
+    data = {'user_id': 1, 'categories': [{'category_id': 2, 'name': 'Food'}], '_flashes': [('success', 'Saved')]}
+    store.set('abc', data)
+    with open(tmp_path / 'sessions' / 'abc', encoding='utf-8') as file:
+        assert 'Food' in file.read()
+    assert store.get('abc') == data
+
+
+def test_file_store_refuses_a_directory_others_can_reach(tmp_path):
+    directory = tmp_path / 'shared'
+    directory.mkdir(mode=0o777)
+    directory.chmod(0o777)
+    with pytest.raises(RuntimeError):
+        sessions.FileStore(str(directory))
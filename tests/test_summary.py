@@ -0,0 +1,91 @@
+from datetime import date
+from decimal import Decimal
+
+import summary
+from repositories import get_repos
+
+
+def _insert(cursor, user_id, amount, transaction_type, category_id, transaction_date):
+    cursor.execute("INSERT INTO transactions (user_id, amount, type, category_id, description, transaction_date) "
+                   "VALUES (%s, %s, %s, %s, %s, %s)",
+                   (user_id, amount, transaction_type, category_id, 'row', transaction_date))
+    return {'transaction_id': cursor.lastrowid, 'amount': Decimal(amount), 'type': transaction_type,
+            'category_id': category_id, 'transaction_date': transaction_date}
+
+
+def _rollup(cursor, user_id):
+    cursor.execute("SELECT category_id, month, income, expenses, transaction_count "
+                   "FROM user_category_month_summary WHERE user_id = %s ORDER BY category_id, month", (user_id,))
+    return cursor.fetchall()
+
+
+def test_deltas_fold_per_key(connection, user_id, add_category):
+    food = add_category('Food')
+    cursor = connection.cursor(buffered=True)
+    rows = [_insert(cursor, user_id, '10.00', 'expense', food, date(2024, 1, 5)),
+            _insert(cursor, user_id, '2.50', 'expense', food, date(2024, 1, 20)),
+            _insert(cursor, user_id, '100.00', 'income', None, date(2024, 2, 1))]
+    summary.record_many(cursor, user_id, rows)
+    connection.commit()
+    assert _rollup(cursor, user_id) == [
+        (summary.UNCATEGORIZED, date(2024, 2, 1), Decimal('100.00'), Decimal('0.00'), 1),
+        (food, date(2024, 1, 1), Decimal('0.00'), Decimal('12.50'), 2),
+    ]
+    assert summary.verify(cursor, user_id) == []
+    cursor.close()
+
+
+def test_changes_keep_the_rollup_in_step(connection, user_id, add_category):
+    food, rent = add_category('Food'), add_category('Rent')
+    cursor = connection.cursor(buffered=True)
+    old = _insert(cursor, user_id, '40.00', 'expense', food, date(2024, 3, 31))
+    other = _insert(cursor, user_id, '5.00', 'expense', food, date(2024, 3, 2))
+    summary.record_many(cursor, user_id, [old, other])
+
+    # Moved to another category and month
+    new = dict(old, category_id=rent, transaction_date=date(2024, 4, 1), amount=Decimal('45.00'))
+    cursor.execute("UPDATE transactions SET category_id = %s, transaction_date = %s, amount = %s "
+                   "WHERE transaction_id = %s", (rent, new['transaction_date'], new['amount'], old['transaction_id']))
+    summary.record_change(cursor, user_id, old=old, new=new)
+    assert summary.verify(cursor, user_id) == []
+
+    # Deleting the last row of a key removes the key
+    cursor.execute("DELETE FROM transactions WHERE transaction_id = %s", (new['transaction_id'],))
+    summary.record_changes(cursor, user_id, old_rows=[new])
+    connection.commit()
+    assert summary.verify(cursor, user_id) == []
+    assert [row[0] for row in _rollup(cursor, user_id)] == [food]
+    cursor.close()
+
+
+def test_rebuild_matches_verify(connection, user_id):
+    cursor = connection.cursor(buffered=True)
+    _insert(cursor, user_id, '7.00', 'expense', None, date(2023, 12, 31))
+    assert summary.verify(cursor, user_id)
+    summary.rebuild(cursor, user_id)
+    connection.commit()
+    assert summary.verify(cursor, user_id) == []
+    cursor.close()
+
+
+def test_fold_totals_sums_categories_sharing_a_name():
+    rows = [{'category_name': 'Food', 'income': None, 'expenses': Decimal('3')},
+            {'category_name': 'Food', 'income': Decimal('0'), 'expenses': Decimal('4')},
+            {'category_name': None, 'income': Decimal('10'), 'expenses': Decimal('1')}]
+    assert summary.fold_totals(rows) == (Decimal('10'), Decimal('8'), {'Food': Decimal('7')})
+
+
+def test_totals_add_up_the_transactions(app, connection, user_id, add_category):
+    food, rent = add_category('Food'), add_category('Rent')
+    cursor = connection.cursor(buffered=True)
+    rows = [_insert(cursor, user_id, '10.00', 'expense', food, date(2024, 1, 5)),
+            _insert(cursor, user_id, '2.25', 'expense', food, date(2024, 2, 5)),
+            _insert(cursor, user_id, '500.00', 'expense', rent, date(2024, 2, 1)),
+            _insert(cursor, user_id, '1.00', 'expense', None, date(2024, 2, 1)),
+            _insert(cursor, user_id, '900.00', 'income', rent, date(2024, 1, 1))]
+    summary.record_many(cursor, user_id, rows)
+    connection.commit()
+    cursor.close()
+    with app.app_context():
+        totals = get_repos().transactions.totals(user_id)
+    assert totals == (Decimal('900.00'), Decimal('513.25'), {'Food': Decimal('12.25'), 'Rent': Decimal('500.00')})
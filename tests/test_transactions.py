@@ -0,0 +1,54 @@
+from datetime import date
+
+import summary
+
+
+def _form(**fields):
+    form = {'amount': '12.50', 'type': 'expense', 'description': 'Lunch', 'transaction_date': '2024-01-05',
+            'category_id': ''}
+    form.update(fields)
+    return form
+
+
+def _rows(connection, user_id):
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute("SELECT transaction_id, amount, transaction_date FROM transactions WHERE user_id = %s "
+                   "ORDER BY transaction_id", (user_id,))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def _verify(connection, user_id):
+    cursor = connection.cursor(buffered=True)
+    drift = summary.verify(cursor, user_id)
+    cursor.close()
+    return drift
+
+
+def test_add_transaction_stores_a_date(client, connection, user_id):
+    assert client.post('/add_transaction', data=_form(transaction_date='2024-1-5')).status_code == 302
+    assert [row['transaction_date'] for row in _rows(connection, user_id)] == [date(2024, 1, 5)]
+    assert _verify(connection, user_id) == []
+
+
+def test_invalid_dates_are_rejected_before_any_write(client, connection, user_id):
+    for value in ('2024-02-30', '05/01/2024', ''):
+        assert client.post('/add_transaction', data=_form(transaction_date=value)).status_code == 302
+    assert _rows(connection, user_id) == []
+
+    client.post('/add_transaction', data=_form())
+    transaction_id = _rows(connection, user_id)[0]['transaction_id']
+    response = client.post(f"/update_transaction/{transaction_id}", data=_form(transaction_date='2024-02-30'))
+    assert response.status_code == 302
+    assert _rows(connection, user_id)[0]['transaction_date'] == date(2024, 1, 5)
+    assert _verify(connection, user_id) == []
+    assert client.get('/dashboard').status_code == 200
+
+
+def test_update_transaction_moves_the_rollup(client, connection, user_id):
+    client.post('/add_transaction', data=_form())
+    transaction_id = _rows(connection, user_id)[0]['transaction_id']
+    client.post(f"/update_transaction/{transaction_id}", data=_form(transaction_date='2024-03-09', amount='20'))
+    assert _rows(connection, user_id)[0]['transaction_date'] == date(2024, 3, 9)
+    assert _verify(connection, user_id) == []